@@ -15,19 +15,73 @@ IMAGE_HEIGHT = 563
 USE_PYRE_NETWORKING = True
 # the ip addresses of all connecting computers in local network (only used if not USE_PYRE_NETWORKING)
 NETWORK_IPS = ["localhost"]
+# find the other computers by UDP beacons announcing their publishers instead of connecting to all NETWORK_IPS
+# (only used if not USE_PYRE_NETWORKING)
+USE_BEACON_DISCOVERY = False
+BEACON_PORT = 5020
+# the address the beacons are sent to ("127.255.255.255" for testing on one computer, a unicast address like
+# "127.0.0.1" reaches only one of the instances sharing the beacon port)
+BEACON_ADDRESS = "255.255.255.255"
+BEACON_INTERVAL = 1  # in seconds
+# send the gazes to a relay hub (python -m messaging.relay_hub) which broadcasts one snapshot of all gazes each tick
+# instead of exchanging them between all computers (for large rooms, only used if not USE_PYRE_NETWORKING)
+USE_RELAY_HUB = False
+RELAY_HUB_IP = "localhost"
+RELAY_HUB_PULL_PORT = 5030
+RELAY_HUB_PUB_PORT = 5031
+RELAY_HUB_TICK = 0.1  # the interval between two snapshots in seconds
+RELAY_HUB_PEER_TIMEOUT = 10  # the time in seconds after which a computer without new gazes is left out
+RELAY_HUB_KEEP_ALIVE_INTERVAL = 2  # the time in seconds after which an unchanged snapshot is broadcast again
+# run the PUB/SUB gaze exchange (and the eye tracker surface stream) on a single asyncio event loop instead of
+# several threads (only used if not USE_PYRE_NETWORKING and not USE_RELAY_HUB)
+USE_ASYNC_RUNTIME = False
+# send every gaze as one UDP multicast datagram to all computers in the local network without connecting to them
+# (only used if not USE_PYRE_NETWORKING, not USE_RELAY_HUB and not USE_ASYNC_RUNTIME)
+USE_MULTICAST = False
+MULTICAST_GROUP = "239.255.42.99"
+MULTICAST_PORT = 5040
+MULTICAST_INTERFACE = "0.0.0.0"  # the ip of the network interface ("127.0.0.1" for testing on one computer)
+MULTICAST_TTL = 1  # the number of hops the datagrams pass (1 to stay in the local network)
+# the time in seconds after which the gaze of a player who did not send a new one is not shown anymore
+GAZE_POSITION_TTL = 10
+GAZE_POSITION_FADE_TIME = 2  # the time in seconds before the TTL in which the gaze fades out (0 for no fading)
+# the interval in seconds in which the clock offsets to the other computers are measured for the latency statistics
+CLOCK_SYNC_INTERVAL = 5
+# send the gazes as fixed-layout binary messages (text messages "id:x,y" are still understood when receiving)
+USE_BINARY_GAZE_MESSAGES = True
+# append all own and received gazes to this session log (None for not recording)
+SESSION_RECORDING_PATH = None
+# replay this session log (see messaging/session_recording.py) instead of exchanging the gazes (None for not replaying)
+SESSION_REPLAY_PATH = None
+SESSION_REPLAY_SPEED = 1  # the factor the replay is sped up with (0 for as fast as possible)
 
 # eyetracking
 EYE_TRACKING_IP = "localhost"  # usually connected to PC via usb
 EYE_TRACKING_PORT = 50020
 EYE_TRACKING_MARKERS = [11, 13, 15, 17, 19, 21, 23, 25]  # the shown surface markers
 EYE_TRACKING_SURFACE_NAME = "WAYL_Screen"
+# start a simulator of Pupil Capture (eye_tracking/pupil_capture_simulator.py) instead of the real one to test without
+# the eye tracker (only used if not TURN_OFF_EYE_TRACKING)
+SIMULATE_EYE_TRACKER = False
 
 # general
 SCREEN_UPDATE_INTERVAL = 1  # the time after which the screen is updated in seconds
 SEND_INTERVAL = 0.5  # the time after which the current position is send to the other players
+# send policy (positions in relative screen coordinates, times in seconds):
+SEND_POLL_INTERVAL = 0.05  # the time after which the current position is checked for being sent
+SEND_DEAD_BAND = 0.01  # movements smaller than this are not sent (except as keep-alive)
+SEND_JUMP_DISTANCE = 0.1  # movements larger than this are sent immediately instead of after SEND_INTERVAL
+SEND_MIN_INTERVAL = 0.05  # the minimal time between two sends, also for jumps
+SEND_KEEP_ALIVE_INTERVAL = 2  # the time after which the position is sent again even if it did not change
 
 # Fixations
 FIXATION_OVERLAY_SIGMA = 120  # in pixel
+# the overlay is calculated on a grid downsampled by this factor (1, 2, 4 or 8) and upsampled afterwards
+# (see fixation_layering/benchmark.py for the error and throughput per factor)
+FIXATION_OVERLAY_DOWNSAMPLING = 1
+# the number of threads rendering horizontal tiles of the filtered image in parallel (1 for rendering incrementally
+# on the main thread)
+RENDER_WORKERS = 1
 
 # testing
 TURN_OFF_EYE_TRACKING = True
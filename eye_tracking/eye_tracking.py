@@ -1,11 +1,63 @@
 import sys
+import time
 from threading import Thread
 
 import msgpack
-import zmq
 
 from helper import current_time_string
-from messaging.zmq_classes import Subscriber
+from messaging.zmq_classes import Subscriber, get_requester_pool
+
+# the limits of the decoded surface data, larger data is rejected instead of being allocated
+SURFACE_DATUM_LIMITS = {"max_str_len": 256, "max_bin_len": 256, "max_array_len": 1024, "max_map_len": 64,
+                        "max_ext_len": 0}
+MIN_GAZE_CONFIDENCE = 0.5  # gazes with a lower confidence are not used
+
+
+def decode_surface_datum(message):
+    """
+    Decodes a surface datum within SURFACE_DATUM_LIMITS
+    Args:
+        message(bytes): the msgpack encoded datum
+    Returns: (dict|None) the datum or None if it could not be decoded
+    """
+    try:
+        datum = msgpack.unpackb(message, raw=False, **SURFACE_DATUM_LIMITS)
+    except ValueError as e:
+        print("Wrong surface datum received: {}".format(e))
+        return None
+    return datum if isinstance(datum, dict) else None
+
+
+def find_best_gaze_on_surface(datum):
+    """
+    Finds the gaze on the surface with the highest confidence in one pass, malformed gazes are skipped
+    Args:
+        datum(dict): the surface datum
+    Returns: (tuple(tuple(float, float), float)|None) the normalized position and the confidence of the gaze or None
+    if no valid gaze is on the surface
+    """
+    gazes = datum.get("gaze_on_srf")
+    if not isinstance(gazes, list):
+        return None
+    best_gaze = None
+    for gaze in gazes:
+        if not isinstance(gaze, dict) or not gaze.get("on_srf"):
+            continue
+        confidence = gaze.get("confidence")
+        norm_pos = gaze.get("norm_pos")
+        if not is_number(confidence) or not isinstance(norm_pos, (list, tuple)) or len(norm_pos) != 2 \
+                or not all(is_number(coordinate) for coordinate in norm_pos):
+            continue
+        if best_gaze is None or confidence > best_gaze[1]:
+            best_gaze = (norm_pos[0], norm_pos[1]), confidence
+    return best_gaze
+
+
+def is_number(value):
+    """
+    Returns: (bool) True if the value is an int or a float (but no bool)
+    """
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
 
 
 class SurfaceGazeStream:
@@ -22,16 +74,21 @@ class SurfaceGazeStream:
         """
         self.name = stream_name
         self.stopped = False
-        # self.subscriber = zmq.Context().socket(zmq.SUB)
-        self.subscriber = Subscriber(ip, sub_port, ["logging.error", "logging.warning", "gaze",
-                                                    "surfaces.{}".format(surface_name)])
+        # only the surface data is needed, the gazes are contained in it
+        surface_topic = "surfaces.{}".format(surface_name)
+        self.subscriber = Subscriber(ip, sub_port, ["logging.error", "logging.warning", surface_topic],
+                                     [surface_topic])  # decoded by decode_surface_datum
         self.ip = ip
         self.port = port
         self.sub_port = sub_port
         self.surface_gaze_datum = None
+        self.surface_gaze = None  # the best gaze on the surface of the latest datum (see find_best_gaze_on_surface)
+        self.surface_gaze_time = None  # the time the latest surface gaze datum was received
+        self.received_surface_data = 0
         self.frame = None
         self.started_plugin = False
         self.verbose = verbose
+        self.recorder = None  # the SessionRecorder (see messaging.session_recording) recording the own gazes
 
     def start(self):
         """
@@ -54,16 +111,32 @@ class SurfaceGazeStream:
             if self.stopped:
                 return
             topic, message = self.subscriber.recv()
-            if topic.startswith("gaze"):
-                if self.verbose:
-                    print("GazeStream-gaze: {}".format(message))
-            elif topic.startswith("surfaces"):
-                if self.verbose:
-                    print("GazeStream-surfaces: {}".format(message))
-                self.surface_gaze_datum = message
-            else:
-                if self.verbose:
-                    print("GazeStream-{}:  {}".format(topic, message["msg".encode()]))
+            self.save_message(topic, message)
+
+    def save_message(self, topic, message):
+        """
+        Saves the message and its best gaze on the surface if it is a surface gaze datum
+        Args:
+            topic(str): the topic of the message
+            message(bytes|dict): the encoded surface datum or the decoded message of the other topics
+        """
+        if topic.startswith("surfaces"):
+            datum = decode_surface_datum(message)
+            if datum is None:
+                return
+            if self.verbose:
+                print("GazeStream-surfaces: {}".format(datum))
+            self.surface_gaze = find_best_gaze_on_surface(datum)
+            self.surface_gaze_datum = datum
+            self.surface_gaze_time = time.time()
+            self.received_surface_data += 1
+            if self.recorder is not None:
+                position = self.read_position()
+                if position is not None:
+                    self.recorder.record_local_gaze(position, self.surface_gaze_time)
+        else:
+            if self.verbose:
+                print("GazeStream-{}:  {}".format(topic, message["msg"]))
 
     def read(self):
         """
@@ -73,24 +146,18 @@ class SurfaceGazeStream:
 
     def read_position(self, use_pygame_coordinates=True):
         """
-        Reads the latest gaze position from the surface gaze datum
+        Reads the latest gaze position, the best gaze on the surface is already found when the datum is received
         Args:
             use_pygame_coordinates(bool): if the coordinates should be mapped to pygame coordinate system
         Returns: (tuple(float, float)|None) the latest position or None
         """
-        if self.surface_gaze_datum is None:
-            return None
-        gazes = self.surface_gaze_datum["gaze_on_srf".encode()]
-        gazes_on_surface = [g for g in gazes if g["on_srf".encode()]]
-        gazes_on_surface = sorted(gazes_on_surface, key=lambda g: g["confidence".encode()], reverse=True)
-        if len(gazes_on_surface) == 0:
+        surface_gaze = self.surface_gaze
+        if surface_gaze is None:
             return None
-        norm_pos = gazes_on_surface[0]["norm_pos".encode()]
-        confidence = gazes_on_surface[0]["confidence".encode()]
-        if confidence < 0.5:
-            print("confidence", confidence)
+        norm_pos, confidence = surface_gaze
+        if confidence < MIN_GAZE_CONFIDENCE:
             return None
-        return tuple(norm_pos) if not use_pygame_coordinates else norm_pos[0], 1 - norm_pos[1]
+        return (norm_pos[0], norm_pos[1]) if not use_pygame_coordinates else (norm_pos[0], 1 - norm_pos[1])
 
     def stop(self):
         """
@@ -103,26 +170,22 @@ class SurfaceGazeStream:
         Starts the surface tracker plugin used to communicate with the eye tracker
         """
         if not self.started_plugin:
-            req = get_connected_requester(self.ip, self.port)
-            send_recv_notification(req, {'subject': 'start_plugin', 'name': 'Surface_Tracker',
-                                         'args': {'min_marker_perimeter': 50}})
+            send_recv_notification(get_pupil_remote(self.ip, self.port),
+                                   {'subject': 'start_plugin', 'name': 'Surface_Tracker',
+                                    'args': {'min_marker_perimeter': 50}})
             self.started_plugin = True
 
 
-def get_connected_requester(ip, port):
+def get_pupil_remote(ip, port):
     """
-    Creates a requester to send commands to pupil labs for the given ip and port
+    Returns the pool of requesters to send commands to pupil labs for the given ip and port, its sockets are reused
+    and checked with a time request ("t") if they were idle for a while
     Args:
         ip(str): the ip of the eye tracker
         port(int): the port of the eye tracker
-    Returns: (zmq.REQ socket) the requester
+    Returns: (RequesterPool) the requester pool
     """
-    ctx = zmq.Context()
-    # noinspection PyUnresolvedReferences
-    requester = ctx.socket(zmq.REQ)
-    push_url = "tcp://{}:{}".format(ip, port)
-    requester.connect(push_url)
-    return requester
+    return get_requester_pool(ip, port, health_check_request=[b"t"])
 
 
 def calibrate(ip, port, sub_port, subscriber=None, requester=None, retries=0):
@@ -133,7 +196,7 @@ def calibrate(ip, port, sub_port, subscriber=None, requester=None, retries=0):
         port(int): the port of the eye tracker
         sub_port(int): the SUB port of the eye tracker
         subscriber(Subscriber|None): a Subscriber already created for the calibration or None
-        requester(zmq.REQ socket): a requester socket to send commands
+        requester(RequesterPool|None): the requester pool to send commands or None for the one of the eye tracker
         retries(int): the number of already executed retries
     """
     def on_failed():
@@ -143,7 +206,7 @@ def calibrate(ip, port, sub_port, subscriber=None, requester=None, retries=0):
     n = {"subject": "calibration.should_start"}
     subscriber = Subscriber(ip, sub_port, ["notify.calibration"]) if subscriber is None else subscriber
     subscriber.start()
-    requester = get_connected_requester(ip, port) if requester is None else requester
+    requester = get_pupil_remote(ip, port) if requester is None else requester
     notification_feedback = send_recv_notification(requester, n)
     print(current_time_string(), "Calibration start feedback: {}".format(notification_feedback))
     started = False
@@ -173,7 +236,7 @@ def calibrate(ip, port, sub_port, subscriber=None, requester=None, retries=0):
             print("Calibration did not start correctly")
             on_failed()
         elif topic == "failed":
-            print("Calibration failed: {}".format(message["reason".encode()].decode()))
+            print("Calibration failed: {}".format(message["reason"]))
             on_failed()
         elif topic == "stopped":
             print("Finished calibration")
@@ -188,9 +251,7 @@ def get_sub_port(ip, port):
         port(int): the eye tracker port
     Returns: (int) the SUB port
     """
-    requester = get_connected_requester(ip, port)
-    requester.send_string('SUB_PORT')
-    sub_port = requester.recv_string()
+    sub_port = get_pupil_remote(ip, port).request([b"SUB_PORT"])[0].decode()
     return sub_port
 
 
@@ -198,25 +259,32 @@ def send_recv_notification(requester, notification):
     """
     Send a notification(a command e.g.) with the requester and wait for a confirmation
     Args:
-        requester(zmq.REQ socket): the requester to use
+        requester(RequesterPool): the requester pool to use
         notification(dict): a dictionary containing the notification
     Returns: (str): the feedback for the request
     """
-    requester.send_multipart(('notify.{}'.format(notification['subject']).encode(), msgpack.dumps(notification)))
-    return requester.recv()
+    return requester.request(['notify.{}'.format(notification['subject']).encode(), msgpack.dumps(notification)])[0]
 
 
-def start_gaze_stream_and_wait(ip, port, surface_name):
+def start_gaze_stream_and_wait(ip, port, surface_name, runtime=None, recorder=None):
     """
     Starts a SurfaceGazeStream and waits until it sends data
     Args:
         ip(str): the eye tracker ip
         port(int): the eye tracker port
+        surface_name(str): the name of the surface to be monitored
+        runtime(AsyncRemoteGazePositionStream|None): a started runtime receiving the data on its event loop instead
+        of a new thread
+        recorder(SessionRecorder|None): the recorder recording the gazes of the stream or None
     Returns: (SurfaceGazeStream) the created GazeStream
     """
     gaze_stream = SurfaceGazeStream(ip, port, get_sub_port(ip, port),
                                     surface_name=surface_name)
-    gaze_stream.start()
+    gaze_stream.recorder = recorder
+    if runtime is not None:
+        runtime.add_surface_stream(gaze_stream)
+    else:
+        gaze_stream.start()
     while gaze_stream.read() is None:
         pass
     return gaze_stream
@@ -0,0 +1,239 @@
+import argparse
+import multiprocessing
+import time
+from threading import Thread
+
+import msgpack
+import numpy as np
+import zmq
+
+from config import *
+from eye_tracking.eye_tracking import start_gaze_stream_and_wait
+from messaging.zmq_classes import get_context
+from mock.gaze_trajectory import GazeTrajectory
+
+SIMULATOR_RATE = 200  # the rate the surface data is published with in Hz
+SIMULATOR_GAZES_PER_DATUM = 8  # the number of gazes per surface datum (the eye cameras run faster than the world one)
+SIMULATOR_CALIBRATION_DURATION = 2  # the time in seconds from calibration.started until calibration.stopped
+# the time in seconds from calibration.should_start until calibration.started, Pupil Capture starts it asynchronously
+SIMULATOR_CALIBRATION_START_DELAY = 0.5
+SIMULATOR_OFF_SURFACE_PROBABILITY = 0.1  # the probability of a gaze not being on the surface
+
+
+class PupilCaptureSimulator:
+    def __init__(self, port=EYE_TRACKING_PORT, surface_name=EYE_TRACKING_SURFACE_NAME, rate=SIMULATOR_RATE,
+                 gazes_per_datum=SIMULATOR_GAZES_PER_DATUM, calibration_duration=SIMULATOR_CALIBRATION_DURATION,
+                 publish_gaze=True, seed=0):
+        """
+        Creates a stand-in for Pupil Capture implementing the subset of the Pupil Remote protocol used by
+        eye_tracking.eye_tracking: the requests SUB_PORT, PUB_PORT, t, T and notify.* on a zmq.REP socket and the
+        notifications, gaze and surface data as msgpack messages on a zmq.PUB socket
+        Args:
+            port(int): the port of Pupil Remote
+            surface_name(str): the name of the published surface
+            rate(float): the rate the surface data is published with in Hz
+            gazes_per_datum(int): the number of gazes per surface datum
+            calibration_duration(float): the time in seconds a calibration takes
+            publish_gaze(bool): if every gaze is published on the gaze topic as well
+            seed(int): the seed of the simulated gaze
+        """
+        self.port = port
+        self.surface_name = surface_name
+        self.rate = rate
+        self.gazes_per_datum = gazes_per_datum
+        self.calibration_duration = calibration_duration
+        self.publish_gaze = publish_gaze
+        self.rng = np.random.default_rng(seed)
+        self.trajectory = GazeTrajectory(self.rng, time.monotonic())
+        self.time_offset = 0  # the offset of the pupil time to the monotonic time, changed with the request T
+        self.calibration_start_time = None  # the time the requested calibration starts
+        self.calibration_end_time = None  # the time the running calibration stops
+        self.published_data = 0
+        self.stopped = True
+        self.thread = None
+        self.replier = None
+        self.publisher = None
+        self.pub_port = None
+
+    def start(self):
+        """
+        Binds the sockets and starts serving on a new Thread
+        Returns: (PupilCaptureSimulator) self
+        """
+        # noinspection PyUnresolvedReferences
+        self.replier = get_context().socket(zmq.REP)
+        self.replier.bind("tcp://*:{}".format(self.port))
+        # noinspection PyUnresolvedReferences
+        self.publisher = get_context().socket(zmq.PUB)
+        self.pub_port = self.publisher.bind_to_random_port("tcp://*")
+        self.stopped = False
+        self.thread = Thread(target=self.update, name="PupilCaptureSimulator", args=())
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops serving, the sockets are closed by the serving thread
+        """
+        self.stopped = True
+
+    def pupil_time(self):
+        return time.monotonic() + self.time_offset
+
+    def update(self):
+        """
+        Answers the requests and publishes a surface datum each 1 / rate seconds until stopped, all on one thread
+        as the publisher is used for both
+        """
+        next_datum_time = time.monotonic()
+        while not self.stopped:
+            timeout = max(0, int((next_datum_time - time.monotonic()) * 1000))
+            # noinspection PyUnresolvedReferences
+            if self.replier.poll(timeout, zmq.POLLIN):
+                self.reply(self.replier.recv_multipart())
+            self.update_calibration()
+            if time.monotonic() >= next_datum_time:
+                self.publish_datum()
+                next_datum_time = max(next_datum_time + 1 / self.rate, time.monotonic() - 1 / self.rate)
+        self.replier.close(linger=0)
+        self.publisher.close(linger=0)
+
+    def update_calibration(self):
+        """
+        Starts the requested and stops the running calibration when their time has come
+        """
+        if self.calibration_start_time is not None and time.monotonic() >= self.calibration_start_time:
+            self.calibration_start_time = None
+            self.calibration_end_time = time.monotonic() + self.calibration_duration
+            self.notify({"subject": "calibration.started"})
+        elif self.calibration_end_time is not None and time.monotonic() >= self.calibration_end_time:
+            self.calibration_end_time = None
+            self.notify({"subject": "calibration.stopped"})
+
+    def reply(self, request):
+        """
+        Answers a Pupil Remote request
+        Args:
+            request(list(bytes)): the frames of the request
+        """
+        command = request[0].decode()
+        if command == "SUB_PORT" or command == "PUB_PORT":
+            # the simulator has no IPC backbone, so subscribing and publishing happens on the same port
+            self.replier.send_string(str(self.pub_port))
+        elif command == "t":
+            self.replier.send_string(repr(self.pupil_time()))
+        elif command.startswith("T "):
+            self.time_offset = float(command[2:]) - time.monotonic()
+            self.replier.send_string("Timesync successful.")
+        elif command.startswith("notify.") and len(request) > 1:
+            self.replier.send_string("Notification received.")
+            self.handle_notification(msgpack.loads(request[1]))
+        else:
+            self.replier.send_string("Unknown command.")
+
+    def handle_notification(self, notification):
+        """
+        Publishes the notification and simulates its effect on the calibration
+        Args:
+            notification(dict): the notification
+        """
+        self.notify(notification)
+        subject = notification["subject"]
+        if subject == "calibration.should_start" and self.calibration_end_time is None:
+            self.calibration_start_time = time.monotonic() + SIMULATOR_CALIBRATION_START_DELAY
+        elif subject == "calibration.should_stop":
+            self.calibration_start_time = None
+            if self.calibration_end_time is not None:
+                self.calibration_end_time = None
+                self.notify({"subject": "calibration.stopped"})
+
+    def notify(self, notification):
+        self.publisher.send_multipart(("notify.{}".format(notification["subject"]).encode(),
+                                       msgpack.dumps(notification, use_bin_type=True)))
+
+    def publish_datum(self):
+        """
+        Publishes the gazes since the last datum on the gaze topic and the surface datum containing them
+        """
+        current_time = self.pupil_time()
+        gazes_on_surface = []
+        for i in range(self.gazes_per_datum):
+            gaze_time = current_time - (self.gazes_per_datum - 1 - i) / (self.rate * self.gazes_per_datum)
+            position = self.trajectory.position_at(gaze_time - self.time_offset)
+            confidence = 0.0 if position is None else float(self.rng.uniform(0.6, 1.0))
+            position = (0.5, 0.5) if position is None else position
+            gaze = {"topic": "gaze.3d.01.", "norm_pos": list(position), "confidence": confidence,
+                    "timestamp": gaze_time}
+            if self.publish_gaze:
+                self.publisher.send_multipart((b"gaze.3d.01.", msgpack.dumps(gaze, use_bin_type=True)))
+            on_surface = self.rng.random() >= SIMULATOR_OFF_SURFACE_PROBABILITY
+            gazes_on_surface.append({"topic": "gaze.3d.01._on_surface", "norm_pos": list(position),
+                                     "confidence": confidence, "on_srf": bool(on_surface),
+                                     "base_data": ("gaze.3d.01.", gaze_time), "timestamp": gaze_time})
+        datum = {"topic": "surfaces.{}".format(self.surface_name), "name": self.surface_name,
+                 "surf_to_img_trans": np.eye(3).tolist(), "img_to_surf_trans": np.eye(3).tolist(),
+                 "gaze_on_srf": gazes_on_surface, "fixations_on_srf": [], "timestamp": current_time}
+        self.publisher.send_multipart(("surfaces.{}".format(self.surface_name).encode(),
+                                       msgpack.dumps(datum, use_bin_type=True)))
+        self.published_data += 1
+
+
+def run_simulator(port, rate, gazes_per_datum, duration, results):
+    """
+    Runs a simulator for the duration and puts the number of published surface data on the results queue
+    """
+    simulator = PupilCaptureSimulator(port, rate=rate, gazes_per_datum=gazes_per_datum).start()
+    time.sleep(duration)
+    simulator.stop()
+    simulator.thread.join()
+    results.put(simulator.published_data)
+
+
+def benchmark_ingestion(port=EYE_TRACKING_PORT, rate=SIMULATOR_RATE, gazes_per_datum=SIMULATOR_GAZES_PER_DATUM,
+                        duration=10):
+    """
+    Measures how many surface data a SurfaceGazeStream ingests and the cpu it needs, the simulator runs in a
+    separate process so that only the ingestion is measured
+    Args:
+        port(int): the port of the simulated Pupil Remote
+        rate(float): the rate of the surface data in Hz
+        gazes_per_datum(int): the number of gazes per surface datum
+        duration(float): the measured time in seconds
+    Returns: (dict) the results
+    """
+    spawn_context = multiprocessing.get_context("spawn")  # the zmq context must not be forked
+    results = spawn_context.Queue()
+    simulator_process = spawn_context.Process(target=run_simulator, daemon=True,
+                                              args=(port, rate, gazes_per_datum, duration + 30, results))
+    simulator_process.start()
+    gaze_stream = start_gaze_stream_and_wait("127.0.0.1", port, EYE_TRACKING_SURFACE_NAME)
+    start_data = gaze_stream.received_surface_data
+    cpu_start = time.process_time()
+    time.sleep(duration)
+    cpu_time = time.process_time() - cpu_start
+    received_data = gaze_stream.received_surface_data - start_data
+    gaze_stream.stop()
+    simulator_process.terminate()
+    return {"rate": rate, "gazes_per_datum": gazes_per_datum, "duration": duration, "received": received_data,
+            "throughput": received_data / duration, "cpu": cpu_time / duration}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Simulates Pupil Capture with a surface for testing without "
+                                                 "the eye tracker")
+    parser.add_argument("mode", type=str, choices=["serve", "benchmark"], nargs="?", default="serve",
+                        help="serve until interrupted or benchmark the ingestion of the SurfaceGazeStream")
+    parser.add_argument("--port", type=int, default=EYE_TRACKING_PORT, help="the port of Pupil Remote")
+    parser.add_argument("--rate", type=float, nargs="*", default=[SIMULATOR_RATE],
+                        help="the rates of the surface data in Hz (several are benchmarked after another)")
+    parser.add_argument("--gazes", type=int, default=SIMULATOR_GAZES_PER_DATUM, help="the gazes per surface datum")
+    parser.add_argument("--duration", type=float, default=10, help="the measured time per benchmark in s")
+    args = parser.parse_args()
+    if args.mode == "serve":
+        PupilCaptureSimulator(args.port, rate=args.rate[0], gazes_per_datum=args.gazes).start().thread.join()
+    else:
+        for benchmark_rate in args.rate:
+            result = benchmark_ingestion(args.port, benchmark_rate, args.gazes, args.duration)
+            print("{rate:.0f} Hz with {gazes_per_datum} gazes: received {throughput:.0f} surface data/s "
+                  "using {cpu:.0%} of a core".format(**result))
@@ -0,0 +1,343 @@
+import argparse
+import json
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from config import *
+from fixation_layering import fixation_layering
+from fixation_layering.fixation_layering import calculate_gaussian_kernel, GazeOverlay, ImageCompositor, \
+    filter_image_with_positions, gaze_filter_for_positions, map_position_to_np_pixel
+from fixation_layering.tiled_renderer import TiledRenderer
+
+# the swept image sizes (width, height)
+IMAGE_SIZES = {"720p": (1280, 720), "1080p": (1920, 1080), "1440p": (2560, 1440), "4K": (3840, 2160)}
+PLAYER_COUNTS = [1, 10, 50, 200]
+SIGMAS = [60, 120, 240]
+PLACEMENTS = ["random", "border", "corner"]
+
+
+def random_positions(rng, image_size, number_of_players):
+    """
+    Creates random fixation positions for the players
+    Args:
+        rng(np.random.Generator): the random generator
+        image_size(tuple): the size of the image
+        number_of_players(int): the number of players
+    Returns: (dict(str, tuple(int, int))) the positions in pixel per player
+    """
+    image_height, image_width = image_size
+    return {"player_{}".format(i): (int(rng.integers(image_width)), int(rng.integers(image_height)))
+            for i in range(number_of_players)}
+
+
+def benchmark_downsampling(image_size=(IMAGE_WIDTH, IMAGE_HEIGHT), sigma=FIXATION_OVERLAY_SIGMA,
+                           number_of_players=10, frames=20, factors=(1, 2, 4, 8), seed=0):
+    """
+    Compares the throughput of the overlay calculated with the given downsample factors and the visual error of
+    the filtered image compared to the full resolution overlay
+    Args:
+        image_size(tuple): the size of the image (in the rotated layout used by wayl)
+        sigma(float): the sigma of the gaussian kernel in pixel of the image
+        number_of_players(int): the number of players which all move every frame
+        frames(int): the number of measured frames
+        factors(tuple(int)): the compared downsample factors
+        seed(int): the seed for the random positions
+    Returns: (list(dict)) the results per factor
+    """
+    rng = np.random.default_rng(seed)
+    image = rng.integers(0, 256, image_size + (3,), dtype=np.uint8)
+    frame_positions = [random_positions(rng, image_size, number_of_players) for _ in range(frames)]
+    reference_images = None
+    results = []
+    for factor in factors:
+        gaze_overlay = GazeOverlay(image_size, calculate_gaussian_kernel(sigma / factor), factor)
+        image_compositor = ImageCompositor(image, gaze_overlay.gaussian_kernel)
+        filtered_images = []
+        overlay_time = 0
+        total_time = 0
+        for positions in frame_positions:
+            start_time = time.perf_counter()
+            gaze_filter = gaze_overlay.update(positions)
+            overlay_time += time.perf_counter() - start_time
+            filtered_images.append(image_compositor.composite(gaze_filter, len(positions)).copy())
+            total_time += time.perf_counter() - start_time
+        if reference_images is None:
+            reference_images = filtered_images
+        errors = np.array([np.abs(filtered.astype(np.int16) - reference)
+                           for filtered, reference in zip(filtered_images, reference_images)])
+        results.append({
+            "factor": factor,
+            "overlay_ms": overlay_time / frames * 1000,
+            "frame_ms": total_time / frames * 1000,
+            "fps": frames / total_time,
+            "mean_abs_error": float(np.mean(errors)),
+            "max_abs_error": int(np.max(errors)),
+        })
+    return results
+
+
+def benchmark_tiled_renderer(image_size=(3840, 2160), sigma=FIXATION_OVERLAY_SIGMA, number_of_players=10, frames=10,
+                             worker_counts=None, seed=0):
+    """
+    Measures how the tiled renderer scales with the number of workers
+    Args:
+        image_size(tuple): the size of the image (in the rotated layout used by wayl)
+        sigma(float): the sigma of the gaussian kernel in pixel
+        number_of_players(int): the number of players
+        frames(int): the number of measured frames
+        worker_counts(list(int)|None): the compared numbers of workers, if None powers of two up to the cpu count
+        seed(int): the seed for the random positions
+    Returns: (list(dict)) the results per number of workers
+    """
+    if worker_counts is None:
+        worker_counts = [2 ** i for i in range(os.cpu_count().bit_length()) if 2 ** i <= os.cpu_count()]
+    rng = np.random.default_rng(seed)
+    image = rng.integers(0, 256, image_size + (3,), dtype=np.uint8)
+    gaussian_kernel = calculate_gaussian_kernel(sigma)
+    frame_positions = [list(random_positions(rng, image_size, number_of_players).values()) for _ in range(frames)]
+    reference = filter_image_with_positions(image, frame_positions[-1], gaussian_kernel)
+    results = []
+    for number_of_workers in worker_counts:
+        tiled_renderer = TiledRenderer(image, gaussian_kernel, number_of_workers)
+        tiled_renderer.render(frame_positions[0])  # warm up the threads
+        start_time = time.perf_counter()
+        for positions in frame_positions:
+            filtered_image = tiled_renderer.render(positions)
+        total_time = time.perf_counter() - start_time
+        tiled_renderer.close()
+        results.append({
+            "workers": number_of_workers,
+            "frame_ms": total_time / frames * 1000,
+            "fps": frames / total_time,
+            "max_abs_error": int(np.max(np.abs(filtered_image.astype(np.int16) - reference))),
+        })
+    for result in results:
+        result["speedup"] = results[0]["frame_ms"] / result["frame_ms"]
+    return results
+
+
+def positions_with_placement(rng, image_size, number_of_players, placement):
+    """
+    Creates fixation positions for the players
+    Args:
+        rng(np.random.Generator): the random generator
+        image_size(tuple): the size of the image
+        number_of_players(int): the number of players
+        placement(str): "random" for positions anywhere on the image, "border" for positions at most 5 pixels from
+        the border and "corner" for positions exactly in the corners
+    Returns: (list(tuple(int, int))) the positions in pixel
+    """
+    image_height, image_width = image_size
+    if placement == "random":
+        return list(random_positions(rng, image_size, number_of_players).values())
+    if placement == "corner":
+        corners = [(0, 0), (image_width - 1, 0), (0, image_height - 1), (image_width - 1, image_height - 1)]
+        return [corners[i % len(corners)] for i in range(number_of_players)]
+    positions = []
+    for pos_x, pos_y in random_positions(rng, image_size, number_of_players).values():
+        offset = int(rng.integers(6))
+        edge = rng.integers(4)
+        if edge == 0:
+            pos_x = offset
+        elif edge == 1:
+            pos_x = image_width - 1 - offset
+        elif edge == 2:
+            pos_y = offset
+        else:
+            pos_y = image_height - 1 - offset
+        positions.append((pos_x, pos_y))
+    return positions
+
+
+def measure(function, repeats, warm_up=1):
+    """
+    Measures the latency of the function and its peak memory (in a separate traced call)
+    Args:
+        function(callable): the measured function without arguments
+        repeats(int): the number of measured calls
+        warm_up(int): the number of calls before measuring
+    Returns: (dict) the throughput, the latency percentiles and the peak memory
+    """
+    for _ in range(warm_up):
+        function()
+    latencies = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        function()
+        latencies.append(time.perf_counter() - start_time)
+    tracemalloc.start()
+    function()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    latencies = np.array(latencies) * 1000
+    return {
+        "repeats": repeats,
+        "throughput_per_s": float(repeats / (np.sum(latencies) / 1000)),
+        "mean_ms": float(np.mean(latencies)),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "peak_memory_mb": peak_memory / 2 ** 20,
+    }
+
+
+def clear_kernel_cache():
+    """
+    Clears the cached kernels, so that calculate_gaussian_kernel is measured without the cache
+    """
+    # noinspection PyProtectedMember
+    fixation_layering._gaussian_kernel_1d.cache_clear()
+    # noinspection PyProtectedMember
+    fixation_layering._gaussian_kernel_2d.cache_clear()
+
+
+def benchmark_suite(image_sizes=tuple(IMAGE_SIZES), player_counts=PLAYER_COUNTS, sigmas=SIGMAS,
+                    placements=PLACEMENTS, repeats=10, seed=0):
+    """
+    Runs the benchmarks of the fixation layering functions for all combinations of the parameters
+    Args:
+        image_sizes(list(str)): the names of the image sizes as in IMAGE_SIZES
+        player_counts(list(int)): the numbers of players
+        sigmas(list(float)): the sigmas in pixel
+        placements(list(str)): the placements of the positions (see positions_with_placement)
+        repeats(int): the number of measured calls per case
+        seed(int): the seed for the random positions
+    Returns: (generator(dict)) the results per case
+    """
+    rng = np.random.default_rng(seed)
+    for sigma in sigmas:
+        def calculate_kernel():
+            clear_kernel_cache()
+            calculate_gaussian_kernel(sigma)
+        yield dict(function="calculate_gaussian_kernel", sigma=sigma, **measure(calculate_kernel, repeats))
+    for size_name in image_sizes:
+        image_width, image_height = IMAGE_SIZES[size_name]
+        image = rng.integers(0, 256, (image_width, image_height, 3), dtype=np.uint8)  # rotated as in wayl
+        # positions on the borders and just outside of the image as well as random ones
+        relative_positions = [(0.0, 0.0), (1.0, 1.0), (-0.01, 0.5), (0.5, 1.01)]
+        relative_positions += [tuple(position) for position in rng.random((96, 2))]
+
+        def map_positions():
+            for position in relative_positions:
+                map_position_to_np_pixel(position, image)
+        result = measure(map_positions, repeats)
+        result["throughput_per_s"] *= len(relative_positions)  # per mapped position
+        yield dict(function="map_position_to_np_pixel", size=size_name, width=image_width, height=image_height,
+                   **result)
+        for sigma in sigmas:
+            gaussian_kernel = calculate_gaussian_kernel(sigma)
+            for number_of_players in player_counts:
+                for placement in placements:
+                    positions = positions_with_placement(rng, image.shape[:2], number_of_players, placement)
+                    case = dict(size=size_name, width=image_width, height=image_height, sigma=sigma,
+                                players=number_of_players, placement=placement)
+                    yield dict(function="gaze_filter_for_positions", **case, **measure(
+                        lambda: gaze_filter_for_positions(positions, image.shape[:2], gaussian_kernel), repeats))
+                    yield dict(function="filter_image_with_positions", **case, **measure(
+                        lambda: filter_image_with_positions(image, positions, gaussian_kernel), repeats))
+
+
+def case_key(result):
+    """
+    Args:
+        result(dict): a result of benchmark_suite
+    Returns: (tuple) the parameters identifying the case of the result
+    """
+    return tuple(result.get(key) for key in ["function", "width", "height", "sigma", "players", "placement"])
+
+
+def compare_results(baseline_path, results_path, threshold=0.1):
+    """
+    Compares the p50 latencies of two result files written by the suite
+    Args:
+        baseline_path(str): the path of the baseline results
+        results_path(str): the path of the new results
+        threshold(float): the relative slowdown from which a case is marked as regression
+    Returns: (list(tuple(tuple, float, float))) the cases with the baseline and the new p50 latencies
+    """
+    with open(baseline_path) as baseline_file:
+        baseline = {case_key(result): result for result in map(json.loads, baseline_file) if "function" in result}
+    with open(results_path) as results_file:
+        results = [result for result in map(json.loads, results_file) if "function" in result]
+    comparison = []
+    for result in results:
+        baseline_result = baseline.get(case_key(result))
+        if baseline_result is None:
+            continue
+        comparison.append((case_key(result), baseline_result["p50_ms"], result["p50_ms"]))
+        ratio = result["p50_ms"] / baseline_result["p50_ms"]
+        print("{:<8} {:8.3f} ms -> {:8.3f} ms ({:+6.1%}) {}".format(
+            "REGRESS" if ratio > 1 + threshold else "", baseline_result["p50_ms"], result["p50_ms"], ratio - 1,
+            " ".join(str(value) for value in case_key(result) if value is not None)))
+    return comparison
+
+
+def current_commit():
+    """
+    Returns: (str|None) the hash of the checked out git commit
+    """
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks the fixation layering")
+    parser.add_argument("benchmark", type=str, choices=["downsampling", "tiles", "suite", "compare"], nargs="?",
+                        default="downsampling", help="the benchmark to run (or compare two result files of the suite)")
+    parser.add_argument("files", type=str, nargs="*", help="the baseline and the new result file for compare")
+    parser.add_argument("--width", type=int, default=None, help="the image width (default {}, {} for tiles)"
+                        .format(IMAGE_WIDTH, IMAGE_SIZES["4K"][0]))
+    parser.add_argument("--height", type=int, default=None, help="the image height (default {}, {} for tiles)"
+                        .format(IMAGE_HEIGHT, IMAGE_SIZES["4K"][1]))
+    parser.add_argument("--sigma", type=float, default=FIXATION_OVERLAY_SIGMA, help="the sigma in pixel")
+    parser.add_argument("--players", type=int, default=10, help="the number of players")
+    parser.add_argument("--frames", type=int, default=20, help="the number of measured frames")
+    parser.add_argument("--workers", type=int, nargs="*", default=None, help="the compared numbers of workers")
+    parser.add_argument("--sizes", type=str, nargs="*", choices=list(IMAGE_SIZES), default=list(IMAGE_SIZES),
+                        help="the image sizes of the suite")
+    parser.add_argument("--player-counts", type=int, nargs="*", default=PLAYER_COUNTS,
+                        help="the numbers of players of the suite")
+    parser.add_argument("--sigmas", type=float, nargs="*", default=SIGMAS, help="the sigmas of the suite")
+    parser.add_argument("--placements", type=str, nargs="*", choices=PLACEMENTS, default=PLACEMENTS,
+                        help="the placements of the positions of the suite")
+    parser.add_argument("--repeats", type=int, default=10, help="the number of measured calls per case of the suite")
+    parser.add_argument("--output", type=str, default=None, help="the file the suite results are written to "
+                                                                 "as json lines (default stdout)")
+    args = parser.parse_args()
+    # the tiled renderer is meant for 4K, at the default image size a single worker is fast enough
+    default_width, default_height = IMAGE_SIZES["4K"] if args.benchmark == "tiles" else (IMAGE_WIDTH, IMAGE_HEIGHT)
+    args.width = default_width if args.width is None else args.width
+    args.height = default_height if args.height is None else args.height
+
+    if args.benchmark == "suite":
+        output = open(args.output, "w") if args.output is not None else sys.stdout
+        output.write(json.dumps({"commit": current_commit(), "time": time.time()}) + "\n")
+        for result in benchmark_suite(args.sizes, args.player_counts, args.sigmas, args.placements, args.repeats):
+            output.write(json.dumps(result) + "\n")
+            output.flush()
+        if output is not sys.stdout:
+            output.close()
+        exit(0)
+
+    if args.benchmark == "compare":
+        if len(args.files) != 2:
+            parser.error("compare needs the baseline and the new result file")
+        compare_results(*args.files)
+        exit(0)
+
+    if args.benchmark == "tiles":
+        print("workers  frame ms     fps  speedup  max error")
+        for result in benchmark_tiled_renderer((args.width, args.height), args.sigma, args.players, args.frames,
+                                               args.workers):
+            print("{workers:7d}  {frame_ms:8.2f}  {fps:6.1f}  {speedup:7.2f}  {max_abs_error:9d}".format(**result))
+        exit(0)
+
+    print("factor  overlay ms  frame ms      fps  mean error  max error")
+    for result in benchmark_downsampling((args.width, args.height), args.sigma, args.players, args.frames):
+        print("{factor:6d}  {overlay_ms:10.2f}  {frame_ms:8.2f}  {fps:7.1f}  {mean_abs_error:10.3f}  "
+              "{max_abs_error:9d}".format(**result))
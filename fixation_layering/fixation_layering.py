@@ -1,16 +1,56 @@
+from collections import OrderedDict
+from functools import lru_cache
+
+import cv2
 import numpy as np
 import pygame
 
 from config import *
 
+# the cost of one tap of the separable blur relative to the cost of adding one kernel pixel to the overlay
+# (measured for float32 with cv2.sepFilter2D against the numpy slice add)
+IMPULSE_ENGINE_COST_RATIO = 0.2
+KERNEL_CACHE_SIZE = 32  # the number of kernels (per sigma and dtype) kept in memory
+# the number of steps the weights of fading kernels are rounded to, so that the weighted kernels can be cached
+KERNEL_WEIGHT_LEVELS = 16
+
+
+def calculate_gaussian_kernel_1d(_sigma=100, dtype=np.float64):
+    """
+    Returns the (cached and read-only) one dimensional gaussian kernel with a radius of 3 sigma and a maximum of 1
+    Args:
+        _sigma(float): the sigma of the gaussian in pixel
+        dtype(type): the type of the kernel
+    Returns: (ndarray) the kernel
+    """
+    return _gaussian_kernel_1d(float(_sigma), np.dtype(dtype))
+
+
+def calculate_gaussian_kernel(_sigma=100, dtype=np.float64):
+    """
+    Returns the (cached and read-only) two dimensional gaussian kernel as outer product of the one dimensional ones
+    Args:
+        _sigma(float): the sigma of the gaussian in pixel
+        dtype(type): the type of the kernel
+    Returns: (ndarray) the kernel
+    """
+    return _gaussian_kernel_2d(float(_sigma), np.dtype(dtype))
+
+
+@lru_cache(maxsize=KERNEL_CACHE_SIZE)
+def _gaussian_kernel_1d(_sigma, dtype):
+    _radius = int(np.ceil(_sigma * 3))
+    kernel_x = np.arange(-_radius, _radius + 1, dtype=np.float64)
+    kernel = np.exp(-kernel_x * kernel_x / (2 * _sigma * _sigma)).astype(dtype)
+    kernel.setflags(write=False)
+    return kernel
+
 
-def calculate_gaussian_kernel(_sigma=100):
-    _radius = _sigma * 3
-    _window_size = _radius * 2 + 1
-    kernel_x = np.array([np.arange(_window_size) for _ in range(_window_size)]) - _radius
-    kernel_y = kernel_x.T
-    kernel = (np.power(kernel_x, 2) + np.power(kernel_y, 2)) / (2 * _sigma * _sigma)
-    kernel = np.exp(-kernel)
+@lru_cache(maxsize=KERNEL_CACHE_SIZE)
+def _gaussian_kernel_2d(_sigma, dtype):
+    kernel_1d = _gaussian_kernel_1d(_sigma, np.dtype(np.float64))
+    kernel = np.outer(kernel_1d, kernel_1d).astype(dtype, copy=False)
+    kernel.setflags(write=False)
     return kernel
 
 
@@ -28,6 +68,55 @@ def initialise_screen():
     return _screen
 
 
+def kernel_slices_for_position(position, image_size, kernel_window_size):
+    """
+    Calculates where a kernel centered at the position lies on the image and which part of it is not cut off
+    Args:
+        position(tuple(int, int)): the position in pixel on the image
+        image_size(tuple): the size of the image
+        kernel_window_size(int): the window size of the (quadratic) kernel
+    Returns: (tuple(slice, slice), tuple(slice, slice)) the slices of the image and the slices of the kernel
+    """
+    pos_x, pos_y = position
+    kernel_radius = kernel_window_size // 2
+    image_height, image_width = image_size
+    left = pos_x - kernel_radius  # left position of the kernel
+    left_cut = -min(left, 0)  # number of pixels overhanging on the left of the image
+    right = pos_x + kernel_radius  # right position of the kernel
+    right_cut = max(right - (image_width - 1), 0)  # number of pixels overhanging on the right of the image
+    top = pos_y - kernel_radius  # top position of the kernel
+    top_cut = -min(top, 0)  # number of pixels overhanging on the top of the image
+    bottom = pos_y + kernel_radius  # bottom position of the kernel
+    bottom_cut = max(bottom - (image_height - 1), 0)  # number of pixels overhanging on the bottom of the image
+    image_slices = slice(top + top_cut, bottom + 1 - bottom_cut), slice(left + left_cut, right + 1 - right_cut)
+    kernel_slices = slice(top_cut, kernel_window_size - bottom_cut), slice(left_cut, kernel_window_size - right_cut)
+    return image_slices, kernel_slices
+
+
+def full_region(image_size):
+    """
+    Args:
+        image_size(tuple): the size of the image
+    Returns: (tuple(slice, slice)) the region covering the whole image
+    """
+    return tuple(slice(0, size) for size in image_size)
+
+
+def merge_regions(region, other_region):
+    """
+    Calculates the bounding region of both regions
+    Args:
+        region(tuple(slice, slice)|None): a region of the image (None for an empty region)
+        other_region(tuple(slice, slice)|None): another region of the image (None for an empty region)
+    Returns: (tuple(slice, slice)|None) the bounding region
+    """
+    if region is None:
+        return other_region
+    if other_region is None:
+        return region
+    return tuple(slice(min(a.start, b.start), max(a.stop, b.stop)) for a, b in zip(region, other_region))
+
+
 def gaze_filter_for_positions(_positions, image_size, _gaussian_kernel):
     """
     Creates an overlay of same size as the image with gaussians at the positions
@@ -38,23 +127,209 @@ def gaze_filter_for_positions(_positions, image_size, _gaussian_kernel):
     Returns: (ndarray) the overlay for the image
     """
     kernel_window_size = _gaussian_kernel.shape[0]
-    kernel_radius = kernel_window_size // 2
     _gaze_filter = np.ones(image_size)
+    for position in _positions:
+        image_slices, kernel_slices = kernel_slices_for_position(position, image_size, kernel_window_size)
+        _gaze_filter[image_slices] += _gaussian_kernel[kernel_slices]
+    return _gaze_filter
+
+
+def gaze_filter_for_positions_with_impulses(_positions, image_size, _gaussian_kernel):
+    """
+    Creates the same overlay as gaze_filter_for_positions by scattering all positions into an impulse map and
+    blurring it once with the separable gaussian, so that the cost does not depend on the number of positions
+    Args:
+        _positions(list(tuple)): the fixation positions in pixel on the image
+        image_size(tuple): the size of the image
+        _gaussian_kernel(ndarray): the gaussian kernel
+    Returns: (ndarray) the overlay for the image
+    """
     image_height, image_width = image_size
-    for pos_x, pos_y in _positions:
-        left = pos_x - kernel_radius  # left position of the kernel
-        left_cut = -min(left, 0)  # number of pixels overhanging on the left of the image
-        right = pos_x + kernel_radius  # right position of the kernel
-        right_cut = max(right - (image_width - 1), 0)  # number of pixels overhanging on the right of the image
-        top = pos_y - kernel_radius  # top position of the kernel
-        top_cut = -min(top, 0)  # number of pixels overhanging on the top of the image
-        bottom = pos_y + kernel_radius  # bottom position of the kernel
-        bottom_cut = max(bottom - (image_height - 1), 0)  # number of pixels overhanging on the bottom of the image
-        _gaze_filter[top + top_cut:bottom + 1 - bottom_cut, left + left_cut:right + 1 - right_cut] \
-            += _gaussian_kernel[top_cut:kernel_window_size - bottom_cut, left_cut:kernel_window_size - right_cut]
+    impulses = np.zeros(image_size, dtype=np.float32)
+    if len(_positions) > 0:
+        positions = np.asarray(_positions)
+        np.add.at(impulses, (np.clip(positions[:, 1], 0, image_height - 1),
+                             np.clip(positions[:, 0], 0, image_width - 1)), 1)
+    # the gaussian is separable: the kernel is the outer product of its center row with itself
+    kernel_row = _gaussian_kernel[_gaussian_kernel.shape[0] // 2].astype(np.float32)
+    _gaze_filter = cv2.sepFilter2D(impulses, -1, kernel_row, kernel_row, borderType=cv2.BORDER_CONSTANT)
+    _gaze_filter += 1
     return _gaze_filter
 
 
+def weight_level(weight):
+    """
+    Rounds the weight of a kernel to one of the KERNEL_WEIGHT_LEVELS steps
+    Args:
+        weight(float): the weight between 0 and 1
+    Returns: (int) the level between 0 and KERNEL_WEIGHT_LEVELS, the kernel is multiplied with
+    level / KERNEL_WEIGHT_LEVELS
+    """
+    return int(round(weight * KERNEL_WEIGHT_LEVELS))
+
+
+def use_impulse_engine(number_of_kernels, image_size, kernel_window_size):
+    """
+    Decides if stamping the kernels one by one is more expensive than blurring an impulse map of the whole image
+    Args:
+        number_of_kernels(int): the number of kernels to stamp
+        image_size(tuple): the size of the image
+        kernel_window_size(int): the window size of the kernel
+    Returns: (bool) True if gaze_filter_for_positions_with_impulses should be used
+    """
+    stamp_cost = number_of_kernels * kernel_window_size * kernel_window_size
+    blur_cost = IMPULSE_ENGINE_COST_RATIO * image_size[0] * image_size[1] * 2 * kernel_window_size
+    return stamp_cost > blur_cost
+
+
+class GazeOverlay:
+    def __init__(self, image_size, gaussian_kernel, downsample_factor=1):
+        """
+        Creates an overlay which is updated incrementally: only the kernels of the players whose position
+        changed since the last update are removed and stamped again
+        Args:
+            image_size(tuple): the size of the image
+            gaussian_kernel(ndarray): the gaussian kernel, if downsampled calculated with sigma / downsample_factor
+            downsample_factor(int): the overlay is built on a grid downsampled by this factor (e.g. 2, 4 or 8)
+            and upsampled to the image size when read
+        """
+        self.image_size = image_size
+        self.downsample_factor = downsample_factor
+        # the size of the grid the kernels are stamped on
+        self.overlay_size = tuple(-(-size // downsample_factor) for size in image_size)
+        self.gaussian_kernel = gaussian_kernel
+        self.gaze_filter = np.ones(self.overlay_size)
+        self.upsampled_gaze_filter = np.ones(image_size) if downsample_factor > 1 else None
+        self.stamped_kernels = {}  # the players with the position and the kernel they were last stamped with
+        # the weighted kernels by the id of the kernel and the weight level with the kernel they are calculated from
+        self.weighted_kernels = OrderedDict()
+        self.changed_region = None  # the region of the image changed by the last update (None if nothing changed)
+
+    def update(self, positions, sigmas=None, weights=None):
+        """
+        Updates the overlay to show the kernels at the given positions
+        Args:
+            positions(dict(str, tuple(int, int))): the fixation positions in pixel on the image per player
+            sigmas(dict(str, float)|None): the sigmas in pixel on the image for players which should not be shown
+            with the default kernel
+            weights(dict(str, float)|None): the weights the kernels are multiplied with for players which should
+            not be shown with full weight (e.g. fading out)
+        Returns: (ndarray) the overlay for the image
+        """
+        self.changed_region = None
+        stamps = {player_id: ((pos_x // self.downsample_factor, pos_y // self.downsample_factor),
+                              self._kernel_for_sigma(sigmas.get(player_id) if sigmas is not None else None))
+                  for player_id, (pos_x, pos_y) in positions.items()}
+        if weights:
+            levels = {player_id: weight_level(weights[player_id]) for player_id in stamps if player_id in weights}
+            stamps = {player_id: (position, self._weighted_kernel(kernel, levels[player_id]))
+                      if player_id in levels else (position, kernel)
+                      for player_id, (position, kernel) in stamps.items() if levels.get(player_id) != 0}
+        changed_stamps = {player_id: stamp for player_id, stamp in stamps.items()
+                          if not self._is_stamped(player_id, stamp)}
+        number_of_changes = sum(2 if p in self.stamped_kernels else 1 for p in changed_stamps)
+        number_of_changes += sum(1 for p in self.stamped_kernels if p not in stamps)
+        if all(kernel is self.gaussian_kernel for _, kernel in stamps.values()) \
+                and use_impulse_engine(number_of_changes, self.overlay_size, self.gaussian_kernel.shape[0]):
+            self.rebuild({player_id: position for player_id, (position, _) in stamps.items()})
+            self.changed_region = full_region(self.image_size)
+            return self.read()
+        for player_id in [p for p in self.stamped_kernels if p not in stamps]:
+            self._remove(player_id)
+        for player_id, (position, kernel) in changed_stamps.items():
+            if player_id in self.stamped_kernels:
+                self._remove(player_id)
+            self._stamp(player_id, position, kernel)
+        if self.changed_region is not None and self.downsample_factor > 1:
+            # a pixel of the grid influences the upsampled overlay up to one grid pixel further
+            factor = self.downsample_factor
+            self.changed_region = tuple(
+                slice(max((region.start - 1) * factor, 0), min((region.stop + 1) * factor, size))
+                for region, size in zip(self.changed_region, self.image_size)
+            )
+        return self.read()
+
+    def read(self):
+        """
+        Returns: (ndarray) the current overlay for the image, upsampled to the image size if downsampled
+        """
+        if self.upsampled_gaze_filter is None:
+            return self.gaze_filter
+        image_height, image_width = self.image_size
+        return cv2.resize(self.gaze_filter, (image_width, image_height), dst=self.upsampled_gaze_filter,
+                          interpolation=cv2.INTER_LINEAR)
+
+    def rebuild(self, positions):
+        """
+        Rebuilds the whole overlay from the given positions on the downsampled grid with the impulse engine
+        Args:
+            positions(dict(str, tuple(int, int))): the fixation positions on the grid of the overlay per player
+        """
+        self.gaze_filter[:] = gaze_filter_for_positions_with_impulses(list(positions.values()), self.overlay_size,
+                                                                       self.gaussian_kernel)
+        self.stamped_kernels = {player_id: (position, self.gaussian_kernel)
+                                for player_id, position in positions.items()}
+
+    def reset(self):
+        """
+        Removes all kernels from the overlay
+        """
+        self.gaze_filter.fill(1)
+        self.stamped_kernels.clear()
+
+    def _kernel_for_sigma(self, sigma):
+        """
+        Returns the default kernel if sigma is None or otherwise the kernel for sigma on the downsampled grid
+        """
+        if sigma is None:
+            return self.gaussian_kernel
+        return calculate_gaussian_kernel(sigma / self.downsample_factor)
+
+    def _weighted_kernel(self, kernel, level):
+        """
+        Returns the (cached) kernel multiplied with level / KERNEL_WEIGHT_LEVELS, the same object for the same kernel
+        and level so that an unchanged weight is not stamped again
+        """
+        if level >= KERNEL_WEIGHT_LEVELS:
+            return kernel
+        key = id(kernel), level
+        cached = self.weighted_kernels.get(key)
+        if cached is not None and cached[0] is kernel:
+            self.weighted_kernels.move_to_end(key)
+            return cached[1]
+        weighted_kernel = kernel * (level / KERNEL_WEIGHT_LEVELS)
+        weighted_kernel.setflags(write=False)
+        self.weighted_kernels[key] = kernel, weighted_kernel
+        if len(self.weighted_kernels) > KERNEL_CACHE_SIZE:
+            self.weighted_kernels.popitem(last=False)
+        return weighted_kernel
+
+    def _is_stamped(self, player_id, stamp):
+        """
+        Checks if the player is already stamped at the same position with the same kernel
+        """
+        stamped = self.stamped_kernels.get(player_id)
+        return stamped is not None and stamped[0] == stamp[0] and stamped[1] is stamp[1]
+
+    def _stamp(self, player_id, position, kernel):
+        """
+        Adds the kernel at the position to the overlay and remembers it for the player
+        """
+        image_slices, kernel_slices = kernel_slices_for_position(position, self.overlay_size, kernel.shape[0])
+        self.gaze_filter[image_slices] += kernel[kernel_slices]
+        self.stamped_kernels[player_id] = position, kernel
+        self.changed_region = merge_regions(self.changed_region, image_slices)
+
+    def _remove(self, player_id):
+        """
+        Subtracts the last stamped kernel of the player from the overlay
+        """
+        position, kernel = self.stamped_kernels.pop(player_id)
+        image_slices, kernel_slices = kernel_slices_for_position(position, self.overlay_size, kernel.shape[0])
+        self.gaze_filter[image_slices] -= kernel[kernel_slices]
+        self.changed_region = merge_regions(self.changed_region, image_slices)
+
+
 def filter_image_with_positions(_image, _positions, _gaussian_kernel, _mapping_back_to_range_values=None):
     """
     Filters the image according to the given positions with the given gaussian kernel
@@ -68,14 +343,83 @@ def filter_image_with_positions(_image, _positions, _gaussian_kernel, _mapping_b
     """
     if _mapping_back_to_range_values is None:
         _mapping_back_to_range_values = get_mapping_back_to_range_values(_gaussian_kernel, len(_positions))
-    gaze_filter = gaze_filter_for_positions(_positions, _image.shape[:2], _gaussian_kernel)
+    if use_impulse_engine(len(_positions), _image.shape[:2], _gaussian_kernel.shape[0]):
+        gaze_filter = gaze_filter_for_positions_with_impulses(_positions, _image.shape[:2], _gaussian_kernel)
+    else:
+        gaze_filter = gaze_filter_for_positions(_positions, _image.shape[:2], _gaussian_kernel)
+    return filter_image_with_gaze_filter(_image, gaze_filter, _mapping_back_to_range_values)
+
+
+def filter_image_with_gaze_filter(_image, _gaze_filter, _mapping_back_to_range_values):
+    """
+    Filters the image with an already calculated overlay
+    Args:
+        _image(ndarray): the image to filter
+        _gaze_filter(ndarray): the overlay for the image
+        _mapping_back_to_range_values(tuple(float, float)): the values used to map the filtered image back onto
+        the 0-255 range
+    Returns: (ndarray) the filtered image
+    """
     image_mean = np.array([128, 128, 128])  # np.mean(image, axis=(0,1))
-    image_filtered_float = (gaze_filter[:, :, np.newaxis] * (_image - image_mean)) + image_mean
+    image_filtered_float = (_gaze_filter[:, :, np.newaxis] * (_image - image_mean)) + image_mean
     image_filtered_norm = image_filtered_float * _mapping_back_to_range_values[0] + _mapping_back_to_range_values[1]
     _image_filtered = np.clip(image_filtered_norm, 0, 255).astype(np.uint8)
     return _image_filtered
 
 
+class ImageCompositor:
+    def __init__(self, image, gaussian_kernel, dtype=np.float32):
+        """
+        Creates a compositor which filters the image with overlays in preallocated buffers, so that no full-frame
+        temporaries are created per frame
+        Args:
+            image(ndarray): the image to filter
+            gaussian_kernel(ndarray): the gaussian kernel the overlays are created with
+            dtype(type): the float type used for the calculation
+        """
+        self.gaussian_kernel = gaussian_kernel
+        self.image_centered = np.subtract(image, 128, dtype=dtype)  # the image shifted by the image mean
+        self.filter_buffer = np.empty(image.shape[:2], dtype=dtype)
+        self.image_buffer = np.empty(image.shape, dtype=dtype)
+        self.image_filtered = np.empty(image.shape, dtype=np.uint8)
+        self.mapping_back_to_range_values = {}  # the values per number of positions
+
+    def get_mapping_back_to_range_values(self, number_of_positions):
+        """
+        Returns the (cached) values used to map the filtered image back onto the 0-255 range
+        Args:
+            number_of_positions(int): the number of positions used in the filter process
+        Returns: (float, float) the scale factor and the shift value
+        """
+        values = self.mapping_back_to_range_values.get(number_of_positions)
+        if values is None:
+            values = get_mapping_back_to_range_values(self.gaussian_kernel, number_of_positions)
+            self.mapping_back_to_range_values[number_of_positions] = values
+        return values
+
+    def composite(self, gaze_filter, number_of_positions, out=None, rows=slice(None)):
+        """
+        Filters the image with the overlay, matches filter_image_with_gaze_filter up to rounding
+        Args:
+            gaze_filter(ndarray): the overlay for the image (or only for the given rows)
+            number_of_positions(int): the number of positions the overlay was created with
+            out(ndarray|None): the uint8 array to write the filtered image to, if None an internal buffer is used
+            rows(slice): the rows of the image which are filtered, disjoint rows can be filtered concurrently
+        Returns: (ndarray) the filtered image
+        """
+        factor, shift = self.get_mapping_back_to_range_values(number_of_positions)
+        filter_buffer = self.filter_buffer[rows]
+        image_buffer = self.image_buffer[rows]
+        # (filter * (image - 128) + 128) * factor + shift == (filter * factor) * (image - 128) + 128 * factor + shift
+        np.multiply(gaze_filter, factor, out=filter_buffer, casting="same_kind")
+        np.multiply(filter_buffer[:, :, np.newaxis], self.image_centered[rows], out=image_buffer)
+        image_buffer += 128 * factor + shift
+        np.clip(image_buffer, 0, 255, out=image_buffer)
+        out = self.image_filtered if out is None else out
+        np.copyto(out[rows], image_buffer, casting="unsafe")
+        return out
+
+
 def get_mapping_back_to_range_values(_gaussian_kernel, number_of_positions):
     """
     Precalculate values used to map the filtered image back onto the 0-255 range
@@ -108,3 +452,18 @@ def map_position_to_np_pixel(position, _image):
         return None  # position is not within image
     image_width, image_height = _image.shape[:2]
     return int(position[1] * image_height), int(position[0] * image_width)
+
+
+def map_positions_to_np_pixels(positions, _image):
+    """
+    Maps the positions from the image frame to the np pixels at once (see map_position_to_np_pixel)
+    Args:
+        positions(ndarray): the positions in the image frame in range 0.0-1.0, one per row
+        _image(ndarray): the image the coordinates are mapped on
+    Returns: (ndarray, ndarray) the np pixel positions as int array with one per row and the boolean mask of the
+    positions within the image
+    """
+    image_width, image_height = _image.shape[:2]
+    within_image = np.all((positions >= 0) & (positions <= 1), axis=1)
+    pixels = (positions[:, ::-1] * (image_height, image_width)).astype(int)
+    return pixels, within_image
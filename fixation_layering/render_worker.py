@@ -0,0 +1,207 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from config import *
+from fixation_layering.fixation_layering import calculate_gaussian_kernel, map_positions_to_np_pixels, GazeOverlay, \
+    ImageCompositor, full_region, merge_regions, weight_level, KERNEL_WEIGHT_LEVELS
+from fixation_layering.tiled_renderer import TiledRenderer
+from messaging.latency import latency_monitor, STAGE_OVERLAY
+from view.ui_handler import map_position_between_screen_and_image
+
+
+class FrameBuffer:
+    def __init__(self, shape):
+        """
+        Creates a buffer with two frames: the back frame is only written by the render worker,
+        the front frame is only read by the displaying thread
+        Args:
+            shape(tuple): the shape of the frames
+        """
+        self.frames = [np.empty(shape, dtype=np.uint8) for _ in range(2)]
+        self.back_index = 0
+        self.fresh = False  # if the front frame was not taken yet
+        self.changed_region = None  # the region changed since the last taken frame
+        self.sent_times = {}  # the sent times of the gazes shown first since the last taken frame per peer
+        self.dropped_frames = 0  # the number of frames which were replaced before they were taken
+        self.lock = threading.Lock()
+
+    def back(self):
+        """
+        Returns: (ndarray) the frame to render into
+        """
+        return self.frames[self.back_index]
+
+    def publish(self, changed_region, sent_times=None):
+        """
+        Swaps the rendered back frame to the front
+        Args:
+            changed_region(tuple(slice, slice)|None): the region of the frame which changed compared to the
+            previously published frame
+            sent_times(dict(str, float)|None): the sent times of the gazes shown in the frame per peer
+        """
+        with self.lock:
+            if self.fresh:
+                self.dropped_frames += 1
+                self.changed_region = merge_regions(self.changed_region, changed_region)
+                self.sent_times.update(sent_times or {})
+            else:
+                self.changed_region = changed_region
+                self.sent_times = dict(sent_times or {})
+            self.back_index = 1 - self.back_index
+            self.fresh = True
+
+    @contextmanager
+    def latest(self):
+        """
+        Context manager giving the latest published frame (or None if it was already taken), the region changed
+        since the previously taken frame and the sent times of the shown gazes, the frame is not overwritten before
+        the context is left
+        """
+        with self.lock:
+            frame = self.frames[1 - self.back_index] if self.fresh else None
+            self.fresh = False
+            yield frame, self.changed_region, self.sent_times
+
+
+class RenderWorker:
+    def __init__(self, image, remote_positions_stream, screen_size, on_frame_ready=None,
+                 interval=SCREEN_UPDATE_INTERVAL):
+        """
+        Creates a worker which renders the filtered image in a background thread into a FrameBuffer
+        Args:
+            image(ndarray): the image to filter
+            remote_positions_stream(AbstractRemoteGazePositionStream): the stream giving the positions on the screen
+            screen_size(tuple(int, int)): the screen size in pixels
+            on_frame_ready(callable|None): called from the worker thread after a frame was published
+            interval(float): the minimal time between two frames in seconds
+        """
+        self.image = image
+        self.remote_positions_stream = remote_positions_stream
+        self.screen_size = screen_size
+        self.on_frame_ready = on_frame_ready
+        self.interval = interval
+        self.frame_buffer = FrameBuffer(image.shape)
+        gaussian_kernel = calculate_gaussian_kernel(FIXATION_OVERLAY_SIGMA / FIXATION_OVERLAY_DOWNSAMPLING)
+        self.gaze_overlay = GazeOverlay(image.shape[:2], gaussian_kernel, FIXATION_OVERLAY_DOWNSAMPLING)
+        self.image_compositor = ImageCompositor(image, gaussian_kernel)
+        self.tiled_renderer = TiledRenderer(image, calculate_gaussian_kernel(FIXATION_OVERLAY_SIGMA)) \
+            if RENDER_WORKERS > 1 else None
+        self.number_of_positions = None  # the number of positions of the last frame
+        self.rendered_version = None  # the version of the snapshot of the positions of the last frame
+        self.rendered_weight_levels = None  # the weight levels of the fading positions of the last frame
+        self.rendered_frames = 0
+        self.skipped_frames = 0  # the number of requested frames which were not rendered as nothing changed
+        self.late_frames = 0  # the number of frames which took longer than the interval
+        self.stopped = True
+        self.frame_requested = True
+        self.wake = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """
+        Starts rendering on a new Thread
+        Returns: (RenderWorker) self
+        """
+        self.stopped = False
+        self.thread = threading.Thread(target=self.update, name="RenderWorker", args=())
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops the worker and waits for the current frame to be finished
+        """
+        self.stopped = True
+        self.wake.set()
+        if self.thread is not None:
+            self.thread.join()
+        if self.tiled_renderer is not None:
+            self.tiled_renderer.close()
+
+    def request_frame(self):
+        """
+        Requests a new frame as the positions changed, can be called from any thread
+        """
+        self.frame_requested = True
+        self.wake.set()
+
+    def update(self):
+        """
+        Renders a frame whenever one was requested, but at most every interval
+        """
+        deadline = time.monotonic()
+        while not self.stopped:
+            if not (self.frame_requested or self.remote_positions_stream.changes_on_read):
+                # the positions also change without a gaze being received when an old one fades out or expires
+                time_until_change = self.remote_positions_stream.time_until_change()
+                if time_until_change is not None and time_until_change <= 0:
+                    self.frame_requested = True
+                    continue
+                self.wake.wait(time_until_change)
+                self.wake.clear()
+                continue
+            timeout = deadline - time.monotonic()
+            if timeout > 0:
+                self.wake.wait(timeout)
+                self.wake.clear()
+                continue
+            if -timeout > self.interval:  # nothing was requested for a while, restart the cadence
+                deadline = time.monotonic()
+            self.frame_requested = False
+            rendered = self.render(self.frame_buffer.back())
+            if rendered is None:
+                self.skipped_frames += 1
+                continue
+            self.frame_buffer.publish(*rendered)
+            self.rendered_frames += 1
+            current_time = time.monotonic()
+            deadline += self.interval
+            if deadline <= current_time:
+                self.late_frames += 1
+                deadline = current_time + self.interval
+            if self.on_frame_ready is not None:
+                self.on_frame_ready()
+
+    def render(self, out):
+        """
+        Filters the image according to the current remote positions
+        Args:
+            out(ndarray): the uint8 array to write the filtered image to
+        Returns: (tuple(tuple(slice, slice)|None, dict(str, float))|None) the region which changed compared to the
+        previous frame and the sent times of the shown gazes per peer or None if nothing changed and out was not
+        written
+        """
+        snapshot = self.remote_positions_stream.read_snapshot()
+        weights = self.remote_positions_stream.read_fade_weights(snapshot)
+        weight_levels = {player_id: weight_level(weight) for player_id, weight in weights.items()}
+        if snapshot.version == self.rendered_version and weight_levels == self.rendered_weight_levels:
+            return None  # the fading positions did not reach the next weight level yet
+        self.rendered_version = snapshot.version
+        self.rendered_weight_levels = weight_levels
+        positions_on_image = np.stack(map_position_between_screen_and_image(
+            snapshot.positions.T, self.screen_size, self.image.shape[:2], True), axis=1).reshape(-1, 2)
+        pixels, within_image = map_positions_to_np_pixels(positions_on_image, self.image)
+        fixations_on_image_not_none = {snapshot.sender_ids[i]: tuple(pixels[i].tolist())
+                                       for i in np.flatnonzero(within_image)}
+        number_of_positions = len(fixations_on_image_not_none)
+        if self.tiled_renderer is not None:
+            self.tiled_renderer.render(list(fixations_on_image_not_none.values()), out,
+                                       [weight_levels.get(player_id, KERNEL_WEIGHT_LEVELS) / KERNEL_WEIGHT_LEVELS
+                                        for player_id in fixations_on_image_not_none])
+            changed_region = full_region(self.image.shape[:2])
+        else:
+            gaze_filter = self.gaze_overlay.update(fixations_on_image_not_none, weights=weights)
+            self.image_compositor.composite(gaze_filter, number_of_positions, out)
+            changed_region = self.gaze_overlay.changed_region
+        if self.number_of_positions is None or self.image_compositor.get_mapping_back_to_range_values(
+                number_of_positions) != self.image_compositor.get_mapping_back_to_range_values(self.number_of_positions):
+            changed_region = full_region(self.image.shape[:2])  # the whole image is mapped differently
+        self.number_of_positions = number_of_positions
+        sent_times = {player_id: snapshot.sent_times[player_id] for player_id in fixations_on_image_not_none
+                      if player_id in snapshot.sent_times}
+        latency_monitor.record_stage(STAGE_OVERLAY, sent_times)
+        return changed_region, sent_times
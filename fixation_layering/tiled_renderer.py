@@ -0,0 +1,75 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from config import *
+from fixation_layering.fixation_layering import ImageCompositor, kernel_slices_for_position
+
+
+class TiledRenderer:
+    def __init__(self, image, gaussian_kernel, number_of_workers=RENDER_WORKERS, number_of_tiles=None):
+        """
+        Creates a renderer which splits the image into tiles of rows and filters them in parallel on a persistent
+        thread pool (numpy and OpenCV release the GIL)
+        Args:
+            image(ndarray): the image to filter
+            gaussian_kernel(ndarray): the gaussian kernel
+            number_of_workers(int): the number of threads
+            number_of_tiles(int|None): the number of tiles, if None two tiles per worker are used
+        """
+        self.gaussian_kernel = gaussian_kernel
+        self.kernel_radius = gaussian_kernel.shape[0] // 2
+        self.image_height, self.image_width = image.shape[:2]
+        self.compositor = ImageCompositor(image, gaussian_kernel)
+        self.image_filtered = np.empty(image.shape, dtype=np.uint8)
+        number_of_tiles = 2 * number_of_workers if number_of_tiles is None else number_of_tiles
+        number_of_tiles = max(1, min(number_of_tiles, self.image_height))
+        tile_borders = np.linspace(0, self.image_height, number_of_tiles + 1).astype(int)
+        self.tiles = [(top, bottom) for top, bottom in zip(tile_borders[:-1], tile_borders[1:])]
+        # every tile has its own overlay buffer so that no tile touches the rows of another
+        self.tile_gaze_filters = [np.empty((bottom - top, self.image_width)) for top, bottom in self.tiles]
+        self.number_of_workers = number_of_workers
+        self.executor = ThreadPoolExecutor(max_workers=number_of_workers, thread_name_prefix="TiledRenderer")
+
+    def render(self, positions, out=None, weights=None):
+        """
+        Filters the image according to the given positions
+        Args:
+            positions(list(tuple(int, int))): the positions in pixel
+            out(ndarray|None): the uint8 array to write the filtered image to, if None an internal buffer is used
+            weights(list(float)|None): the weights the kernels of the positions are multiplied with (e.g. fading
+            out) or None for full weight
+        Returns: (ndarray) the filtered image
+        """
+        out = self.image_filtered if out is None else out
+        positions_y = np.array([pos_y for _, pos_y in positions], dtype=int)
+        futures = [self.executor.submit(self._render_tile, tile_index, positions, positions_y, weights, out)
+                   for tile_index in range(len(self.tiles))]
+        for future in futures:
+            future.result()
+        return out
+
+    def _render_tile(self, tile_index, positions, positions_y, weights, out):
+        """
+        Creates the overlay for the tile only from the kernels intersecting it and filters the rows of the tile
+        """
+        top, bottom = self.tiles[tile_index]
+        tile_gaze_filter = self.tile_gaze_filters[tile_index]
+        tile_gaze_filter.fill(1)
+        intersecting = np.flatnonzero((positions_y + self.kernel_radius >= top)
+                                      & (positions_y - self.kernel_radius < bottom))
+        for i in intersecting:
+            pos_x, pos_y = positions[i]
+            image_slices, kernel_slices = kernel_slices_for_position((pos_x, pos_y - top), tile_gaze_filter.shape,
+                                                                     self.gaussian_kernel.shape[0])
+            if weights is None or weights[i] == 1:
+                tile_gaze_filter[image_slices] += self.gaussian_kernel[kernel_slices]
+            else:
+                tile_gaze_filter[image_slices] += self.gaussian_kernel[kernel_slices] * weights[i]
+        self.compositor.composite(tile_gaze_filter, len(positions), out, rows=slice(top, bottom))
+
+    def close(self):
+        """
+        Stops the worker threads
+        """
+        self.executor.shutdown(wait=True)
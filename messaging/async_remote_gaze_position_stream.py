@@ -0,0 +1,359 @@
+import asyncio
+import socket
+import time
+import uuid
+from threading import Thread, Event
+
+import msgpack
+import zmq
+import zmq.asyncio
+
+from config import *
+from messaging.beacon import encode_beacon, decode_beacon
+from messaging.gaze_message import encode_gaze_message
+from messaging.latency import TOPIC_CLOCK_SYNC
+from messaging.remote_gaze_position_stream import AbstractRemoteGazePositionStream, parse_gaze_message, \
+    TOPIC_GAZE_EXCHANGE, TOPIC_BINARY_GAZE_EXCHANGE
+from messaging.zmq_classes import ALIVE_TOPIC, LivenessTracker, decode_message, get_own_ips, resolve_ip, \
+    get_context
+from messaging.zmq_connection import PORT_RANGE, CONNECTION_TIMEOUT, get_possible_network_ips
+
+
+class BeaconProtocol(asyncio.DatagramProtocol):
+    def __init__(self, on_endpoint):
+        """
+        Protocol receiving the beacons of all BeaconBroadcasters (see messaging.beacon) on the event loop
+        Args:
+            on_endpoint(callable): called with the ip and the port for every port of every received beacon
+        """
+        self.on_endpoint = on_endpoint
+
+    def datagram_received(self, data, addr):
+        ports = decode_beacon(data)
+        if ports is None:
+            return
+        for port in ports:
+            self.on_endpoint(addr[0], port)
+
+
+class AsyncRemoteGazePositionStream(AbstractRemoteGazePositionStream):
+    """
+    Exchanges the gazes over PUB/SUB like the SubscriberRemoteGazePositionStream and the Publisher of
+    messaging.gaze_exchange, but multiplexes all sockets (subscriber, publisher, alive signals, beacons and surface
+    streams) and timers on a single asyncio event loop running on one thread.
+    The received gaze positions are only changed on the loop, readers on other threads get an immutable snapshot
+    (see AbstractRemoteGazePositionStream.read_snapshot). Gazes sent from other threads are awaited on the loop, the
+    sockets use the context shared by the process which is not terminated on stop
+    """
+
+    def __init__(self, stream_name="AsyncRemoteGazePositionStream"):
+        super().__init__(stream_name)
+        self.publisher_id = None
+        self.peer_id = None
+        self.pub_port = None
+        self.ip_and_ports = set()  # the ip-port-combinations the subscriber is connected to
+        self.known_endpoints = set()  # all ip-port-combinations the alive subscriber is connected to
+        self.liveness_tracker = LivenessTracker(CONNECTION_TIMEOUT / 1000)
+        self.loop = None
+        self.thread = None
+        self.main_task = None
+        self.tasks = []  # the tasks running on the loop until it is stopped
+        self.started = Event()
+        self.context = None
+        self.subscriber = None
+        self.alive_subscriber = None  # stays connected to all endpoints to notice when they are alive again
+        self.publisher = None
+
+    def start(self):
+        """
+        Starts the event loop on a new Thread and waits until the sockets are set up
+        Returns: (AbstractRemoteGazePositionStream) self
+        """
+        self.stopped = False
+        self.thread = Thread(target=self.update, name=self.name, args=())
+        self.thread.daemon = True
+        self.thread.start()
+        self.started.wait()
+        return self
+
+    def update(self):
+        """
+        Runs the event loop until stopped
+        """
+        self.loop = asyncio.new_event_loop()
+        try:
+            self.main_task = self.loop.create_task(self.run())
+            self.loop.run_until_complete(self.main_task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.loop.close()
+
+    def stop(self):
+        """
+        Cancels all tasks, closes the sockets and waits until the loop finished, can be called from any thread
+        """
+        super().stop()
+        if self.loop is not None and self.main_task is not None:
+            self.loop.call_soon_threadsafe(self.main_task.cancel)
+        if self.thread is not None:
+            self.thread.join()
+
+    async def run(self):
+        """
+        Sets up the sockets and runs the receiving and timer tasks until cancelled
+        """
+        # an asyncio view of the context shared by the process, closing the sockets is enough as it must not be termed
+        self.context = zmq.asyncio.Context.shadow(get_context().underlying)
+        # noinspection PyUnresolvedReferences
+        self.subscriber = self.context.socket(zmq.SUB)
+        # noinspection PyUnresolvedReferences
+        self.alive_subscriber = self.context.socket(zmq.SUB)
+        # noinspection PyUnresolvedReferences
+        self.publisher = self.context.socket(zmq.PUB)
+        beacon_transport = None
+        try:
+            self.bind_publisher()
+            for topic in [TOPIC_GAZE_EXCHANGE, TOPIC_BINARY_GAZE_EXCHANGE, TOPIC_CLOCK_SYNC]:
+                # noinspection PyUnresolvedReferences
+                self.subscriber.setsockopt(zmq.SUBSCRIBE, topic.encode())
+            # noinspection PyUnresolvedReferences
+            self.alive_subscriber.setsockopt(zmq.SUBSCRIBE, ALIVE_TOPIC.encode())
+            if USE_BEACON_DISCOVERY:
+                self.start_task(self.send_beacons())
+                beacon_transport = await self.listen_to_beacons()
+            else:
+                ips = get_possible_network_ips() if NETWORK_IPS is None else NETWORK_IPS
+                for ip in ips:
+                    for port in PORT_RANGE:
+                        self.connect(ip, port)
+            self.start_task(self.receive_gazes())
+            self.start_task(self.receive_alive_signals())
+            self.start_task(self.send_alive_signal())
+            self.start_task(self.check_alive())
+            self.start_task(self.send_clock_sync_pings())
+            self.started.set()
+            await asyncio.get_running_loop().create_future()  # run until cancelled
+        finally:
+            for task in self.tasks:
+                task.cancel()
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+            if beacon_transport is not None:
+                beacon_transport.close()
+            self.subscriber.close(linger=0)
+            self.alive_subscriber.close(linger=0)
+            self.publisher.close(linger=0)
+            self.started.set()  # do not block start if setting up failed
+
+    def start_task(self, coroutine):
+        """
+        Runs the coroutine as task on the loop until the loop is stopped
+        Args:
+            coroutine(coroutine): the coroutine
+        """
+        task = asyncio.ensure_future(coroutine)
+        task.add_done_callback(self.on_task_done)
+        self.tasks.append(task)
+
+    @staticmethod
+    def on_task_done(task):
+        """
+        Prints the exception of a task which finished unexpectedly
+        Args:
+            task(asyncio.Task): the finished task
+        """
+        if not task.cancelled() and task.exception() is not None:
+            print("Task {} failed: {}".format(task, task.exception()))
+
+    def bind_publisher(self):
+        """
+        Binds the publisher to the first unused port in PORT_RANGE
+        """
+        for port in PORT_RANGE:
+            try:
+                self.publisher.bind("tcp://*:{}".format(port))
+            except zmq.error.ZMQError as e:
+                if len(e.args) > 0 and e.args[0] == 98:
+                    print("Port already used, trying next one!")
+                    continue
+                raise e
+            print("Publisher started on port", port)
+            self.pub_port = port
+            self.publisher_id = get_own_ips()[1] + "_" + str(port)
+            self.peer_id = uuid.uuid5(uuid.NAMESPACE_URL, self.publisher_id).bytes
+            return
+        raise zmq.error.ZMQError(-1, "No unused port found in PORT_RANGE")
+
+    def connect(self, ip, port):
+        """
+        Connects the subscribers to the ip-port-combination if not already connected
+        Args:
+            ip(str): the ip
+            port(int): the port
+        """
+        ip = resolve_ip(ip)
+        if (ip, port) not in self.known_endpoints:
+            self.known_endpoints.add((ip, port))
+            self.alive_subscriber.connect("tcp://{}:{}".format(ip, port))
+        if (ip, port) in self.ip_and_ports:
+            return
+        self.ip_and_ports.add((ip, port))
+        self.liveness_tracker.add((ip, port), time.time())
+        self.subscriber.connect("tcp://{}:{}".format(ip, port))
+
+    async def receive_gazes(self):
+        """
+        Receives the gazes and the clock sync messages of the other players
+        """
+        while True:
+            topic, message = decode_message(await self.subscriber.recv_multipart(),
+                                             [TOPIC_BINARY_GAZE_EXCHANGE, TOPIC_CLOCK_SYNC])
+            if message is None:
+                continue
+            if topic == TOPIC_CLOCK_SYNC:
+                self.handle_clock_sync_message(message)
+                for answer in self.pop_clock_sync_messages():
+                    await self.publisher.send_multipart((TOPIC_CLOCK_SYNC.encode(), answer))
+                continue
+            self.save_gaze(*parse_gaze_message(message))
+
+    async def send_alive_signal(self):
+        """
+        Sends an ALIVE_TOPIC message with the publishers ips and port every half CONNECTION_TIMEOUT
+        """
+        pub_ips = get_own_ips()
+        while True:
+            for ip in pub_ips:
+                await self.publisher.send_multipart((ALIVE_TOPIC.encode(),
+                                                     msgpack.dumps("{}:{}".format(ip, self.pub_port))))
+            await asyncio.sleep(CONNECTION_TIMEOUT / 2000)
+
+    async def send_clock_sync_pings(self):
+        """
+        Sends a clock sync ping every CLOCK_SYNC_INTERVAL to measure the clock offsets to the other players
+        """
+        while True:
+            await self.publisher.send_multipart((TOPIC_CLOCK_SYNC.encode(), self.clock_sync_ping()))
+            await asyncio.sleep(CLOCK_SYNC_INTERVAL)
+
+    async def receive_alive_signals(self):
+        """
+        Receives the alive signals of the other players and connects again to the ones which were disconnected
+        """
+        while True:
+            _, message = decode_message(await self.alive_subscriber.recv_multipart())
+            if message is None:
+                continue
+            alive_ip, alive_port = message.split(":")
+            alive_endpoint = resolve_ip(alive_ip), int(alive_port)
+            if not self.liveness_tracker.heartbeat(alive_endpoint, time.time()) \
+                    and alive_endpoint in self.known_endpoints:
+                self.connect(*alive_endpoint)
+
+    async def check_alive(self):
+        """
+        Disconnects every half CONNECTION_TIMEOUT from the ip-port-combinations which did not send an alive signal
+        within the CONNECTION_TIMEOUT
+        """
+        while True:
+            await asyncio.sleep(CONNECTION_TIMEOUT / 2000)
+            for ip, port in self.liveness_tracker.pop_expired(time.time()):
+                self.ip_and_ports.discard((ip, port))
+                try:
+                    self.subscriber.disconnect("tcp://{}:{}".format(ip, port))
+                except zmq.ZMQError as e:
+                    print("error", e)
+
+    async def send_beacons(self):
+        """
+        Announces the publisher port via UDP every BEACON_INTERVAL
+        """
+        beacon_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        beacon_socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        beacon_socket.setblocking(False)
+        try:
+            while True:
+                try:
+                    beacon_socket.sendto(encode_beacon([self.pub_port]), (BEACON_ADDRESS, BEACON_PORT))
+                except OSError as e:
+                    print("Could not send beacon", e)
+                await asyncio.sleep(BEACON_INTERVAL)
+        finally:
+            beacon_socket.close()
+
+    async def listen_to_beacons(self):
+        """
+        Connects to the publishers announced by beacons
+        Returns: (asyncio.DatagramTransport) the transport receiving the beacons
+        """
+        beacon_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # several instances on one machine share the port, only broadcasts are delivered to all of them
+        beacon_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, "SO_REUSEPORT"):
+            beacon_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        beacon_socket.bind(("", BEACON_PORT))
+        transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+            lambda: BeaconProtocol(self.connect), sock=beacon_socket)
+        return transport
+
+    def add_surface_stream(self, surface_stream):
+        """
+        Lets the loop receive the data of the SurfaceGazeStream instead of its own thread, can be called from any
+        thread after start
+        Args:
+            surface_stream(SurfaceGazeStream): the not started stream
+        """
+        if self.stopped:
+            raise ValueError("Stream is not running")
+        surface_stream.start_surface_tracker_plugin()
+        surface_stream.stopped = False
+        self.loop.call_soon_threadsafe(self.start_task, self.receive_surface_data(surface_stream))
+
+    async def receive_surface_data(self, surface_stream):
+        """
+        Receives the data of the eye tracker for the SurfaceGazeStream
+        Args:
+            surface_stream(SurfaceGazeStream): the stream
+        """
+        # noinspection PyUnresolvedReferences
+        subscriber = self.context.socket(zmq.SUB)
+        try:
+            subscriber.connect("tcp://{}:{}".format(surface_stream.ip, surface_stream.sub_port))
+            for subject in surface_stream.subscriber.subjects:
+                # noinspection PyUnresolvedReferences
+                subscriber.setsockopt(zmq.SUBSCRIBE, subject.encode())
+            while not surface_stream.stopped:
+                surface_stream.save_message(*decode_message(await subscriber.recv_multipart(),
+                                                            surface_stream.subscriber.raw_subjects))
+        finally:
+            subscriber.close(linger=0)
+
+    def send_gaze(self, gaze, sequence_number, confidence=1.0):
+        """
+        Sends the gaze to all other players on the loop, can be called from any thread
+        Args:
+            gaze(tuple(float, float)): the gaze to be send
+            sequence_number(int): the sequence number of the gaze
+            confidence(float): the confidence of the gaze (only sent with USE_BINARY_GAZE_MESSAGES)
+        """
+        if USE_BINARY_GAZE_MESSAGES:
+            frames = (TOPIC_BINARY_GAZE_EXCHANGE.encode(),
+                      encode_gaze_message(self.peer_id, sequence_number, time.time(), gaze, confidence))
+        else:
+            gaze_string = ",".join([str(pos) for pos in gaze])
+            frames = (TOPIC_GAZE_EXCHANGE.encode(), msgpack.dumps("{}:{}".format(self.publisher_id, gaze_string)))
+        asyncio.run_coroutine_threadsafe(self.publish_gaze(frames), self.loop)
+
+    async def publish_gaze(self, frames):
+        """
+        Publishes the frames of a gaze message without blocking, a gaze which can't be sent is dropped
+        Args:
+            frames(tuple(bytes, bytes)): the topic and the message
+        """
+        try:
+            # noinspection PyUnresolvedReferences
+            await self.publisher.send_multipart(frames, zmq.NOBLOCK)
+        except zmq.error.Again:
+            print("Gaze dropped, the send queue is full")
+        except zmq.error.ZMQError as e:
+            print("Sending the gaze failed: {}".format(e))
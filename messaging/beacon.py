@@ -0,0 +1,145 @@
+import socket
+import struct
+import time
+from threading import Thread
+
+BEACON_MAGIC = b"WAYL"
+BEACON_VERSION = 1
+BEACON_HEADER = struct.Struct("<4sBB")  # magic, version, number of ports (followed by the ports as "<H")
+MAX_BEACON_SIZE = 512
+
+
+def encode_beacon(ports):
+    """
+    Encodes the beacon announcing the ports
+    Args:
+        ports(list(int)): the announced ports
+    Returns: (bytes) the beacon
+    """
+    return BEACON_HEADER.pack(BEACON_MAGIC, BEACON_VERSION, len(ports)) + struct.pack("<{}H".format(len(ports)),
+                                                                                     *ports)
+
+
+def decode_beacon(beacon):
+    """
+    Decodes a beacon
+    Args:
+        beacon(bytes): the received beacon
+    Returns: (list(int)|None) the announced ports or None if it is no valid beacon
+    """
+    if len(beacon) < BEACON_HEADER.size:
+        return None
+    magic, version, number_of_ports = BEACON_HEADER.unpack_from(beacon)
+    if magic != BEACON_MAGIC or version != BEACON_VERSION \
+            or len(beacon) != BEACON_HEADER.size + 2 * number_of_ports:
+        return None
+    return list(struct.unpack_from("<{}H".format(number_of_ports), beacon, BEACON_HEADER.size))
+
+
+class BeaconBroadcaster:
+    def __init__(self, ports, beacon_port, address="255.255.255.255", interval=1.0):
+        """
+        Creates a broadcaster which periodically announces the given (publisher) ports via UDP
+        Args:
+            ports(list(int)): the announced ports
+            beacon_port(int): the UDP port the beacons are sent to
+            address(str): the broadcast address the beacons are sent to (e.g. "127.255.255.255" on one computer, a
+            unicast address reaches only one of the listeners sharing the beacon port)
+            interval(float): the interval between two beacons in seconds
+        """
+        self.ports = list(ports)
+        self.beacon_port = beacon_port
+        self.address = address
+        self.interval = interval
+        self.stopped = True
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+
+    def add_port(self, port):
+        """
+        Adds a port to the announced ones
+        Args:
+            port(int): the port
+        """
+        self.ports = self.ports + [port]
+
+    def start(self):
+        """
+        Starts announcing on a new Thread
+        Returns: (BeaconBroadcaster) self
+        """
+        self.stopped = False
+        t = Thread(target=self.update, name="BeaconBroadcaster", args=())
+        t.daemon = True
+        t.start()
+        return self
+
+    def update(self):
+        """
+        Sends a beacon every interval until stopped
+        """
+        while not self.stopped:
+            try:
+                self.socket.sendto(encode_beacon(self.ports), (self.address, self.beacon_port))
+            except OSError as e:
+                print("Could not send beacon", e)
+            time.sleep(self.interval)
+
+    def stop(self):
+        """
+        Stops announcing
+        """
+        self.stopped = True
+
+
+class BeaconListener:
+    def __init__(self, on_endpoint, beacon_port, interface_ip=""):
+        """
+        Creates a listener which receives the beacons of all BeaconBroadcasters on the beacon port
+        Args:
+            on_endpoint(callable): called with the ip and the port for every port of every received beacon
+            beacon_port(int): the UDP port to listen on
+            interface_ip(str): the ip to bind to ("" for all interfaces)
+        """
+        self.on_endpoint = on_endpoint
+        self.stopped = True
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # several instances on one machine share the port, only broadcasts are delivered to all of them
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, "SO_REUSEPORT"):
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.socket.bind((interface_ip, beacon_port))
+        self.socket.settimeout(0.5)  # to check for stopped regularly
+
+    def start(self):
+        """
+        Starts listening on a new Thread
+        Returns: (BeaconListener) self
+        """
+        self.stopped = False
+        t = Thread(target=self.update, name="BeaconListener", args=())
+        t.daemon = True
+        t.start()
+        return self
+
+    def update(self):
+        """
+        Receives the beacons until stopped
+        """
+        while not self.stopped:
+            try:
+                beacon, (ip, _) = self.socket.recvfrom(MAX_BEACON_SIZE)
+            except socket.timeout:
+                continue
+            ports = decode_beacon(beacon)
+            if ports is None:
+                continue
+            for port in ports:
+                self.on_endpoint(ip, port)
+        self.socket.close()
+
+    def stop(self):
+        """
+        Stops listening
+        """
+        self.stopped = True
@@ -0,0 +1,39 @@
+import socket
+import time
+
+import pytest
+
+from messaging.beacon import BeaconBroadcaster, BeaconListener
+
+LOOPBACK_BROADCAST_ADDRESS = "127.255.255.255"
+
+
+def free_udp_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as udp_socket:
+        udp_socket.bind(("", 0))
+        return udp_socket.getsockname()[1]
+
+
+@pytest.mark.parametrize("address", [LOOPBACK_BROADCAST_ADDRESS, "255.255.255.255"])
+def test_all_listeners_on_one_computer_find_all_broadcasters(address):
+    """
+    The listeners of several instances on one computer share the beacon port, every one of them must receive the
+    beacons of all instances (a unicast address like 127.0.0.1 would reach only one listener)
+    """
+    beacon_port = free_udp_port()
+    number_of_instances = 3
+    found_endpoints = [set() for _ in range(number_of_instances)]
+    listeners = [BeaconListener(lambda ip, port, found=found: found.add(port), beacon_port).start()
+                 for found in found_endpoints]
+    ports = [6000 + i for i in range(number_of_instances)]
+    broadcasters = [BeaconBroadcaster([port], beacon_port, address, 0.1).start() for port in ports]
+    try:
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline and any(found != set(ports) for found in found_endpoints):
+            time.sleep(0.1)
+        assert found_endpoints == [set(ports)] * number_of_instances
+    finally:
+        for broadcaster in broadcasters:
+            broadcaster.stop()
+        for listener in listeners:
+            listener.stop()
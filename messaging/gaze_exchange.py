@@ -1,13 +1,26 @@
+import math
+import time
+import uuid
+
 from config import *
+from messaging.async_remote_gaze_position_stream import AsyncRemoteGazePositionStream
+from messaging.gaze_message import encode_gaze_message
+from messaging.latency import latency_monitor, LOCAL_PEER, STAGE_SEND, TOPIC_CLOCK_SYNC
 from messaging.remote_gaze_position_stream import PyreRemoteGazePositionStream, SubscriberRemoteGazePositionStream, \
-    TOPIC_GAZE_EXCHANGE
+    RelayRemoteGazePositionStream, MulticastRemoteGazePositionStream, TOPIC_GAZE_EXCHANGE, TOPIC_BINARY_GAZE_EXCHANGE
+from messaging.session_recording import SessionRecorder, ReplayRemoteGazePositionStream
 from messaging.zmq_classes import get_own_ips
 from messaging.zmq_connection import setup_publisher
-from mock.gaze_exchange_mock import MockPyreRemoteGazePositionStream, MockSubscriberRemoteGazePositionStream
+from mock.gaze_exchange_mock import MockPyreRemoteGazePositionStream, MockSubscriberRemoteGazePositionStream, \
+    MockRelayRemoteGazePositionStream, MockAsyncRemoteGazePositionStream, MockMulticastRemoteGazePositionStream
 
 publisher = None
 publisher_id = None
+sequence_number = 0
 remote_gaze_position_stream = None
+send_policy = None
+last_clock_sync_time = None
+session_recorder = None
 
 
 def setup_gaze_exchange():
@@ -15,36 +28,203 @@ def setup_gaze_exchange():
     Setup the messaging with the other players
     Returns: (AbstractRemoteGazePositionStream) the stream returning the others' gaze positions
     """
-    global remote_gaze_position_stream
-    if USE_PYRE_NETWORKING:
+    global remote_gaze_position_stream, session_recorder
+    if SESSION_REPLAY_PATH is not None:
+        remote_gaze_position_stream = ReplayRemoteGazePositionStream(SESSION_REPLAY_PATH)
+    elif USE_PYRE_NETWORKING:
         if MOCK_PLAYERS > 0:
             remote_gaze_position_stream = MockPyreRemoteGazePositionStream()
         else:
             remote_gaze_position_stream = PyreRemoteGazePositionStream()
+    elif USE_RELAY_HUB:
+        if MOCK_PLAYERS > 0:
+            remote_gaze_position_stream = MockRelayRemoteGazePositionStream()
+        else:
+            remote_gaze_position_stream = RelayRemoteGazePositionStream()
+    elif USE_ASYNC_RUNTIME:
+        if MOCK_PLAYERS > 0:
+            remote_gaze_position_stream = MockAsyncRemoteGazePositionStream()
+        else:
+            remote_gaze_position_stream = AsyncRemoteGazePositionStream()
+    elif USE_MULTICAST:
+        if MOCK_PLAYERS > 0:
+            remote_gaze_position_stream = MockMulticastRemoteGazePositionStream()
+        else:
+            remote_gaze_position_stream = MulticastRemoteGazePositionStream()
     else:
         if MOCK_PLAYERS > 0:
             remote_gaze_position_stream = MockSubscriberRemoteGazePositionStream()
         else:
             remote_gaze_position_stream = SubscriberRemoteGazePositionStream()
+        # already needed for answering the clock sync pings, also if no own gazes are sent
+        setup_gaze_publisher()
+    if SESSION_RECORDING_PATH is not None:
+        session_recorder = SessionRecorder(SESSION_RECORDING_PATH)
+        remote_gaze_position_stream.recorder = session_recorder
     return remote_gaze_position_stream
 
 
-def send_gaze(gaze):
+def setup_gaze_publisher():
+    """
+    Setups the publisher of the PUB/SUB gaze exchange and the own peer id derived from it
+    """
+    global publisher, publisher_id
+    publisher = setup_publisher()
+    publisher_id = get_own_ips()[1] + "_" + str(publisher.pub_port)
+    remote_gaze_position_stream.peer_id = uuid.uuid5(uuid.NAMESPACE_URL, publisher_id).bytes
+
+
+class SendPolicy:
+    def __init__(self, dead_band=SEND_DEAD_BAND, jump_distance=SEND_JUMP_DISTANCE, interval=SEND_INTERVAL,
+                 min_interval=SEND_MIN_INTERVAL, keep_alive_interval=SEND_KEEP_ALIVE_INTERVAL):
+        """
+        Decides which of the regularly offered gazes are sent: movements within the dead band are suppressed,
+        other movements are sent every interval, jumps immediately but at most every min_interval and an unchanged
+        gaze every keep_alive_interval. As always the latest offered gaze is compared to the last sent one, gazes
+        suppressed by the rate cap are coalesced into the next send
+        Args:
+            dead_band(float): the distance below which movements are not sent
+            jump_distance(float): the distance from which movements are sent immediately
+            interval(float): the time in seconds after which movements outside the dead band are sent
+            min_interval(float): the minimal time in seconds between two sends
+            keep_alive_interval(float): the time in seconds after which the gaze is sent even if it did not change
+        """
+        self.dead_band = dead_band
+        self.jump_distance = jump_distance
+        self.interval = interval
+        self.min_interval = min_interval
+        self.keep_alive_interval = keep_alive_interval
+        self.last_sent_gaze = None
+        self.last_sent_time = None
+        self.sent_gazes = 0
+        self.suppressed_gazes = 0
+
+    def should_send(self, gaze, current_time):
+        """
+        Decides if the gaze is sent and remembers it as last sent gaze if so
+        Args:
+            gaze(tuple(float, float)): the current gaze
+            current_time(float): the current monotonic time in seconds
+        Returns: (bool) True if the gaze should be sent
+        """
+        send = self._should_send(gaze, current_time)
+        if send:
+            self.last_sent_gaze = gaze
+            self.last_sent_time = current_time
+            self.sent_gazes += 1
+        else:
+            self.suppressed_gazes += 1
+        return send
+
+    def _should_send(self, gaze, current_time):
+        if self.last_sent_gaze is None:
+            return True
+        elapsed = current_time - self.last_sent_time
+        if elapsed < self.min_interval:
+            return False
+        distance = math.hypot(gaze[0] - self.last_sent_gaze[0], gaze[1] - self.last_sent_gaze[1])
+        if distance >= self.jump_distance:
+            return True
+        if distance >= self.dead_band and elapsed >= self.interval:
+            return True
+        return elapsed >= self.keep_alive_interval
+
+
+def offer_gaze(gaze, confidence=1.0, recorded_time=None):
+    """
+    Sends the gaze to all other players if the send policy decides so, should be called every SEND_POLL_INTERVAL
+    Args:
+        gaze(tuple(float, float)): the current gaze
+        confidence(float): the confidence of the gaze (only sent with USE_BINARY_GAZE_MESSAGES)
+        recorded_time(float|None): the time the gaze was received from the eye tracker if known
+    Returns: (bool) True if the gaze was sent
+    """
+    global send_policy
+    if SESSION_REPLAY_PATH is not None:
+        return False  # the replayed session is not exchanged with other players
+    if send_policy is None:
+        send_policy = SendPolicy()
+    if not send_policy.should_send(gaze, time.monotonic()):
+        return False
+    send_gaze(gaze, confidence, recorded_time)
+    return True
+
+
+def exchange_clock_sync():
+    """
+    Sends the answers to the clock sync pings of the other players and a ping every CLOCK_SYNC_INTERVAL,
+    should be called regularly from one thread, also if no own gazes are sent (the async runtime does this on its
+    own)
+    """
+    global last_clock_sync_time
+    if SESSION_REPLAY_PATH is not None:
+        return
+    if USE_PYRE_NETWORKING:
+        if remote_gaze_position_stream.peer_id is None:
+            return
+        send = remote_gaze_position_stream.pyre_pipe.send  # the pyre task answers the pings itself
+    elif USE_RELAY_HUB or USE_ASYNC_RUNTIME:
+        return
+    elif USE_MULTICAST:
+        for answer in remote_gaze_position_stream.pop_clock_sync_messages():
+            remote_gaze_position_stream.send_raw(answer)
+        send = remote_gaze_position_stream.send_raw
+    elif publisher is None:
+        return
+    else:
+        for answer in remote_gaze_position_stream.pop_clock_sync_messages():
+            publisher.send_raw(TOPIC_CLOCK_SYNC, answer)
+
+        def send(message):
+            publisher.send_raw(TOPIC_CLOCK_SYNC, message)
+    current_time = time.monotonic()
+    if last_clock_sync_time is None or current_time - last_clock_sync_time >= CLOCK_SYNC_INTERVAL:
+        last_clock_sync_time = current_time
+        send(remote_gaze_position_stream.clock_sync_ping())
+
+
+def send_gaze(gaze, confidence=1.0, recorded_time=None):
     """
     Sends the gaze to all other players
     Args:
         gaze(tuple(float, float)): the gaze to be send
+        confidence(float): the confidence of the gaze (only sent with USE_BINARY_GAZE_MESSAGES)
+        recorded_time(float|None): the time the gaze was received from the eye tracker if known
     """
-    global publisher, publisher_id
+    global publisher, publisher_id, sequence_number
+    if SESSION_REPLAY_PATH is not None:
+        return  # the replay stream has no transport to send with
     gaze_string = ",".join([str(pos) for pos in gaze])
-    if not USE_PYRE_NETWORKING:
+    sequence_number += 1
+    if recorded_time is not None:
+        latency_monitor.record(LOCAL_PEER, STAGE_SEND, time.time() - recorded_time)
+    if USE_RELAY_HUB and not USE_PYRE_NETWORKING:
+        if publisher_id is None:
+            publisher_id = uuid.uuid4()
+        # the hub only relays binary messages
+        remote_gaze_position_stream.pusher.send_raw(
+            encode_gaze_message(publisher_id.bytes, sequence_number, time.time(), gaze, confidence))
+    elif USE_ASYNC_RUNTIME and not USE_PYRE_NETWORKING:
+        remote_gaze_position_stream.send_gaze(gaze, sequence_number, confidence)
+    elif USE_MULTICAST and not USE_PYRE_NETWORKING:
+        # the datagrams are always binary messages
+        remote_gaze_position_stream.send_gaze(gaze, sequence_number, confidence)
+    elif not USE_PYRE_NETWORKING:
         if publisher is None:
-            publisher = setup_publisher()
-            publisher_id = get_own_ips()[1] + "_" + str(publisher.pub_port)
-        publisher.send(TOPIC_GAZE_EXCHANGE, "{}:{}".format(publisher_id, gaze_string))
+            setup_gaze_publisher()
+        if USE_BINARY_GAZE_MESSAGES:
+            publisher.send_raw(TOPIC_BINARY_GAZE_EXCHANGE, encode_gaze_message(
+                remote_gaze_position_stream.peer_id, sequence_number, time.time(), gaze, confidence))
+        else:
+            publisher.send(TOPIC_GAZE_EXCHANGE, "{}:{}".format(publisher_id, gaze_string))
     else:
         if publisher_id is None:
             publisher_id = remote_gaze_position_stream.publisher_id
-        msg = "{}:{}".format(publisher_id, gaze_string)
+            if publisher_id is None:
+                return  # the pyre task did not start yet
+        if USE_BINARY_GAZE_MESSAGES:
+            msg = encode_gaze_message(publisher_id.bytes, sequence_number, time.time(), gaze, confidence)
+        else:
+            msg = "{}:{}".format(publisher_id, gaze_string).encode("utf-8")
         print("try to send ", msg)
-        remote_gaze_position_stream.pyre_pipe.send(msg.encode("utf-8"))
+        remote_gaze_position_stream.pyre_pipe.send(msg)
@@ -0,0 +1,85 @@
+import struct
+import uuid
+
+import numpy as np
+
+GAZE_MESSAGE_MAGIC = b"WG"
+GAZE_MESSAGE_VERSION = 1
+# magic, version, flags (reserved), peer id, sequence number, timestamp, x, y, confidence
+GAZE_MESSAGE_STRUCT = struct.Struct("<2sBB16sIdfff")
+GAZE_MESSAGE_SIZE = GAZE_MESSAGE_STRUCT.size
+# the same layout as numpy dtype, used to decode a buffer of concatenated messages as view
+GAZE_MESSAGE_DTYPE = np.dtype([("magic", "S2"), ("version", "u1"), ("flags", "u1"), ("peer_id", "V16"),
+                               ("sequence", "<u4"), ("timestamp", "<f8"), ("x", "<f4"), ("y", "<f4"),
+                               ("confidence", "<f4")])
+SEQUENCE_MODULO = 2 ** 32
+
+assert GAZE_MESSAGE_DTYPE.itemsize == GAZE_MESSAGE_SIZE
+
+
+def encode_gaze_message(peer_id, sequence, timestamp, gaze, confidence=1.0):
+    """
+    Encodes the gaze as fixed-layout binary message
+    Args:
+        peer_id(bytes): the 16 bytes id of the sending peer
+        sequence(int): the sequence number of the message (wraps around at 2**32)
+        timestamp(float): the time the gaze was recorded in seconds since the epoch
+        gaze(tuple(float, float)): the gaze position
+        confidence(float): the confidence of the gaze
+    Returns: (bytes) the message
+    """
+    return GAZE_MESSAGE_STRUCT.pack(GAZE_MESSAGE_MAGIC, GAZE_MESSAGE_VERSION, 0, peer_id, sequence % SEQUENCE_MODULO,
+                                    timestamp, gaze[0], gaze[1], confidence)
+
+
+def is_gaze_message(message):
+    """
+    Checks if the message is a binary gaze message of the supported version (and not a text message)
+    Args:
+        message(bytes|memoryview): the received message
+    Returns: (bool) True if the message can be decoded with decode_gaze_message
+    """
+    return len(message) == GAZE_MESSAGE_SIZE and message[:2] == GAZE_MESSAGE_MAGIC \
+        and message[2] == GAZE_MESSAGE_VERSION
+
+
+def decode_gaze_message(message):
+    """
+    Decodes a binary gaze message directly from the buffer without copying it
+    Args:
+        message(bytes|memoryview): the message
+    Returns: (bytes, int, float, float, float, float) the peer id, the sequence number, the timestamp,
+    x, y and the confidence
+    """
+    _, _, _, peer_id, sequence, timestamp, x, y, confidence = GAZE_MESSAGE_STRUCT.unpack_from(message)
+    return peer_id, sequence, timestamp, x, y, confidence
+
+
+def decode_gaze_messages(buffer):
+    """
+    Decodes concatenated binary gaze messages as structured array viewing the buffer
+    Args:
+        buffer(bytes|memoryview): the concatenated messages
+    Returns: (ndarray) the messages with the fields of GAZE_MESSAGE_DTYPE
+    """
+    return np.frombuffer(buffer, dtype=GAZE_MESSAGE_DTYPE)
+
+
+def is_newer_sequence(sequence, latest_sequence):
+    """
+    Compares the sequence numbers with serial number arithmetic, so that the wrap around is no problem
+    Args:
+        sequence(int): the sequence number of a received message
+        latest_sequence(int|None): the sequence number of the latest message of the same peer or None if there is none
+    Returns: (bool) True if the message is newer than the latest one (False if it is reordered or duplicated)
+    """
+    return latest_sequence is None or 0 < (sequence - latest_sequence) % SEQUENCE_MODULO < SEQUENCE_MODULO // 2
+
+
+def peer_id_to_string(peer_id):
+    """
+    Args:
+        peer_id(bytes): the 16 bytes id of a peer
+    Returns: (str) the id as used as key for the received gaze positions
+    """
+    return str(uuid.UUID(bytes=bytes(peer_id)))
@@ -0,0 +1,233 @@
+import bisect
+import struct
+import time
+from collections import deque
+from threading import Lock
+
+# the stages a gaze passes from the eye tracker of one player to the screen of another one
+STAGE_SEND = "send"  # the gaze was sent (measured from when the surface datum was received from the eye tracker)
+STAGE_RECEIVE = "receive"  # the gaze was received
+STAGE_OVERLAY = "overlay"  # the overlay containing the gaze was computed
+STAGE_DISPLAY = "display"  # the frame containing the gaze was displayed
+LOCAL_PEER = "local"  # the peer the latencies of the own gazes are recorded for
+PERCENTILES = (50, 95, 99)
+
+HISTOGRAM_BINS = 200
+HISTOGRAM_MIN_LATENCY = 1e-5  # in seconds
+HISTOGRAM_MAX_LATENCY = 100  # in seconds
+
+TOPIC_CLOCK_SYNC = "clock_sync"
+CLOCK_SYNC_MAGIC = b"WC"
+CLOCK_SYNC_PING = 0
+CLOCK_SYNC_PONG = 1
+# magic, kind, the peer id of the pinging and of the answering peer, the time the ping was sent (pinging clock),
+# the time the ping was received and the time the pong was sent (answering clock)
+CLOCK_SYNC_STRUCT = struct.Struct("<2sB16s16sddd")
+CLOCK_SYNC_SAMPLES = 8  # the number of last samples per peer the offset is estimated from
+
+
+class LatencyHistogram:
+    def __init__(self, bins=HISTOGRAM_BINS, min_latency=HISTOGRAM_MIN_LATENCY, max_latency=HISTOGRAM_MAX_LATENCY):
+        """
+        Creates a histogram with logarithmically spaced bins, so that recording is O(log bins) without storing
+        the latencies and the percentiles have a constant relative error
+        Args:
+            bins(int): the number of bins
+            min_latency(float): the upper edge of the first bin in seconds
+            max_latency(float): the lower edge of the last bin in seconds
+        """
+        ratio = (max_latency / min_latency) ** (1 / (bins - 2))
+        self.edges = [min_latency * ratio ** i for i in range(bins - 1)]
+        self.counts = [0] * bins
+        self.count = 0
+
+    def record(self, latency):
+        """
+        Args:
+            latency(float): the latency in seconds
+        """
+        self.counts[bisect.bisect_left(self.edges, latency)] += 1
+        self.count += 1
+
+    def percentile(self, percent):
+        """
+        Args:
+            percent(float): the percentile between 0 and 100
+        Returns: (float|None) the upper edge of the bin containing the percentile in seconds or None if empty
+        """
+        if self.count == 0:
+            return None
+        rank = percent / 100 * self.count
+        cumulated_count = 0
+        for i, count in enumerate(self.counts):
+            cumulated_count += count
+            if cumulated_count >= rank and cumulated_count > 0:
+                return self.edges[min(i, len(self.edges) - 1)]
+        return self.edges[-1]
+
+
+class LatencyMonitor:
+    def __init__(self):
+        """
+        Collects the latencies of the gazes per peer and stage, the latency of a stage is the age of the gaze
+        when it reached the stage (measured from when it was sent, or from the surface datum for own gazes)
+        """
+        self.histograms = {}  # the histograms per peer and stage
+        self.recorded_sent_times = {}  # the sent time of the last gaze recorded per peer and stage
+        self.lock = Lock()
+
+    def record(self, peer, stage, latency):
+        """
+        Records a latency, can be called from any thread
+        Args:
+            peer(str): the peer id
+            stage(str): the stage
+            latency(float): the latency in seconds
+        """
+        with self.lock:
+            self._record(peer, stage, latency)
+
+    def _record(self, peer, stage, latency):
+        histogram = self.histograms.get((peer, stage))
+        if histogram is None:
+            histogram = self.histograms[(peer, stage)] = LatencyHistogram()
+        histogram.record(latency)
+
+    def record_stage(self, stage, sent_times, current_time=None):
+        """
+        Records the latencies of the gazes reaching the stage
+        Args:
+            stage(str): the stage
+            sent_times(dict(str, float)): the times the gazes were sent (on the local clock) per peer, gazes which
+            already reached the stage are not recorded again
+            current_time(float|None): the time the stage was reached or None for now
+        """
+        current_time = time.time() if current_time is None else current_time
+        with self.lock:
+            for peer, sent_time in sent_times.items():
+                if self.recorded_sent_times.get((peer, stage)) == sent_time:
+                    continue
+                self.recorded_sent_times[(peer, stage)] = sent_time
+                self._record(peer, stage, current_time - sent_time)
+
+    def merged_histogram(self, stage):
+        """
+        Args:
+            stage(str): the stage
+        Returns: (LatencyHistogram) the latencies of all peers at the stage in one histogram
+        """
+        merged = LatencyHistogram()
+        with self.lock:
+            for (_, histogram_stage), histogram in self.histograms.items():
+                if histogram_stage == stage:
+                    merged.counts = [a + b for a, b in zip(merged.counts, histogram.counts)]
+                    merged.count += histogram.count
+        return merged
+
+    def reset(self):
+        """
+        Removes all recorded latencies
+        """
+        with self.lock:
+            self.histograms.clear()
+            self.recorded_sent_times.clear()
+
+    def report(self):
+        """
+        Returns: (dict(tuple(str, str), tuple)) the number of latencies and the PERCENTILES in seconds
+        per peer and stage
+        """
+        with self.lock:
+            return {key: (histogram.count,) + tuple(histogram.percentile(p) for p in PERCENTILES)
+                    for key, histogram in sorted(self.histograms.items())}
+
+    def print_report(self):
+        """
+        Prints the percentiles in milliseconds per peer and stage
+        """
+        for (peer, stage), (count, *percentiles) in self.report().items():
+            print("Latency {} {}: {} gazes, {}".format(peer, stage, count, ", ".join(
+                "p{} {:.1f} ms".format(p, value * 1000) for p, value in zip(PERCENTILES, percentiles))))
+
+
+class ClockOffsetEstimator:
+    def __init__(self, samples=CLOCK_SYNC_SAMPLES):
+        """
+        Estimates the clock offsets to the other peers NTP-like from ping-pong exchanges: of the last samples the one
+        with the shortest round trip is used as its offset is the least distorted by asymmetric delays
+        Args:
+            samples(int): the number of last samples per peer used for the estimation
+        """
+        self.samples = samples
+        self.peer_samples = {}  # the last samples of round trip delay and offset per peer
+        self.lock = Lock()
+
+    def add_sample(self, peer, ping_sent_time, ping_received_time, pong_sent_time, pong_received_time):
+        """
+        Adds the times of one ping-pong exchange
+        Args:
+            peer(str): the answering peer
+            ping_sent_time(float): the time the ping was sent (local clock)
+            ping_received_time(float): the time the ping was received (peer clock)
+            pong_sent_time(float): the time the pong was sent (peer clock)
+            pong_received_time(float): the time the pong was received (local clock)
+        """
+        delay = (pong_received_time - ping_sent_time) - (pong_sent_time - ping_received_time)
+        offset = ((ping_received_time - ping_sent_time) + (pong_sent_time - pong_received_time)) / 2
+        with self.lock:
+            if peer not in self.peer_samples:
+                self.peer_samples[peer] = deque(maxlen=self.samples)
+            self.peer_samples[peer].append((delay, offset))
+
+    def offset(self, peer):
+        """
+        Args:
+            peer(str): the peer
+        Returns: (float) the estimated time the clock of the peer is ahead of the local one in seconds
+        (0 if unknown)
+        """
+        with self.lock:
+            samples = self.peer_samples.get(peer)
+            return min(samples)[1] if samples else 0.0
+
+    def to_local_time(self, peer, peer_time):
+        """
+        Args:
+            peer(str): the peer
+            peer_time(float): a time on the clock of the peer
+        Returns: (float) the time on the local clock
+        """
+        return peer_time - self.offset(peer)
+
+
+def encode_clock_sync_message(kind, pinging_peer_id, answering_peer_id, ping_sent_time, ping_received_time=0.0,
+                              pong_sent_time=0.0):
+    """
+    Encodes a ping (answering_peer_id is ignored) or a pong
+    Args:
+        kind(int): CLOCK_SYNC_PING or CLOCK_SYNC_PONG
+        pinging_peer_id(bytes): the 16 bytes id of the pinging peer
+        answering_peer_id(bytes): the 16 bytes id of the answering peer
+        ping_sent_time(float): the time the ping was sent
+        ping_received_time(float): the time the ping was received
+        pong_sent_time(float): the time the pong was sent
+    Returns: (bytes) the message
+    """
+    return CLOCK_SYNC_STRUCT.pack(CLOCK_SYNC_MAGIC, kind, pinging_peer_id, answering_peer_id, ping_sent_time,
+                                  ping_received_time, pong_sent_time)
+
+
+def decode_clock_sync_message(message):
+    """
+    Args:
+        message(bytes): the message
+    Returns: (tuple|None) kind, pinging peer id, answering peer id, the ping sent, ping received and pong sent times
+    or None if it is no clock sync message
+    """
+    if len(message) != CLOCK_SYNC_STRUCT.size or message[:2] != CLOCK_SYNC_MAGIC:
+        return None
+    return CLOCK_SYNC_STRUCT.unpack(message)[1:]
+
+
+latency_monitor = LatencyMonitor()
+clock_offset_estimator = ClockOffsetEstimator()
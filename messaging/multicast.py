@@ -0,0 +1,43 @@
+import socket
+import struct
+
+MAX_DATAGRAM_SIZE = 512  # larger than any gaze or clock sync message
+
+
+def create_multicast_sender(interface="0.0.0.0", ttl=1, loop=True):
+    """
+    Creates a UDP socket sending datagrams to multicast groups
+    Args:
+        interface(str): the ip of the interface the datagrams are sent from ("0.0.0.0" for the default one,
+        "127.0.0.1" for testing on one computer)
+        ttl(int): the number of hops the datagrams pass (1 to stay in the local network)
+        loop(bool): if the datagrams are delivered to the receivers on the same computer as well
+    Returns: (socket.socket) the socket
+    """
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    sender.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+    sender.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, int(loop))
+    sender.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(interface))
+    return sender
+
+
+def create_multicast_receiver(group, port, interface="0.0.0.0", timeout=None):
+    """
+    Creates a UDP socket which joined the multicast group, several receivers on one computer can join the same group
+    Args:
+        group(str): the multicast address (e.g. "239.255.42.99")
+        port(int): the port the datagrams are sent to
+        interface(str): the ip of the interface joining the group ("0.0.0.0" for the default one, "127.0.0.1" for
+        testing on one computer)
+        timeout(float|None): the timeout of the receive calls in seconds or None to block
+    Returns: (socket.socket) the socket
+    """
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    receiver.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if hasattr(socket, "SO_REUSEPORT"):
+        receiver.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    receiver.bind(("", port))
+    membership = struct.pack("4s4s", socket.inet_aton(group), socket.inet_aton(interface))
+    receiver.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+    receiver.settimeout(timeout)
+    return receiver
@@ -0,0 +1,109 @@
+import argparse
+import time
+
+from config import *
+from messaging.gaze_message import is_gaze_message, decode_gaze_message, SEQUENCE_MODULO
+from messaging.remote_gaze_position_stream import TOPIC_GAZE_SNAPSHOT
+from messaging.zmq_classes import Publisher, Puller
+
+
+class RelayHub:
+    def __init__(self, pull_port=RELAY_HUB_PULL_PORT, pub_port=RELAY_HUB_PUB_PORT, tick=RELAY_HUB_TICK,
+                 peer_timeout=RELAY_HUB_PEER_TIMEOUT, keep_alive_interval=RELAY_HUB_KEEP_ALIVE_INTERVAL):
+        """
+        Creates a hub which receives the binary gaze messages of all clients and broadcasts one snapshot with the
+        latest message of every client each tick in which they changed, so that every client receives at most one
+        message per tick instead of one per other client
+        Args:
+            pull_port(int): the port the clients push their gazes to
+            pub_port(int): the port the snapshots are published on
+            tick(float): the interval between two snapshots in seconds
+            peer_timeout(float): the time in seconds after which a client without new gazes is left out
+            keep_alive_interval(float): the time in seconds after which an unchanged snapshot is broadcast again
+        """
+        self.puller = Puller(pull_port)
+        self.publisher = Publisher(pub_port)
+        self.tick = tick
+        self.peer_timeout = peer_timeout
+        self.keep_alive_interval = keep_alive_interval
+        self.changed = False  # if the latest messages changed since the last broadcast snapshot
+        self.last_broadcast_time = None
+        self.latest_messages = {}  # the peer ids with their latest message, its sequence number and receive time
+        self.stopped = True
+
+    def run(self):
+        """
+        Relays the gazes until stopped
+        """
+        self.puller.start()
+        self.publisher.start()
+        self.stopped = False
+        print("Relay hub receiving on port {} and publishing on port {}".format(self.puller.port,
+                                                                                 self.publisher.pub_port))
+        next_tick = time.time()
+        while not self.stopped:
+            timeout = int(max(next_tick - time.time(), 0) * 1000)
+            message = self.puller.recv_raw(timeout)
+            if message is not None:
+                self.save_message(message)
+            if time.time() < next_tick:
+                continue
+            next_tick += self.tick
+            if next_tick < time.time():
+                next_tick = time.time() + self.tick
+            self.remove_timed_out_peers()
+            if self.changed or self.last_broadcast_time is None \
+                    or time.time() - self.last_broadcast_time >= self.keep_alive_interval:
+                self.publisher.send_raw(TOPIC_GAZE_SNAPSHOT, self.snapshot())
+                self.changed = False
+                self.last_broadcast_time = time.time()
+
+    def save_message(self, message):
+        """
+        Saves the message if it is newer than the latest one of its peer
+        Args:
+            message(bytes): the received binary gaze message
+        """
+        if not is_gaze_message(message):
+            print("Wrong gaze received: ", message)
+            return
+        peer_id, sequence = decode_gaze_message(message)[:2]
+        latest = self.latest_messages.get(peer_id)
+        # serial number arithmetic, so that the wrap around of the sequence numbers is no problem
+        if latest is not None and 0 < (latest[1] - sequence) % SEQUENCE_MODULO < SEQUENCE_MODULO // 2:
+            return  # reordered message
+        self.latest_messages[peer_id] = message, sequence, time.time()
+        self.changed = True
+
+    def remove_timed_out_peers(self):
+        """
+        Removes the peers without new gazes for longer than the peer timeout
+        """
+        current_time = time.time()
+        number_of_peers = len(self.latest_messages)
+        self.latest_messages = {peer_id: latest for peer_id, latest in self.latest_messages.items()
+                                if current_time - latest[2] < self.peer_timeout}
+        if len(self.latest_messages) != number_of_peers:
+            self.changed = True
+
+    def snapshot(self):
+        """
+        Concatenates the latest messages of all peers
+        Returns: (bytes) the snapshot
+        """
+        return b"".join(message for message, _, _ in self.latest_messages.values())
+
+    def stop(self):
+        """
+        Stops the hub
+        """
+        self.stopped = True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Relays the gazes of all clients configured with USE_RELAY_HUB")
+    parser.add_argument("--pull-port", type=int, default=RELAY_HUB_PULL_PORT, help="the port receiving the gazes")
+    parser.add_argument("--pub-port", type=int, default=RELAY_HUB_PUB_PORT, help="the port publishing the snapshots")
+    parser.add_argument("--tick", type=float, default=RELAY_HUB_TICK, help="the interval between snapshots in s")
+    args = parser.parse_args()
+    RelayHub(args.pull_port, args.pub_port, args.tick).run()
@@ -1,25 +1,117 @@
 import abc
 import json
+import socket
+import time
 import uuid
-from threading import Thread
+from collections import OrderedDict, deque, namedtuple
+from threading import Thread, Lock
+from types import MappingProxyType
+
+import numpy as np
 from pyre import Pyre, zhelper
 import zmq
 
 from config import *
+from messaging.gaze_message import is_gaze_message, decode_gaze_message, peer_id_to_string, decode_gaze_messages, \
+    encode_gaze_message, is_newer_sequence
+from messaging.latency import latency_monitor, clock_offset_estimator, decode_clock_sync_message, \
+    encode_clock_sync_message, STAGE_RECEIVE, CLOCK_SYNC_PING, CLOCK_SYNC_PONG, TOPIC_CLOCK_SYNC
+from messaging.multicast import create_multicast_sender, create_multicast_receiver, MAX_DATAGRAM_SIZE
+from messaging.zmq_classes import Subscriber, Pusher, get_context
 from messaging.zmq_connection import setup_subscriber
 
 TOPIC_GAZE_EXCHANGE = "gaze_exchange"
+TOPIC_BINARY_GAZE_EXCHANGE = "binary_gaze_exchange"
+TOPIC_GAZE_SNAPSHOT = "gaze_snapshot"
 GROUP_GAZE_EXCHANGE = "GAZE_EXCHANGE"
 STOP_MESSAGE = "$$STOP"
 
+# an immutable state of the received gazes: the version increases with every change, the positions are a read-only
+# array with one row per sender id, the sent times (on the local clock) are given per sender id, the receive times
+# (monotonic) are a read-only array in the order of the sender ids and expiry_time is the monotonic time the oldest
+# gaze expires (None if there are no gazes)
+GazeSnapshot = namedtuple("GazeSnapshot", ["version", "sender_ids", "positions", "sent_times", "receive_times",
+                                           "expiry_time"])
+
+
+def parse_gaze_message(message):
+    """
+    Reads the sender id and the gaze from the given message
+    Args:
+        message(str|bytes): the message, either a binary gaze message or a text message "id:x,y"
+    Returns: (tuple(str, tuple(float, float), float|None)) the sender id, the gaze and the time it was sent
+    (on the clock of the sender, None for text messages)
+    """
+    if not isinstance(message, str) and is_gaze_message(message):
+        peer_id, _, timestamp, x, y, _ = decode_gaze_message(message)
+        return peer_id_to_string(peer_id), (x, y), timestamp
+    if not isinstance(message, str):
+        message = bytes(message).decode("utf-8")
+    sender_id, pos_msg = message.split(":")
+    positions = pos_msg.split(",")
+    if len(positions) != 2:
+        print("Wrong gaze received: ", message)
+    return sender_id, (float(positions[0]), float(positions[1])), None
+
+
+def create_gaze_snapshot(version, gazes, sent_times, receive_times, expiry_time=None):
+    """
+    Creates an immutable snapshot of the gazes
+    Args:
+        version(int): the version of the snapshot
+        gazes(dict(str, tuple(float, float))): the gazes per sender id
+        sent_times(dict(str, float)): the times the gazes were sent per sender id
+        receive_times(dict(str, float)): the monotonic times the gazes were received per sender id
+        expiry_time(float|None): the monotonic time the oldest gaze expires
+    Returns: (GazeSnapshot) the snapshot
+    """
+    sender_ids = tuple(gazes)
+    positions = np.array([gazes[sender_id] for sender_id in sender_ids], dtype=np.float64).reshape(-1, 2)
+    positions.flags.writeable = False
+    snapshot_receive_times = np.array([receive_times.get(sender_id, np.inf) for sender_id in sender_ids],
+                                      dtype=np.float64)
+    snapshot_receive_times.flags.writeable = False
+    snapshot_sent_times = MappingProxyType({sender_id: sent_times[sender_id] for sender_id in sender_ids
+                                            if sender_id in sent_times})
+    return GazeSnapshot(version, sender_ids, positions, snapshot_sent_times, snapshot_receive_times, expiry_time)
+
 
 class AbstractRemoteGazePositionStream(abc.ABC):
     """Class for receiving the gaze positions of all other players"""
-    def __init__(self, stream_name="RemoteGazePositionStream"):
+    changes_on_read = False  # if the positions can change without a gaze being received
+
+    def __init__(self, stream_name="RemoteGazePositionStream", ttl=GAZE_POSITION_TTL,
+                 fade_time=GAZE_POSITION_FADE_TIME):
+        """
+        Args:
+            stream_name(str): the name of the stream
+            ttl(float): the time in seconds after which a received gaze is evicted if no newer one of the player was
+            received
+            fade_time(float): the time in seconds before the ttl in which the gaze is faded out
+        """
         self.name = stream_name
         self.stopped = True
         self.received_gaze_positions = dict()
+        # the sender ids with the monotonic time their gaze was received, ordered from the oldest to the newest
+        # so that expired gazes are found without scanning all of them
+        self.receive_times = OrderedDict()
+        self.sent_times = {}  # the sender ids with the time their gaze was sent (on the local clock)
+        # the sender ids with the time their gaze was sent on their own clock as last given to replace_gazes, used to
+        # recognize the unchanged gazes repeated in every relay snapshot
+        self.replaced_sent_times = {}
+        self.lock = Lock()  # guards the received gazes which are only written by the receiving threads
+        # the latest snapshot of the received gazes, built lazily by the first read after a change and replaced as a
+        # whole so that it can be read without locking
+        self.snapshot = create_gaze_snapshot(0, {}, {}, {})
+        self.version = 0  # increased with every change of the received gazes
+        self.expiry_time = None  # the monotonic time the oldest gaze expires (None if there are no gazes)
+        self.ttl = ttl
+        self.fade_time = fade_time
         self.subscriber = None
+        self.on_gaze_received = None  # called (from the receiving thread) after a gaze was saved
+        self.recorder = None  # the SessionRecorder (see messaging.session_recording) recording the received gazes
+        self.peer_id = None  # the own 16 bytes peer id, clock sync pings are answered once it is known
+        self.clock_sync_answers = deque()  # the answers to clock sync pings which are not sent yet
 
     @abc.abstractmethod
     def start(self):
@@ -38,23 +130,223 @@ class AbstractRemoteGazePositionStream(abc.ABC):
         """
         Reads the gaze from the given message and the sender id and saves it to received_gaze_positions
         Args:
-            message(str): the message
+            message(str|bytes): the message, either a binary gaze message or a text message "id:x,y"
+        """
+        self.save_gaze(*parse_gaze_message(message))
+
+    def save_gaze(self, sender_id, gaze, sent_time=None):
+        """
+        Saves the gaze of the sender with the current time as receive time
+        Args:
+            sender_id(str): the id of the sender
+            gaze(tuple(float, float)): the gaze
+            sent_time(float|None): the time the gaze was sent on the clock of the sender if known
+        """
+        current_time = time.time()
+        sent_time = self.to_local_sent_time(sender_id, sent_time, current_time)
+        if self.recorder is not None:
+            self.recorder.record_remote_gaze(sender_id, gaze, sent_time)
+        with self.lock:
+            self.received_gaze_positions[sender_id] = gaze
+            self.receive_times[sender_id] = time.monotonic()
+            self.receive_times.move_to_end(sender_id)
+            self.sent_times[sender_id] = sent_time
+            self.mark_changed()
+        if self.on_gaze_received is not None:
+            self.on_gaze_received()
+
+    def replace_gazes(self, gazes, sent_times=None):
+        """
+        Replaces all received gazes with the given ones, only the gazes which changed since the last call count as
+        received now (an unchanged gaze keeps its receive time, so that it fades out and expires, and stays
+        evicted once expired)
+        Args:
+            gazes(dict(str, tuple(float, float))): the gazes per sender id
+            sent_times(dict(str, float)|None): the times the gazes were sent on the clocks of the senders if known
+        """
+        current_time = time.time()
+        current_monotonic_time = time.monotonic()
+        sent_times = {} if sent_times is None else sent_times
+        changed_gazes = {}  # the changed gazes per sender id
+        removed = False
+        with self.lock:
+            for sender_id in [sender_id for sender_id in self.replaced_sent_times if sender_id not in gazes]:
+                del self.replaced_sent_times[sender_id]
+            for sender_id in [sender_id for sender_id in self.received_gaze_positions if sender_id not in gazes]:
+                self.received_gaze_positions.pop(sender_id)
+                self.receive_times.pop(sender_id, None)
+                self.sent_times.pop(sender_id, None)
+                removed = True
+            for sender_id, gaze in gazes.items():
+                sent_time = sent_times.get(sender_id)
+                if sender_id in self.replaced_sent_times and self.replaced_sent_times[sender_id] == sent_time \
+                        and (sent_time is not None or self.received_gaze_positions.get(sender_id) == gaze):
+                    continue
+                self.replaced_sent_times[sender_id] = sent_time
+                self.received_gaze_positions[sender_id] = gaze
+                self.receive_times[sender_id] = current_monotonic_time
+                self.receive_times.move_to_end(sender_id)
+                self.sent_times[sender_id] = self.to_local_sent_time(sender_id, sent_time, current_time)
+                changed_gazes[sender_id] = gaze
+            changed = removed or len(changed_gazes) > 0
+            if changed:
+                self.mark_changed()
+        if self.recorder is not None:
+            for sender_id, gaze in changed_gazes.items():  # the unchanged ones were recorded when they arrived
+                self.recorder.record_remote_gaze(sender_id, gaze, self.sent_times.get(sender_id))
+        if changed and self.on_gaze_received is not None:
+            self.on_gaze_received()
+
+    @staticmethod
+    def to_local_sent_time(sender_id, sent_time, current_time):
+        """
+        Maps the sent time to the local clock and records the latency of the receipt
+        Args:
+            sender_id(str): the id of the sender
+            sent_time(float|None): the time the gaze was sent on the clock of the sender or None if unknown
+            current_time(float): the time the gaze was received
+        Returns: (float) the time the gaze was sent on the local clock (the current time if unknown)
+        """
+        if sent_time is None:
+            return current_time
+        sent_time = clock_offset_estimator.to_local_time(sender_id, sent_time)
+        latency_monitor.record_stage(STAGE_RECEIVE, {sender_id: sent_time}, current_time)
+        return sent_time
+
+    def handle_clock_sync_message(self, message):
+        """
+        Queues the answer to a clock sync ping or adds the sample of a clock sync pong answering an own ping
+        Args:
+            message(bytes): the received clock sync message
+        """
+        current_time = time.time()
+        decoded = decode_clock_sync_message(message)
+        if decoded is None or self.peer_id is None:
+            return
+        kind, pinging_peer_id, answering_peer_id, ping_sent_time, ping_received_time, pong_sent_time = decoded
+        if kind == CLOCK_SYNC_PING and pinging_peer_id != self.peer_id:
+            self.clock_sync_answers.append((pinging_peer_id, ping_sent_time, current_time))
+        elif kind == CLOCK_SYNC_PONG and pinging_peer_id == self.peer_id:
+            clock_offset_estimator.add_sample(peer_id_to_string(answering_peer_id), ping_sent_time,
+                                              ping_received_time, pong_sent_time, current_time)
+
+    def pop_clock_sync_messages(self):
+        """
+        Returns: (list(bytes)) the queued answers to clock sync pings, each stamped with the current time as
+        sent time
+        """
+        messages = []
+        while len(self.clock_sync_answers) > 0:
+            pinging_peer_id, ping_sent_time, ping_received_time = self.clock_sync_answers.popleft()
+            messages.append(encode_clock_sync_message(CLOCK_SYNC_PONG, pinging_peer_id, self.peer_id,
+                                                      ping_sent_time, ping_received_time, time.time()))
+        return messages
+
+    def clock_sync_ping(self):
+        """
+        Returns: (bytes) a clock sync ping sent now
+        """
+        return encode_clock_sync_message(CLOCK_SYNC_PING, self.peer_id, bytes(16), time.time())
+
+    def remove_gaze(self, sender_id):
+        """
+        Removes the gaze of the sender immediately (e.g. because it left)
+        Args:
+            sender_id(str): the id of the sender
+        """
+        with self.lock:
+            self.received_gaze_positions.pop(sender_id, None)
+            self.receive_times.pop(sender_id, None)
+            self.sent_times.pop(sender_id, None)
+            self.mark_changed()
+        if self.on_gaze_received is not None:
+            self.on_gaze_received()
+
+    def evict_expired_gazes(self, current_time):
+        """
+        Removes the gazes received more than ttl ago, only the expired ones and the oldest remaining one are visited,
+        must be called with the lock held
+        Args:
+            current_time(float): the current monotonic time
+        """
+        evicted = False
+        while len(self.receive_times) > 0:
+            sender_id, receive_time = next(iter(self.receive_times.items()))
+            if current_time - receive_time < self.ttl:
+                break
+            self.receive_times.popitem(last=False)
+            self.received_gaze_positions.pop(sender_id, None)
+            self.sent_times.pop(sender_id, None)
+            evicted = True
+        if evicted:
+            self.mark_changed()
+
+    def mark_changed(self):
+        """
+        Increases the version so that the next read builds a new snapshot, in O(1) as it is called for every
+        received gaze, must be called with the lock held
         """
-        sender_id, pos_msg = message.split(":")
-        positions = pos_msg.split(",")
-        if len(positions) != 2:
-            print("Wrong gaze received: ", message)
-        gaze = float(positions[0]), float(positions[1])
-        self.received_gaze_positions[sender_id] = gaze
+        self.version += 1
+        oldest_receive_time = next(iter(self.receive_times.values())) if len(self.receive_times) > 0 else None
+        self.expiry_time = oldest_receive_time + self.ttl if oldest_receive_time is not None else None
+
+    def read_snapshot(self):
+        """
+        Reads the latest snapshot of the received gazes, without locking unless a gaze was received or expired
+        since the last read
+        Returns: (GazeSnapshot) the snapshot
+        """
+        if self.stopped:
+            raise ValueError("Stream is not running")
+        snapshot = self.snapshot
+        expiry_time = self.expiry_time
+        if snapshot.version != self.version or (expiry_time is not None and expiry_time <= time.monotonic()):
+            with self.lock:
+                self.evict_expired_gazes(time.monotonic())
+                if self.snapshot.version != self.version:
+                    self.snapshot = create_gaze_snapshot(self.version, self.received_gaze_positions,
+                                                         self.sent_times, self.receive_times, self.expiry_time)
+                snapshot = self.snapshot
+        return snapshot
 
     def read(self):
         """
         Reads the dictionary with the latest remote gaze positions
         Returns: (dict(str, tuple(float, float))) the gaze positions
         """
-        if self.stopped:
-            raise ValueError("Stream is not running")
-        return self.received_gaze_positions
+        snapshot = self.read_snapshot()
+        return dict(zip(snapshot.sender_ids, map(tuple, snapshot.positions.tolist())))
+
+    def read_sent_times(self):
+        """
+        Reads the times the received gazes were sent
+        Returns: (dict(str, float)) the times on the local clock per sender id
+        """
+        return dict(self.read_snapshot().sent_times)
+
+    def read_fade_weights(self, snapshot=None):
+        """
+        Reads the weights of the gazes which are fading out because they are about to expire
+        Args:
+            snapshot(GazeSnapshot|None): the snapshot the weights are calculated for or None for the latest one
+        Returns: (dict(str, float)) the weights between 0 and 1 of the fading gazes per sender id
+        """
+        if self.fade_time <= 0:
+            return {}
+        snapshot = self.read_snapshot() if snapshot is None else snapshot
+        remaining_times = self.ttl - (time.monotonic() - snapshot.receive_times)
+        fading = np.flatnonzero(remaining_times < self.fade_time)
+        return {snapshot.sender_ids[i]: max(remaining_times[i] / self.fade_time, 0) for i in fading}
+
+    def time_until_change(self):
+        """
+        Returns: (float|None) the time in seconds until the read gazes change without a new gaze being received
+        (because the oldest gaze starts fading or expires) or None if there are no gazes
+        """
+        expiry_time = self.expiry_time
+        if expiry_time is None:
+            return None
+        return max(expiry_time - max(self.fade_time, 0) - time.monotonic(), 0)
 
     def read_list(self):
         """
@@ -71,7 +363,9 @@ class SubscriberRemoteGazePositionStream(AbstractRemoteGazePositionStream):
         Starts the stream
         Returns: (AbstractRemoteGazePositionStream) self
         """
-        self.subscriber = setup_subscriber([TOPIC_GAZE_EXCHANGE], NETWORK_IPS)
+        self.subscriber = setup_subscriber([TOPIC_GAZE_EXCHANGE, TOPIC_BINARY_GAZE_EXCHANGE, TOPIC_CLOCK_SYNC],
+                                           NETWORK_IPS, [TOPIC_BINARY_GAZE_EXCHANGE, TOPIC_CLOCK_SYNC],
+                                           USE_BEACON_DISCOVERY)
         self.subscriber.start()
         t = Thread(target=self.update, name=self.name, args=())
         t.daemon = True
@@ -84,8 +378,139 @@ class SubscriberRemoteGazePositionStream(AbstractRemoteGazePositionStream):
         Updates the received gaze positions with the latest message
         """
         while not self.stopped:
-            _, message = self.subscriber.recv()
-            self.save_gaze_from_message(message)
+            topic, message = self.subscriber.recv()
+            if topic == TOPIC_CLOCK_SYNC:
+                self.handle_clock_sync_message(message)  # answered by the sending thread
+            else:
+                self.save_gaze_from_message(message)
+
+
+class RelayRemoteGazePositionStream(AbstractRemoteGazePositionStream):
+    def __init__(self):
+        super().__init__()
+        self.pusher = None
+
+    def start(self):
+        """
+        Starts the stream receiving the snapshots of the relay hub
+        Returns: (AbstractRemoteGazePositionStream) self
+        """
+        self.subscriber = Subscriber(RELAY_HUB_IP, RELAY_HUB_PUB_PORT, [TOPIC_GAZE_SNAPSHOT], [TOPIC_GAZE_SNAPSHOT])
+        self.subscriber.start()
+        self.pusher = Pusher(RELAY_HUB_IP, RELAY_HUB_PULL_PORT).start()
+        t = Thread(target=self.update, name=self.name, args=())
+        t.daemon = True
+        self.stopped = False
+        t.start()
+        return self
+
+    def update(self):
+        """
+        Replaces the received gaze positions with the latest snapshot
+        """
+        while not self.stopped:
+            _, snapshot = self.subscriber.recv()
+            self.save_gazes_from_snapshot(snapshot)
+
+    def save_gazes_from_snapshot(self, snapshot):
+        """
+        Replaces the received gaze positions with the gazes of the snapshot
+        Args:
+            snapshot(bytes): the concatenated binary gaze messages of all players
+        """
+        messages = decode_gaze_messages(snapshot)
+        sender_ids = [peer_id_to_string(peer_id.tobytes()) for peer_id in messages["peer_id"]]
+        self.replace_gazes({sender_id: (float(x), float(y))
+                            for sender_id, x, y in zip(sender_ids, messages["x"], messages["y"])},
+                           dict(zip(sender_ids, messages["timestamp"].tolist())))
+
+
+class MulticastRemoteGazePositionStream(AbstractRemoteGazePositionStream):
+    def __init__(self, group=MULTICAST_GROUP, port=MULTICAST_PORT, interface=MULTICAST_INTERFACE,
+                 multicast_ttl=MULTICAST_TTL):
+        """
+        Exchanges the gazes as binary gaze messages sent as UDP multicast datagrams, so that one datagram reaches
+        all players without connections. As datagrams can be reordered, messages older than the latest one received
+        from the same player are dropped
+        Args:
+            group(str): the multicast address
+            port(int): the multicast port
+            interface(str): the ip of the network interface ("127.0.0.1" for testing on one computer)
+            multicast_ttl(int): the number of hops the datagrams pass
+        """
+        super().__init__()
+        self.group = group
+        self.port = port
+        self.interface = interface
+        self.multicast_ttl = multicast_ttl  # not self.ttl, which is the time to live of the received gazes
+        self.peer_id = uuid.uuid4().bytes
+        self.latest_sequences = {}  # the sequence number of the latest message per peer id
+        self.dropped_messages = 0  # the number of reordered or duplicated messages
+        self.sender = None
+        self.receiver = None
+
+    def start(self):
+        """
+        Joins the multicast group and starts receiving
+        Returns: (AbstractRemoteGazePositionStream) self
+        """
+        self.receiver = create_multicast_receiver(self.group, self.port, self.interface, timeout=1)
+        self.sender = create_multicast_sender(self.interface, self.multicast_ttl)
+        t = Thread(target=self.update, name=self.name, args=())
+        t.daemon = True
+        self.stopped = False
+        t.start()
+        return self
+
+    def update(self):
+        """
+        Updates the received gaze positions with the received datagrams until stopped
+        """
+        while not self.stopped:
+            try:
+                message = self.receiver.recv(MAX_DATAGRAM_SIZE)
+            except socket.timeout:
+                continue
+            if decode_clock_sync_message(message) is not None:
+                self.handle_clock_sync_message(message)  # answered by the sending thread
+            elif is_gaze_message(message):
+                self.save_gaze_from_datagram(message)
+            else:
+                print("Wrong gaze received: ", message)
+        self.receiver.close()
+
+    def save_gaze_from_datagram(self, message):
+        """
+        Saves the gaze of the binary gaze message unless it is an own one or not newer than the latest of the sender
+        Args:
+            message(bytes): the binary gaze message
+        """
+        peer_id, sequence, timestamp, x, y, _ = decode_gaze_message(message)
+        if peer_id == self.peer_id:
+            return  # the own messages are looped back
+        if not is_newer_sequence(sequence, self.latest_sequences.get(peer_id)):
+            self.dropped_messages += 1
+            return
+        self.latest_sequences[peer_id] = sequence
+        self.save_gaze(peer_id_to_string(peer_id), (x, y), timestamp)
+
+    def send_gaze(self, gaze, sequence_number, confidence=1.0):
+        """
+        Sends the gaze to the group
+        Args:
+            gaze(tuple(float, float)): the gaze
+            sequence_number(int): the sequence number of the gaze
+            confidence(float): the confidence of the gaze
+        """
+        self.send_raw(encode_gaze_message(self.peer_id, sequence_number, time.time(), gaze, confidence))
+
+    def send_raw(self, message):
+        """
+        Sends the message as one datagram to the group
+        Args:
+            message(bytes): the message
+        """
+        self.sender.sendto(message, (self.group, self.port))
 
 
 class PyreRemoteGazePositionStream(AbstractRemoteGazePositionStream):
@@ -99,7 +524,7 @@ class PyreRemoteGazePositionStream(AbstractRemoteGazePositionStream):
         Starts the stream
         Returns: (AbstractRemoteGazePositionStream) self
         """
-        ctx = zmq.Context()
+        ctx = get_context()
         self.stopped = False
         self.pyre_pipe = zhelper.zthread_fork(ctx, self.gaze_exchange_task)
         return self
@@ -119,8 +544,9 @@ class PyreRemoteGazePositionStream(AbstractRemoteGazePositionStream):
             pipe(zmq.PAIR pipe): the pipe for exchanging messages
         Returns: (zmq.PAIR pipe) the pipe
         """
-        n = Pyre("GAZE_EXCHANGE")
+        n = Pyre("GAZE_EXCHANGE", ctx=ctx)
         self.publisher_id = n.uuid()
+        self.peer_id = self.publisher_id.bytes
         n.join(GROUP_GAZE_EXCHANGE)
         n.start()
 
@@ -136,26 +562,34 @@ class PyreRemoteGazePositionStream(AbstractRemoteGazePositionStream):
             if pipe in items and items[pipe] == zmq.POLLIN:
                 message = pipe.recv()
                 # message to quit
-                message = message.decode('utf-8')
-                if message == STOP_MESSAGE:
+                if message == STOP_MESSAGE.encode("utf-8"):
                     break
                 print("GAZE_EXCHANGE_TASK: {}".format(message))
-                self.save_gaze_from_message(message)
-                n.shouts(GROUP_GAZE_EXCHANGE, message)
+                if decode_clock_sync_message(message) is None:
+                    self.save_gaze_from_message(message)
+                n.shout(GROUP_GAZE_EXCHANGE, message)
             else:
                 cmds = n.recv()
                 msg_type = cmds.pop(0)
                 print("NODE_MSG TYPE: %s" % msg_type)
-                print("NODE_MSG PEER: %s" % uuid.UUID(bytes=cmds.pop(0)))
+                peer = uuid.UUID(bytes=cmds.pop(0))
+                print("NODE_MSG PEER: %s" % peer)
                 print("NODE_MSG NAME: %s" % cmds.pop(0))
                 if msg_type.decode('utf-8') == "SHOUT":
                     print("NODE_MSG GROUP: %s" % cmds.pop(0))
-                    message = cmds.pop(0).decode("utf-8")
-                    self.save_gaze_from_message(message)
+                    message = cmds.pop(0)
+                    if decode_clock_sync_message(message) is not None:
+                        self.handle_clock_sync_message(message)
+                        for answer in self.pop_clock_sync_messages():
+                            n.shout(GROUP_GAZE_EXCHANGE, answer)
+                    else:
+                        self.save_gaze_from_message(message)
                 elif msg_type.decode('utf-8') == "ENTER":
                     headers = json.loads(cmds.pop(0).decode('utf-8'))
                     print("NODE_MSG HEADERS: %s" % headers)
                     for key in headers:
                         print("key = {0}, value = {1}".format(key, headers[key]))
+                elif msg_type.decode('utf-8') == "EXIT":
+                    self.remove_gaze(str(peer))
                 print("NODE_MSG CONT: %s" % cmds)
         n.stop()
@@ -0,0 +1,191 @@
+import argparse
+import math
+import os
+import struct
+import time
+import uuid
+from threading import Thread, Lock
+
+import numpy as np
+
+from config import *
+from messaging.gaze_message import peer_id_to_string
+from messaging.remote_gaze_position_stream import AbstractRemoteGazePositionStream
+
+SESSION_LOG_MAGIC = b"WAYLLOG"
+SESSION_LOG_VERSION = 1
+SESSION_LOG_HEADER = struct.Struct("<7sB")  # magic, version (followed by the records)
+# the time the event was recorded, the kind of the event, the peer id, x, y and the time the gaze was sent (local
+# clock, nan if unknown)
+SESSION_RECORD_STRUCT = struct.Struct("<dB16sffd")
+# the same layout as numpy dtype, used to read the log as memory-mapped array
+SESSION_RECORD_DTYPE = np.dtype([("time", "<f8"), ("kind", "u1"), ("peer_id", "V16"), ("x", "<f4"), ("y", "<f4"),
+                                 ("sent_time", "<f8")])
+EVENT_LOCAL_GAZE = 0  # a gaze of the own eye tracker
+EVENT_REMOTE_GAZE = 1  # a gaze received from another player
+REPLAY_CHUNK_SIZE = 4096  # the number of records copied from the log at once while replaying
+
+assert SESSION_RECORD_DTYPE.itemsize == SESSION_RECORD_STRUCT.size
+
+
+def sender_id_to_peer_id(sender_id):
+    """
+    Args:
+        sender_id(str): the id of a sender as used as key for the received gaze positions
+    Returns: (bytes) the 16 bytes peer id (derived from the sender id if it is no uuid)
+    """
+    try:
+        return uuid.UUID(sender_id).bytes
+    except ValueError:
+        return uuid.uuid5(uuid.NAMESPACE_URL, sender_id).bytes
+
+
+def read_session_log(path):
+    """
+    Maps the records of the session log into memory without reading them, an incompletely written last record is
+    left out
+    Args:
+        path(str): the path of the log
+    Returns: (ndarray) the records with the fields of SESSION_RECORD_DTYPE
+    """
+    with open(path, "rb") as log:
+        magic, version = SESSION_LOG_HEADER.unpack(log.read(SESSION_LOG_HEADER.size))
+    if magic != SESSION_LOG_MAGIC or version != SESSION_LOG_VERSION:
+        raise ValueError("{} is no session log of version {}".format(path, SESSION_LOG_VERSION))
+    number_of_records = (os.path.getsize(path) - SESSION_LOG_HEADER.size) // SESSION_RECORD_DTYPE.itemsize
+    if number_of_records == 0:
+        return np.empty(0, dtype=SESSION_RECORD_DTYPE)
+    return np.memmap(path, dtype=SESSION_RECORD_DTYPE, mode="r", offset=SESSION_LOG_HEADER.size,
+                     shape=(number_of_records,))
+
+
+class SessionRecorder:
+    def __init__(self, path, peer_id=None):
+        """
+        Creates a recorder appending the local and remote gaze events to the session log at the path
+        Args:
+            path(str): the path of the log, created if it does not exist
+            peer_id(bytes|None): the 16 bytes id the local gazes are recorded with or None for a new one
+        """
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            read_session_log(path)  # raises if the file is no session log
+        self.path = path
+        self.peer_id = uuid.uuid4().bytes if peer_id is None else peer_id
+        self.file = open(path, "ab")
+        if self.file.tell() == 0:
+            self.file.write(SESSION_LOG_HEADER.pack(SESSION_LOG_MAGIC, SESSION_LOG_VERSION))
+        self.recorded_events = 0
+        self.lock = Lock()  # the events are recorded from the threads of the different streams
+
+    def record_local_gaze(self, gaze, recorded_time=None):
+        """
+        Records a gaze of the own eye tracker
+        Args:
+            gaze(tuple(float, float)): the gaze
+            recorded_time(float|None): the time the gaze was received from the eye tracker or None for now
+        """
+        recorded_time = time.time() if recorded_time is None else recorded_time
+        self.record(EVENT_LOCAL_GAZE, self.peer_id, gaze, recorded_time, recorded_time)
+
+    def record_remote_gaze(self, sender_id, gaze, sent_time=None):
+        """
+        Records a gaze received from another player now
+        Args:
+            sender_id(str): the id of the sender
+            gaze(tuple(float, float)): the gaze
+            sent_time(float|None): the time the gaze was sent on the local clock if known
+        """
+        self.record(EVENT_REMOTE_GAZE, sender_id_to_peer_id(sender_id), gaze, time.time(), sent_time)
+
+    def record(self, kind, peer_id, gaze, event_time, sent_time=None):
+        """
+        Appends the event to the log
+        Args:
+            kind(int): EVENT_LOCAL_GAZE or EVENT_REMOTE_GAZE
+            peer_id(bytes): the 16 bytes id of the player
+            gaze(tuple(float, float)): the gaze
+            event_time(float): the time of the event
+            sent_time(float|None): the time the gaze was sent if known
+        """
+        record = SESSION_RECORD_STRUCT.pack(event_time, kind, peer_id, gaze[0], gaze[1],
+                                            math.nan if sent_time is None else sent_time)
+        with self.lock:
+            if self.file.closed:
+                return
+            self.file.write(record)
+            self.recorded_events += 1
+
+    def close(self):
+        """
+        Writes the buffered events and closes the log
+        """
+        with self.lock:
+            self.file.close()
+
+
+class ReplayRemoteGazePositionStream(AbstractRemoteGazePositionStream):
+    def __init__(self, path, speed=SESSION_REPLAY_SPEED, include_local=True):
+        """
+        Replays the gaze events of a session log as if they were received now
+        Args:
+            path(str): the path of the log
+            speed(float): the factor the session is sped up with (0 to replay as fast as possible)
+            include_local(bool): if the local gazes of the recording player are replayed as well
+        """
+        super().__init__("ReplayRemoteGazePositionStream")
+        self.path = path
+        self.speed = speed
+        self.include_local = include_local
+        self.replayed_events = 0
+        self.finished = False  # if all events were replayed, the last gazes stay readable until they expire
+        self.thread = None
+
+    def start(self):
+        """
+        Starts replaying on a new Thread
+        Returns: (AbstractRemoteGazePositionStream) self
+        """
+        self.thread = Thread(target=self.update, name=self.name, args=())
+        self.thread.daemon = True
+        self.stopped = False
+        self.thread.start()
+        return self
+
+    def update(self):
+        """
+        Saves the gazes of the log in the recorded intervals divided by the speed until stopped or finished
+        """
+        records = read_session_log(self.path)
+        start_time = time.monotonic()
+        first_event_time = records[0]["time"] if len(records) > 0 else 0
+        for chunk_start in range(0, len(records), REPLAY_CHUNK_SIZE):
+            for event_time, kind, peer_id, x, y, sent_time in \
+                    records[chunk_start:chunk_start + REPLAY_CHUNK_SIZE].tolist():
+                if self.stopped:
+                    return
+                if kind == EVENT_LOCAL_GAZE and not self.include_local:
+                    continue
+                if self.speed > 0:
+                    delay = start_time + (event_time - first_event_time) / self.speed - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                # shifted to now keeping the recorded latency
+                sent_time = None if math.isnan(sent_time) else time.time() - (event_time - sent_time)
+                self.save_gaze(peer_id_to_string(peer_id), (x, y), sent_time)
+                self.replayed_events += 1
+        self.finished = True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replays a session log as fast as possible and prints its summary")
+    parser.add_argument("path", help="the path of the session log")
+    args = parser.parse_args()
+    session_records = read_session_log(args.path)
+    if len(session_records) > 0:
+        print("{} events of {} players in {:.1f} s".format(
+            len(session_records), len(np.unique(session_records["peer_id"])),
+            session_records["time"][-1] - session_records["time"][0]))
+    replay_start_time = time.monotonic()
+    stream = ReplayRemoteGazePositionStream(args.path, speed=0).start()
+    stream.thread.join()
+    print("Replayed {} events in {:.3f} s".format(stream.replayed_events, time.monotonic() - replay_start_time))
@@ -0,0 +1,35 @@
+import time
+
+from messaging import gaze_exchange
+from messaging.session_recording import SessionRecorder, ReplayRemoteGazePositionStream
+
+
+def test_replay_with_sending_enabled(tmp_path, monkeypatch):
+    """
+    Replaying a session while the own gazes are offered as with the eye tracker running must not use the transport
+    of the configured networking
+    """
+    path = str(tmp_path / "session.log")
+    recorder = SessionRecorder(path)
+    recorder.record_remote_gaze("replayed_player", (0.25, 0.75), time.time())
+    recorder.close()
+    monkeypatch.setattr(gaze_exchange, "SESSION_REPLAY_PATH", path)
+    monkeypatch.setattr(gaze_exchange, "SESSION_RECORDING_PATH", None)
+    monkeypatch.setattr(gaze_exchange, "publisher_id", None)
+    monkeypatch.setattr(gaze_exchange, "send_policy", None)
+    stream = gaze_exchange.setup_gaze_exchange()
+    assert isinstance(stream, ReplayRemoteGazePositionStream)
+    stream.speed = 0
+    stream.start()
+    try:
+        for transport in ["USE_PYRE_NETWORKING", "USE_RELAY_HUB", "USE_ASYNC_RUNTIME", "USE_MULTICAST", None]:
+            for flag in ["USE_PYRE_NETWORKING", "USE_RELAY_HUB", "USE_ASYNC_RUNTIME", "USE_MULTICAST"]:
+                monkeypatch.setattr(gaze_exchange, flag, flag == transport)
+            assert not gaze_exchange.offer_gaze((0.5, 0.5), recorded_time=time.time())
+            gaze_exchange.send_gaze((0.5, 0.5))
+            gaze_exchange.exchange_clock_sync()
+        stream.thread.join(5)
+        assert stream.finished
+        assert len(stream.read_snapshot().sender_ids) == 1
+    finally:
+        stream.stop()
@@ -1,31 +1,216 @@
+import heapq
+import socket
 import time
-from threading import Thread
+from collections import deque
+from threading import Thread, Lock
 
 import msgpack
 import zmq
 from netifaces import interfaces, ifaddresses, AF_INET
 
 ALIVE_TOPIC = "_alive"
+ENDPOINT_POLL_INTERVAL = 100  # the interval in milliseconds in which added endpoints are connected while receiving
+REQUEST_TIMEOUT = 2500  # the time in milliseconds a requester waits for a reply before the request is retried
+REQUEST_RETRIES = 3  # the number of times a request is sent on a new socket before giving up
+REQUESTER_HEALTH_CHECK_INTERVAL = 30  # the idle time in seconds after which a requester is checked before reuse
+
+_requester_pools = {}  # the requester pools per endpoint
+_requester_pools_lock = Lock()
+
+
+def get_context():
+    """
+    Returns: (zmq.Context) the context shared by all sockets of the process
+    """
+    return zmq.Context.instance()
+
+
+class RequesterPool:
+    def __init__(self, ip, port, timeout=REQUEST_TIMEOUT, retries=REQUEST_RETRIES, health_check_request=None,
+                 health_check_interval=REQUESTER_HEALTH_CHECK_INTERVAL):
+        """
+        Creates a pool of zmq.REQ sockets connected to one endpoint (e.g. Pupil Remote) which are reused for
+        requests instead of connecting a new socket each time. A socket which did not get a reply within the timeout
+        is closed and the request is retried on a new one (as a REQ socket cannot send again before it received)
+        Args:
+            ip(str): the ip of the endpoint
+            port(int): the port of the endpoint
+            timeout(int): the time in milliseconds to wait for a reply
+            retries(int): the number of times a request is sent before giving up
+            health_check_request(list(bytes)|None): a cheap request sent on sockets idle for longer than
+            health_check_interval before they are reused (None to reuse them unchecked)
+            health_check_interval(float): the idle time in seconds after which a socket is checked
+        """
+        self.endpoint = "tcp://{}:{}".format(ip, port)
+        self.timeout = timeout
+        self.retries = retries
+        self.health_check_request = health_check_request
+        self.health_check_interval = health_check_interval
+        self.idle_requesters = deque()  # the connected sockets not in use with the time they were last used
+        self.lock = Lock()
+
+    def request(self, frames):
+        """
+        Sends the request and waits for the reply, can be called from several threads at once
+        Args:
+            frames(list(bytes)): the frames of the request
+        Returns: (list(bytes)) the frames of the reply
+        """
+        for _ in range(self.retries):
+            requester = self._acquire()
+            reply = self._request(requester, frames)
+            if reply is not None:
+                self._release(requester)
+                return reply
+            print("No reply from {}, retrying with a new socket".format(self.endpoint))
+        raise TimeoutError("No reply from {} after {} tries".format(self.endpoint, self.retries))
+
+    def _request(self, requester, frames):
+        """
+        Sends the request on the socket and closes the socket if no reply arrived
+        Returns: (list(bytes)|None) the reply or None if timed out
+        """
+        requester.send_multipart(frames)
+        # noinspection PyUnresolvedReferences
+        if requester.poll(self.timeout, zmq.POLLIN):
+            return requester.recv_multipart()
+        requester.close(linger=0)
+        return None
+
+    def _acquire(self):
+        """
+        Returns an idle healthy socket or a newly connected one
+        """
+        while True:
+            with self.lock:
+                if len(self.idle_requesters) == 0:
+                    break
+                requester, last_used_time = self.idle_requesters.pop()
+            if self.health_check_request is None or time.time() - last_used_time < self.health_check_interval \
+                    or self._request(requester, self.health_check_request) is not None:
+                return requester
+        # noinspection PyUnresolvedReferences
+        requester = get_context().socket(zmq.REQ)
+        requester.connect(self.endpoint)
+        return requester
+
+    def _release(self, requester):
+        with self.lock:
+            self.idle_requesters.append((requester, time.time()))
+
+    def close(self):
+        """
+        Closes all idle sockets
+        """
+        with self.lock:
+            while len(self.idle_requesters) > 0:
+                self.idle_requesters.pop()[0].close(linger=0)
+
+
+def get_requester_pool(ip, port, **kwargs):
+    """
+    Returns the requester pool of the process for the endpoint, it is created with the kwargs on the first call
+    Args:
+        ip(str): the ip of the endpoint
+        port(int): the port of the endpoint
+        kwargs: passed to RequesterPool
+    Returns: (RequesterPool) the pool
+    """
+    with _requester_pools_lock:
+        if (ip, port) not in _requester_pools:
+            _requester_pools[(ip, port)] = RequesterPool(ip, port, **kwargs)
+        return _requester_pools[(ip, port)]
+
+
+class LivenessTracker:
+    def __init__(self, timeout):
+        """
+        Tracks which endpoints sent an alive signal within the timeout with a heap of expiry times, so that a
+        heartbeat costs O(log n) and finding the expired endpoints only visits those which expired. Outdated heap
+        entries of endpoints with a newer heartbeat are skipped when popped. Can be used from several threads
+        Args:
+            timeout(float): the timeout in seconds
+        """
+        self.timeout = timeout
+        self.last_alive_times = {}  # the tracked endpoints with their last alive time
+        self.expiry_heap = []  # the expiry times with their endpoints, possibly outdated
+        self.lock = Lock()
+
+    def add(self, endpoint, current_time):
+        """
+        Starts tracking the endpoint as alive now
+        Args:
+            endpoint(tuple(str, int)): the ip and port
+            current_time(float): the current time
+        """
+        with self.lock:
+            self._set_alive(endpoint, current_time)
+
+    def heartbeat(self, endpoint, current_time):
+        """
+        Marks the endpoint as alive now if it is tracked
+        Args:
+            endpoint(tuple(str, int)): the ip and port
+            current_time(float): the current time
+        Returns: (bool) False if the endpoint is not tracked (never added or expired)
+        """
+        with self.lock:
+            if endpoint not in self.last_alive_times:
+                return False
+            self._set_alive(endpoint, current_time)
+            return True
+
+    def _set_alive(self, endpoint, current_time):
+        self.last_alive_times[endpoint] = current_time
+        heapq.heappush(self.expiry_heap, (current_time + self.timeout, endpoint))
+
+    def pop_expired(self, current_time):
+        """
+        Stops tracking the endpoints without an alive signal within the timeout
+        Args:
+            current_time(float): the current time
+        Returns: (list(tuple(str, int))) the expired endpoints
+        """
+        expired = []
+        with self.lock:
+            while len(self.expiry_heap) > 0 and self.expiry_heap[0][0] <= current_time:
+                _, endpoint = heapq.heappop(self.expiry_heap)
+                last_alive_time = self.last_alive_times.get(endpoint)
+                if last_alive_time is not None and last_alive_time + self.timeout <= current_time:
+                    del self.last_alive_times[endpoint]
+                    expired.append(endpoint)
+        return expired
 
 
 class Subscriber:
-    def __init__(self, ip, port, subjects):
+    def __init__(self, ip, port, subjects, raw_subjects=()):
         """
         Creates a Subscriber wrapping a zmq.SUB socket listening to the given subjects
         Args:
             ip(str|None): the ip to subscribe to (can be None if add_additional_ips is used)
             port(int|None): the port to subscribe on (can be None if add_additional_ips is used)
             subjects(list(str)): the subject to subscribe on
+            raw_subjects(iterable(str)): the subjects of subjects whose messages are not msgpack encoded
+            and are returned as bytes
         """
-        self.ip_and_ports = {}  # the ip-port-combinations with their last alive time
+        self.ip_and_ports = {}  # the connected ip-port-combinations (only changed by the receiving thread)
         if ip is not None and port is not None:
-            self.ip_and_ports[(ip, port)] = 0.0
+            self.ip_and_ports[(resolve_ip(ip), port)] = 0.0
         self.subjects = subjects
+        self.raw_subjects = set(raw_subjects)
         # noinspection PyUnresolvedReferences
-        self.subscriber = zmq.Context().socket(zmq.SUB)
+        self.subscriber = get_context().socket(zmq.SUB)
         self.check_alive_thread = None
         self.timeout = 0
         self.check_alive_subscriber = None
+        self.liveness_tracker = None
+        self.disconnected_endpoints = set()  # the endpoints disconnected for missing alive signals
+        self.discovering = False  # if endpoints are added while receiving
+        self.pending_endpoints = deque()  # the endpoints added from other threads which are not connected yet
+        # guards the disconnected endpoints which are changed by the check alive thread and read by add_endpoint
+        self.endpoints_lock = Lock()
+        # the endpoints which expired in the check alive thread and are disconnected by the receiving thread
+        self.pending_disconnects = deque()
 
     def add_additional_ips(self, ip_and_ports):
         """
@@ -35,49 +220,84 @@ class Subscriber:
         Returns: (Subscriber) self
         """
         for ip, port in ip_and_ports:
-            self.ip_and_ports[(ip, port)] = 0.0
+            self.ip_and_ports[(resolve_ip(ip), port)] = 0.0
         return self
 
+    def add_endpoint(self, ip, port):
+        """
+        Adds an ip-port-combination while the subscriber is running, can be called from any thread,
+        the connection is made by the receiving thread
+        Args:
+            ip(str): the ip
+            port(int): the port
+        """
+        ip = resolve_ip(ip)
+        self.discovering = True
+        with self.endpoints_lock:
+            self.pending_endpoints.append((ip, port))
+            if self.liveness_tracker is not None and (ip, port) not in self.disconnected_endpoints:
+                self.liveness_tracker.add((ip, port), time.time())
+        if self.check_alive_subscriber is not None:
+            self.check_alive_subscriber.add_endpoint(ip, port)
+
+    def connect_pending_endpoints(self):
+        """
+        Connects to the endpoints added with add_endpoint which are not connected yet
+        """
+        while len(self.pending_endpoints) > 0:
+            ip, port = self.pending_endpoints.popleft()
+            if (ip, port) in self.ip_and_ports:
+                continue
+            self.ip_and_ports[(ip, port)] = 0.0
+            self.subscriber.connect("tcp://{}:{}".format(ip, port))
+
+    def disconnect_pending_endpoints(self):
+        """
+        Disconnects from the expired endpoints at once, zmq disconnects in the background so this does not block
+        """
+        while len(self.pending_disconnects) > 0:
+            ip, port = self.pending_disconnects.popleft()
+            if self.ip_and_ports.pop((ip, port), None) is None:
+                continue
+            try:
+                self.subscriber.disconnect("tcp://{}:{}".format(ip, port))
+            except zmq.ZMQError as e:
+                print("error", e)
+
     def set_connection_timeout(self, timeout):
         """
-        Sets a connection timeout after which all connections which did not recently send an ALIVE_TOPIC message
-        are disconnected
+        Sets a connection timeout after which the connections which did not recently send an ALIVE_TOPIC message
+        are disconnected, they are connected again as soon as they send an alive signal again
         Args:
             timeout(int): the timeout in milliseconds
         """
         self.check_alive_subscriber = Subscriber("", 0, []).add_additional_ips(self.ip_and_ports.keys())
         # noinspection PyUnresolvedReferences
         self.check_alive_subscriber.subscriber.setsockopt(zmq.SUBSCRIBE, ALIVE_TOPIC.encode())
+        self.liveness_tracker = LivenessTracker(timeout / 1000)
+        current_time = time.time()
+        for ip_and_port in list(self.ip_and_ports.keys()) + list(self.pending_endpoints):
+            self.liveness_tracker.add(ip_and_port, current_time)
 
         def check_alive():
-            last_check_time = time.time()
             while True:
-                received = self.check_alive_subscriber.recv(self.timeout)
-                if received is None:  # did not get any alive signal -> disconnect from all ips
-                    break
-                if received[1] is None:
-                    continue
-                alive_ip, alive_port = received[1].split(":")
-                alive_port = int(alive_port)
+                # wake up at least every timeout to disconnect the expired endpoints even if no one is alive
+                received = self.check_alive_subscriber.recv(self.timeout, log_timeout=False)
                 current_time = time.time()
-                if (alive_ip, alive_port) in self.ip_and_ports:
-                    self.ip_and_ports[(alive_ip, alive_port)] = current_time  # update last alive time
-                if current_time - last_check_time > self.timeout / 1000:  # check all ips for alive
-                    last_check_time = current_time
-                    remaining_ips = {}
-                    for (ip, port), last_alive_time in self.ip_and_ports.items():
-                        if current_time - last_alive_time < timeout:
-                            remaining_ips[(ip, port)] = self.ip_and_ports[(ip, port)]
-                        else:
-                            try:
-                                self.subscriber.disconnect("tcp://{}:{}".format(ip, port))
-                                time.sleep(0.001)
-                            except zmq.ZMQError as e:
-                                print("error", e)
-                                pass
-                    self.ip_and_ports = remaining_ips
-            self.ip_and_ports.clear()
-            self.subscriber.close()
+                if received is not None and received[1] is not None:
+                    alive_ip, alive_port = received[1].split(":")
+                    alive_endpoint = resolve_ip(alive_ip), int(alive_port)
+                    with self.endpoints_lock:
+                        if not self.liveness_tracker.heartbeat(alive_endpoint, current_time) \
+                                and alive_endpoint in self.disconnected_endpoints:  # reappeared -> connect again
+                            self.disconnected_endpoints.discard(alive_endpoint)
+                            self.liveness_tracker.add(alive_endpoint, current_time)
+                            self.pending_endpoints.append(alive_endpoint)
+                expired_endpoints = self.liveness_tracker.pop_expired(current_time)
+                if len(expired_endpoints) > 0:
+                    with self.endpoints_lock:
+                        self.disconnected_endpoints.update(expired_endpoints)
+                    self.pending_disconnects.extend(expired_endpoints)
 
         self.timeout = timeout
         if self.check_alive_thread is None:
@@ -91,6 +311,7 @@ class Subscriber:
         """
         for ip, port in self.ip_and_ports:
             self.subscriber.connect("tcp://{}:{}".format(ip, port))
+        self.connect_pending_endpoints()
         for s in self.subjects:
             if s == ALIVE_TOPIC:
                 raise ValueError("topic {} is reserved".format(ALIVE_TOPIC))
@@ -101,32 +322,39 @@ class Subscriber:
             self.check_alive_thread.start()
         return self
 
-    def recv(self, timeout=None):
+    def recv(self, timeout=None, log_timeout=True):
         """
         Receives the next message from the subscriber
         Args:
             timeout(int|None): if not None the maximal timeout milliseconds are waited for a message
+            log_timeout(bool): if a timeout is printed (False for polling regularly)
         Returns: (str|None) the received message or None if timed out
         """
+        end_time = time.time() + timeout / 1000 if timeout is not None else None
         while True:
             try:
-                if timeout is not None:
+                self.connect_pending_endpoints()
+                self.disconnect_pending_endpoints()
+                poll_timeout = max(int((end_time - time.time()) * 1000), 0) if end_time is not None else None
+                if self.discovering or self.liveness_tracker is not None:
+                    # wake up regularly to connect to the added and disconnect from the expired endpoints
+                    poll_timeout = ENDPOINT_POLL_INTERVAL if poll_timeout is None \
+                        else min(poll_timeout, ENDPOINT_POLL_INTERVAL)
+                if poll_timeout is not None:
                     # self.subscriber.RCVTIMEO = timeout
                     # noinspection PyUnresolvedReferences
-                    if self.subscriber.poll(timeout, zmq.POLLIN):
+                    if self.subscriber.poll(poll_timeout, zmq.POLLIN):
                         # noinspection PyUnresolvedReferences
                         received = self.subscriber.recv_multipart(zmq.NOBLOCK)
-                    else:
-                        print("timeout error")
+                    elif end_time is not None and time.time() >= end_time:
+                        if log_timeout:
+                            print("timeout error")
                         return None
+                    else:
+                        continue
                 else:
                     received = self.subscriber.recv_multipart()
-                topic = received[0]
-                message = msgpack.loads(received[1]) if len(received) > 1 else None
-                if type(message) is bytes:
-                    message = message.decode()
-                topic = topic.decode()
-                return topic, message
+                return decode_message(received, self.raw_subjects)
             except zmq.error.Again:
                 continue
 
@@ -140,7 +368,7 @@ class Publisher:
         """
         self.pub_port = pub_port
         # noinspection PyUnresolvedReferences
-        self.publisher = zmq.Context().socket(zmq.PUB)
+        self.publisher = get_context().socket(zmq.PUB)
 
     def start(self):
         """
@@ -157,11 +385,12 @@ class Publisher:
         Args:
             interval(int): the interval in milliseconds
             port_range(range): the port range to send the alive signal on
+        Returns: (Publisher) the publisher sending the alive signal
         """
         pub_ips = get_own_ips()
+        alive_publisher = setup_publisher(port_range)
 
         def send_alive():
-            alive_publisher = setup_publisher(port_range)
             while True:
                 for ip in pub_ips:
                     alive_publisher.send(ALIVE_TOPIC, "{}:{}".format(ip, self.pub_port))
@@ -171,6 +400,7 @@ class Publisher:
         send_alive_thread = Thread(target=send_alive, name="send_alive", args=())
         send_alive_thread.setDaemon(True)
         send_alive_thread.start()
+        return alive_publisher
 
     def send(self, topic, message):
         """
@@ -183,6 +413,106 @@ class Publisher:
         payload = msgpack.dumps(message)
         self.publisher.send_multipart((topic.encode(), payload))
 
+    def send_raw(self, topic, payload):
+        """
+        Sends an already encoded message for a specific topic (received as raw subject by the Subscriber)
+        Args:
+            topic(str): the topic
+            payload(bytes): the message
+        """
+        self.publisher.send_multipart((topic.encode(), payload))
+
+
+class Pusher:
+    def __init__(self, ip, port, queue_size=10):
+        """
+        Creates a Pusher wrapping a zmq.PUSH socket which sends messages to one Puller,
+        messages are dropped instead of queued if the Puller is not reachable
+        Args:
+            ip(str): the ip of the Puller
+            port(int): the port of the Puller
+            queue_size(int): the number of messages queued while the Puller is not reachable
+        """
+        self.ip = ip
+        self.port = port
+        # noinspection PyUnresolvedReferences
+        self.pusher = get_context().socket(zmq.PUSH)
+        # noinspection PyUnresolvedReferences
+        self.pusher.setsockopt(zmq.SNDHWM, queue_size)
+        # noinspection PyUnresolvedReferences
+        self.pusher.setsockopt(zmq.LINGER, 0)
+
+    def start(self):
+        """
+        Connects the pusher to the Puller
+        Returns: (Pusher) self
+        """
+        self.pusher.connect("tcp://{}:{}".format(self.ip, self.port))
+        return self
+
+    def send_raw(self, payload):
+        """
+        Sends an encoded message
+        Args:
+            payload(bytes): the message
+        Returns: (bool) False if the message was dropped
+        """
+        try:
+            # noinspection PyUnresolvedReferences
+            self.pusher.send(payload, zmq.NOBLOCK)
+            return True
+        except zmq.error.Again:
+            return False
+
+
+class Puller:
+    def __init__(self, port):
+        """
+        Creates a Puller wrapping a zmq.PULL socket which receives the messages of all Pushers
+        Args:
+            port(int): the port to receive on
+        """
+        self.port = port
+        # noinspection PyUnresolvedReferences
+        self.puller = get_context().socket(zmq.PULL)
+
+    def start(self):
+        """
+        Binds the puller to the given port
+        Returns: (Puller) self
+        """
+        self.puller.bind("tcp://*:{}".format(self.port))
+        return self
+
+    def recv_raw(self, timeout=None):
+        """
+        Receives the next message
+        Args:
+            timeout(int|None): if not None the maximal timeout milliseconds are waited for a message
+        Returns: (bytes|None) the message or None if timed out
+        """
+        # noinspection PyUnresolvedReferences
+        if timeout is not None and not self.puller.poll(timeout, zmq.POLLIN):
+            return None
+        return self.puller.recv()
+
+
+def decode_message(received, raw_subjects=()):
+    """
+    Decodes the frames of a message received by a zmq.SUB socket
+    Args:
+        received(list(bytes)): the frames, the topic followed by the (msgpack encoded) message
+        raw_subjects(iterable(str)): the subjects whose messages are not msgpack encoded and are returned as bytes
+    Returns: (tuple(str, object)) the topic and the message
+    """
+    topic = received[0].decode()
+    if topic in raw_subjects:
+        return topic, received[1] if len(received) > 1 else None
+    message = msgpack.loads(received[1]) if len(received) > 1 else None
+    if type(message) is bytes:
+        message = message.decode()
+    return topic, message
+
 
 def setup_publisher(port_range):
     """
@@ -205,6 +535,19 @@ def setup_publisher(port_range):
     raise zmq.error.ZMQError(-1, "No unused port found in PORT_RANGE")
 
 
+def resolve_ip(ip):
+    """
+    Resolves a host name (e.g. "localhost") to the ip announced in alive signals
+    Args:
+        ip(str): the ip or host name
+    Returns: (str) the ip or the unchanged host name if it cannot be resolved
+    """
+    try:
+        return socket.gethostbyname(ip) if ip else ip
+    except socket.error:
+        return ip
+
+
 def get_own_ips():
     """
     Returns the ips of this device for every interface
@@ -1,3 +1,5 @@
+from config import *
+from messaging.beacon import BeaconBroadcaster, BeaconListener
 from messaging.zmq_classes import Subscriber, get_own_ips, setup_publisher as _setup_publisher
 
 CONNECTION_TIMEOUT = 10000
@@ -15,19 +17,24 @@ def subscribe_test():
         print(len(subscriber.ip_and_ports))
 
 
-def setup_subscriber(topics, ips=None):
+def setup_subscriber(topics, ips=None, raw_topics=(), discover=False):
     """
     Setups a subscriber on the given ips in the local network for the given topics
     Args:
         topics(list(str)): the topics
         ips(list(str)|None): list of ips to connect to (if None connected to all possible ips)
+        raw_topics(iterable(str)): the topics of topics whose messages are received as bytes
+        discover(bool): if True the subscriber only connects to the publishers announced by beacons (ips is ignored)
     Returns: (Subscriber) the setup subscriber
     """
-    subscriber = Subscriber(None, None, topics)
-    ips = get_possible_network_ips() if ips is None else ips
-    ips_and_ports = [(ip, p) for ip in ips for p in PORT_RANGE]
-    subscriber.add_additional_ips(ips_and_ports)
+    subscriber = Subscriber(None, None, topics, raw_topics)
+    if not discover:
+        ips = get_possible_network_ips() if ips is None else ips
+        ips_and_ports = [(ip, p) for ip in ips for p in PORT_RANGE]
+        subscriber.add_additional_ips(ips_and_ports)
     subscriber.set_connection_timeout(CONNECTION_TIMEOUT)
+    if discover:
+        BeaconListener(subscriber.add_endpoint, BEACON_PORT).start()
     return subscriber
 
 
@@ -55,5 +62,8 @@ def setup_publisher():
     Returns: (Publisher) the setup publisher
     """
     _publisher = _setup_publisher(PORT_RANGE)
-    _publisher.send_alive_signal(CONNECTION_TIMEOUT // 2, PORT_RANGE)
+    alive_publisher = _publisher.send_alive_signal(CONNECTION_TIMEOUT // 2, PORT_RANGE)
+    if USE_BEACON_DISCOVERY:
+        BeaconBroadcaster([_publisher.pub_port, alive_publisher.pub_port], BEACON_PORT, BEACON_ADDRESS,
+                          BEACON_INTERVAL).start()
     return _publisher
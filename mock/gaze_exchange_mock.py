@@ -5,12 +5,17 @@ from numpy.random import rand
 
 from config import *
 from messaging.remote_gaze_position_stream import AbstractRemoteGazePositionStream, PyreRemoteGazePositionStream, \
-    SubscriberRemoteGazePositionStream
+    SubscriberRemoteGazePositionStream, RelayRemoteGazePositionStream, MulticastRemoteGazePositionStream, \
+    create_gaze_snapshot
+from messaging.async_remote_gaze_position_stream import AsyncRemoteGazePositionStream
 from view.ui_handler import map_position_between_screen_and_image
 
 
 class AbstractMockRemoteGazePositionStream(AbstractRemoteGazePositionStream, abc.ABC):
     """MockRemoteGazepositionStream adds mock positions to the received ones"""
+    changes_on_read = True
+    mock_reads = 0  # the number of snapshots read, added to the version as the mock positions change on every read
+
     @abc.abstractmethod
     def read_super_positions(self):
         """
@@ -18,11 +23,13 @@ class AbstractMockRemoteGazePositionStream(AbstractRemoteGazePositionStream, abc
         """
         pass
 
-    def read(self):
+    def read_snapshot(self):
         """
-        Reads the dictionary with the latest remote gaze positions and adds the mock positions
-        Returns: (dict(str, tuple(float, float))) the gaze positions
+        Reads the latest snapshot of the remote gaze positions and adds the mock positions
+        Returns: (GazeSnapshot) the snapshot
         """
+        snapshot = super().read_snapshot()
+        gazes = dict(zip(snapshot.sender_ids, map(tuple, snapshot.positions.tolist())))
         for i in range(MOCK_PLAYERS):
             if i < len(MOCK_POSITIONS):
                 pos = MOCK_POSITIONS[i]
@@ -35,15 +42,32 @@ class AbstractMockRemoteGazePositionStream(AbstractRemoteGazePositionStream, abc
             pos = map_position_between_screen_and_image(pos, (SCREEN_WIDTH, SCREEN_HEIGHT),
                                                         (IMAGE_WIDTH, IMAGE_HEIGHT), False)
             print("after", pos)
-            self.received_gaze_positions["Mock_{}".format(i)] = pos
-        return super().read()
+            gazes["Mock_{}".format(i)] = pos
+        self.mock_reads += 1
+        return create_gaze_snapshot(snapshot.version + self.mock_reads, gazes, snapshot.sent_times,
+                                    dict(zip(snapshot.sender_ids, snapshot.receive_times)), snapshot.expiry_time)
 
 
 class MockPyreRemoteGazePositionStream(PyreRemoteGazePositionStream, AbstractMockRemoteGazePositionStream):
     def read_super_positions(self):
-        return super(PyreRemoteGazePositionStream).read()
+        return super(MockPyreRemoteGazePositionStream, self).read()
 
 
 class MockSubscriberRemoteGazePositionStream(SubscriberRemoteGazePositionStream, AbstractMockRemoteGazePositionStream):
     def read_super_positions(self):
-        return super(SubscriberRemoteGazePositionStream).read()
+        return super(MockSubscriberRemoteGazePositionStream, self).read()
+
+
+class MockRelayRemoteGazePositionStream(RelayRemoteGazePositionStream, AbstractMockRemoteGazePositionStream):
+    def read_super_positions(self):
+        return super(MockRelayRemoteGazePositionStream, self).read()
+
+
+class MockAsyncRemoteGazePositionStream(AsyncRemoteGazePositionStream, AbstractMockRemoteGazePositionStream):
+    def read_super_positions(self):
+        return super(MockAsyncRemoteGazePositionStream, self).read()
+
+
+class MockMulticastRemoteGazePositionStream(MulticastRemoteGazePositionStream, AbstractMockRemoteGazePositionStream):
+    def read_super_positions(self):
+        return super(MockMulticastRemoteGazePositionStream, self).read()
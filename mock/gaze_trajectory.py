@@ -0,0 +1,75 @@
+import math
+
+import numpy as np
+
+# the gaze trajectory model (positions in relative screen coordinates, times in seconds)
+FIXATION_MEDIAN_DURATION = 0.25  # the fixation durations are lognormal distributed around it
+FIXATION_DURATION_SIGMA = 0.4
+FIXATION_NOISE = 0.003  # the standard deviation of the eye tracker noise during fixations
+SACCADE_AMPLITUDE = 0.2  # the standard deviation of the saccade amplitude per axis
+SACCADE_BASE_DURATION = 0.02  # the duration of a saccade is the base duration plus the amplitude times the rate
+SACCADE_DURATION_RATE = 0.1
+DROPOUT_PROBABILITY = 0.02  # the probability of a dropout (blink, looking away, lost pupil) after a fixation
+DROPOUT_DURATION_RANGE = (0.2, 2.0)
+
+FIXATION = 0
+SACCADE = 1
+DROPOUT = 2
+
+
+class GazeTrajectory:
+    def __init__(self, rng, start_time):
+        """
+        Simulates the gaze of a player: fixations with noise, saccades between them and dropouts in which
+        no gaze is tracked
+        Args:
+            rng(np.random.Generator): the random generator
+            start_time(float): the time the trajectory starts in seconds
+        """
+        self.rng = rng
+        self.state = FIXATION
+        self.position = rng.random(2)
+        self.saccade_start = self.position
+        self.state_start = start_time
+        self.state_end = start_time + self.fixation_duration()
+
+    def fixation_duration(self):
+        return self.rng.lognormal(math.log(FIXATION_MEDIAN_DURATION), FIXATION_DURATION_SIGMA)
+
+    def next_state(self):
+        """
+        Changes to the state following the current one
+        """
+        self.state_start = self.state_end
+        if self.state == FIXATION and self.rng.random() < DROPOUT_PROBABILITY:
+            self.state = DROPOUT
+            self.state_end += self.rng.uniform(*DROPOUT_DURATION_RANGE)
+        elif self.state == FIXATION:
+            self.state = SACCADE
+            self.saccade_start = self.position
+            self.position = np.clip(self.position + self.rng.normal(0, SACCADE_AMPLITUDE, 2), 0, 1)
+            amplitude = np.hypot(*(self.position - self.saccade_start))
+            self.state_end += SACCADE_BASE_DURATION + SACCADE_DURATION_RATE * amplitude
+        else:
+            if self.state == DROPOUT:
+                self.position = self.rng.random(2)
+            self.state = FIXATION
+            self.state_end += self.fixation_duration()
+
+    def position_at(self, current_time):
+        """
+        Args:
+            current_time(float): the current time in seconds (not before the last call)
+        Returns: (tuple(float, float)|None) the gaze at the time or None during a dropout
+        """
+        while current_time >= self.state_end:
+            self.next_state()
+        if self.state == DROPOUT:
+            return None
+        if self.state == SACCADE:
+            progress = (current_time - self.state_start) / (self.state_end - self.state_start)
+            eased_progress = (1 - math.cos(math.pi * progress)) / 2
+            position = self.saccade_start + (self.position - self.saccade_start) * eased_progress
+        else:
+            position = np.clip(self.position + self.rng.normal(0, FIXATION_NOISE, 2), 0, 1)
+        return float(position[0]), float(position[1])
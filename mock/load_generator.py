@@ -0,0 +1,204 @@
+import argparse
+import json
+import multiprocessing
+import time
+import uuid
+
+import numpy as np
+import psutil
+
+from config import *
+from messaging.gaze_exchange import SendPolicy
+from messaging.gaze_message import encode_gaze_message
+from messaging.latency import latency_monitor, STAGE_RECEIVE, PERCENTILES
+from messaging.multicast import create_multicast_sender
+from messaging.relay_hub import RelayHub
+from messaging.remote_gaze_position_stream import SubscriberRemoteGazePositionStream, \
+    RelayRemoteGazePositionStream, MulticastRemoteGazePositionStream, TOPIC_BINARY_GAZE_EXCHANGE
+from messaging.zmq_classes import Pusher
+from messaging.zmq_connection import PORT_RANGE, setup_publisher
+from mock.gaze_trajectory import GazeTrajectory
+
+TRANSPORTS = ["pubsub", "relay", "multicast"]
+
+
+def create_sender(transport, interface=MULTICAST_INTERFACE):
+    """
+    Creates the sending side of the transport as used by messaging.gaze_exchange
+    Args:
+        transport(str): one of TRANSPORTS
+        interface(str): the network interface of the multicast transport
+    Returns: (callable) sends a binary gaze message
+    """
+    if transport == "pubsub":
+        publisher = setup_publisher()
+        return lambda message: publisher.send_raw(TOPIC_BINARY_GAZE_EXCHANGE, message)
+    if transport == "relay":
+        return Pusher(RELAY_HUB_IP, RELAY_HUB_PULL_PORT).start().send_raw
+    sender = create_multicast_sender(interface, MULTICAST_TTL)
+    return lambda message: sender.sendto(message, (MULTICAST_GROUP, MULTICAST_PORT))
+
+
+def create_observer(transport, interface=MULTICAST_INTERFACE):
+    """
+    Creates the receiving stream of the transport
+    Args:
+        transport(str): one of TRANSPORTS
+        interface(str): the network interface of the multicast transport
+    Returns: (AbstractRemoteGazePositionStream) the not started stream
+    """
+    if transport == "pubsub":
+        return SubscriberRemoteGazePositionStream()
+    if transport == "relay":
+        return RelayRemoteGazePositionStream()
+    return MulticastRemoteGazePositionStream(interface=interface)
+
+
+def run_peers(transport, worker_index, number_of_peers, rate, start_time, duration, seed, use_send_policy,
+              interface, results):
+    """
+    Simulates the peers of one process, all sending with one socket of the transport
+    Args:
+        transport(str): one of TRANSPORTS
+        worker_index(int): the index of the process
+        number_of_peers(int): the number of simulated peers
+        rate(float): the rate the gazes are read from the simulated eye trackers in Hz
+        start_time(float): the time the peers start sending
+        duration(float): the time in seconds the peers send
+        seed(int): the seed of the trajectories
+        use_send_policy(bool): if the gazes are filtered by the SendPolicy as the real clients do
+        interface(str): the network interface of the multicast transport
+        results(multiprocessing.Queue): the queue the worker index, the number of sent gazes, the used cpu time
+        and the number of late ticks are put on when finished
+    """
+    send = create_sender(transport, interface)
+    rng = np.random.default_rng(seed + worker_index)
+    peer_ids = [uuid.uuid4().bytes for _ in range(number_of_peers)]
+    trajectories = [GazeTrajectory(rng, start_time) for _ in range(number_of_peers)]
+    send_policies = [SendPolicy() for _ in range(number_of_peers)] if use_send_policy else None
+    sequence_numbers = [0] * number_of_peers
+    sent_gazes = 0
+    late_ticks = 0
+    time.sleep(max(0.0, start_time - time.time()))
+    cpu_start = time.process_time()
+    tick = start_time
+    while tick < start_time + duration:
+        current_time = time.time()
+        for i, trajectory in enumerate(trajectories):
+            gaze = trajectory.position_at(current_time)
+            if gaze is None or (send_policies is not None and not send_policies[i].should_send(gaze, current_time)):
+                continue
+            sequence_numbers[i] += 1
+            send(encode_gaze_message(peer_ids[i], sequence_numbers[i], time.time(), gaze))
+            sent_gazes += 1
+        tick += 1 / rate
+        delay = tick - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            late_ticks += 1
+    results.put((worker_index, sent_gazes, time.process_time() - cpu_start, late_ticks))
+
+
+def run_load(transport, number_of_peers, processes=4, rate=1 / SEND_POLL_INTERVAL, duration=10,
+             warm_up=5, grace=1, seed=0, use_send_policy=True, interface=MULTICAST_INTERFACE, observer=None):
+    """
+    Runs the peers split across the processes and measures the receipt on the observing stream
+    Args:
+        transport(str): one of TRANSPORTS
+        number_of_peers(int): the number of simulated peers
+        processes(int): the number of processes the peers are split across
+        rate(float): the rate the gazes are read from the simulated eye trackers in Hz
+        duration(float): the time in seconds the peers send
+        warm_up(float): the time in seconds given to the processes to start and the subscriber to connect to them
+        grace(float): the time in seconds waited for late gazes after the peers finished
+        seed(int): the seed of the trajectories
+        use_send_policy(bool): if the gazes are filtered by the SendPolicy as the real clients do
+        interface(str): the network interface of the multicast transport
+        observer(AbstractRemoteGazePositionStream|None): a started observing stream of the transport or None to
+        create one
+    Returns: (dict) the results
+    """
+    if transport == "pubsub" and processes > len(PORT_RANGE) // 2:
+        raise ValueError("pubsub supports at most {} processes (a publisher and its alive publisher each use a port "
+                         "of PORT_RANGE)".format(len(PORT_RANGE) // 2))
+    observer = create_observer(transport, interface).start() if observer is None else observer
+    latency_monitor.reset()
+    spawn_context = multiprocessing.get_context("spawn")  # the zmq context of the observer must not be forked
+    results = spawn_context.Queue()
+    start_time = time.time() + warm_up
+    workers = [spawn_context.Process(target=run_peers, daemon=True, args=(
+        transport, i, len(range(i, number_of_peers, processes)), rate, start_time, duration, seed, use_send_policy,
+        interface, results)) for i in range(processes)]
+    for worker in workers:
+        worker.start()
+    time.sleep(max(0.0, start_time - time.time()))
+    latency_monitor.reset()  # gazes of earlier runs
+    observer_process = psutil.Process()
+    observer_process.cpu_percent()
+    time.sleep(duration + grace)
+    observer_cpu = observer_process.cpu_percent()
+    received = latency_monitor.merged_histogram(STAGE_RECEIVE)
+    worker_results = [results.get(timeout=duration + warm_up + 30) for _ in workers]
+    for worker in workers:
+        worker.join()
+    sent_gazes = sum(result[1] for result in worker_results)
+    return {"transport": transport, "peers": number_of_peers, "processes": processes, "rate": rate,
+            "duration": duration, "sent": sent_gazes, "received": received.count,
+            "throughput": received.count / duration, "loss": 1 - received.count / sent_gazes if sent_gazes else 0,
+            "latency": {"p{}".format(p): received.percentile(p) for p in PERCENTILES},
+            "observer_cpu": observer_cpu, "worker_cpu": sum(result[2] for result in worker_results) / duration,
+            "late_ticks": sum(result[3] for result in worker_results)}
+
+
+def run_relay_hub():
+    """
+    Runs a relay hub with the configured ports until the process is terminated
+    """
+    RelayHub().run()
+
+
+def print_result(result):
+    """
+    Prints the result of run_load
+    Args:
+        result(dict): the result
+    """
+    print("{transport}: {peers} peers in {processes} processes at {rate:.0f} Hz for {duration} s".format(**result))
+    print("  sent {} gazes, received {} ({:.0f}/s), loss {:.2%}{}".format(
+        result["sent"], result["received"], result["throughput"], result["loss"],
+        " (the relay hub keeps only the latest gaze per tick)" if result["transport"] == "relay" else ""))
+    print("  latency {}".format(", ".join("{} {:.1f} ms".format(p, value * 1000) if value is not None
+                                          else "{} -".format(p) for p, value in result["latency"].items())))
+    print("  cpu observer {:.0f}%, workers {:.0%} of a core in total, {} late ticks".format(
+        result["observer_cpu"], result["worker_cpu"], result["late_ticks"]))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Simulates many peers sending gazes over a real transport and "
+                                                 "measures the receipt on this node")
+    parser.add_argument("transport", type=str, choices=TRANSPORTS, help="the transport")
+    parser.add_argument("--peers", type=int, nargs="*", default=[10, 50, 100, 200, 400],
+                        help="the numbers of peers, each is run after another to find the scaling limit")
+    parser.add_argument("--processes", type=int, default=4, help="the number of processes the peers are split across")
+    parser.add_argument("--rate", type=float, default=1 / SEND_POLL_INTERVAL,
+                        help="the rate the gazes are read in Hz")
+    parser.add_argument("--duration", type=float, default=10, help="the measured time per run in s")
+    parser.add_argument("--warm-up", type=float, default=5, help="the time in s given to connect before each run")
+    parser.add_argument("--no-send-policy", action="store_true", help="send every read gaze")
+    parser.add_argument("--interface", type=str, default=MULTICAST_INTERFACE,
+                        help="the network interface of the multicast transport")
+    parser.add_argument("--start-hub", action="store_true", help="start a relay hub in a separate process")
+    parser.add_argument("--output", type=str, default=None, help="the file the results are appended to as json lines")
+    args = parser.parse_args()
+    if args.start_hub:
+        multiprocessing.get_context("spawn").Process(target=run_relay_hub, daemon=True).start()
+    observing_stream = create_observer(args.transport, args.interface).start()
+    for peers in args.peers:
+        load_result = run_load(args.transport, peers, args.processes, args.rate, args.duration,
+                               warm_up=args.warm_up, use_send_policy=not args.no_send_policy, interface=args.interface,
+                               observer=observing_stream)
+        print_result(load_result)
+        if args.output is not None:
+            with open(args.output, "a") as output:
+                output.write(json.dumps(load_result) + "\n")
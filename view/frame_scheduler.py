@@ -0,0 +1,82 @@
+import math
+import threading
+import time
+
+import pygame
+
+FRAME_READY_EVENT = pygame.USEREVENT + 1
+
+_frame_ready_pending = threading.Event()
+
+
+def notify_frame_ready():
+    """
+    Wakes the scheduler from any thread because a new frame was rendered,
+    only one event is queued until the scheduler handled it
+    """
+    if not _frame_ready_pending.is_set():
+        _frame_ready_pending.set()
+        pygame.event.post(pygame.event.Event(FRAME_READY_EVENT))
+
+
+class FrameScheduler:
+    def __init__(self):
+        """
+        Creates a scheduler which sleeps until the next input event or the deadline of the next periodic task
+        instead of polling
+        """
+        self.tasks = {}  # the task names with their next deadline, their interval and if they are enabled
+
+    def add_task(self, name, interval, enabled=True):
+        """
+        Adds a periodic task which is due first immediately and afterwards every interval seconds
+        Args:
+            name(str): the name of the task
+            interval(float): the interval in seconds
+            enabled(bool): if the task is enabled, disabled tasks are never due and do not wake the scheduler
+        """
+        self.tasks[name] = [time.monotonic(), interval, enabled]
+
+    def set_enabled(self, name, enabled):
+        """
+        Enables or disables a task, an enabled task whose deadline passed while it was disabled is due immediately
+        Args:
+            name(str): the name of the task
+            enabled(bool): if the task is enabled
+        """
+        self.tasks[name][2] = enabled
+
+    def wait(self):
+        """
+        Waits until at least one input event arrived or one task is due
+        Returns: (list(Event), list(str)) the events and the names of the due tasks
+        """
+        deadlines = [deadline for deadline, _, enabled in self.tasks.values() if enabled]
+        timeout = min(deadlines) - time.monotonic() if len(deadlines) > 0 else None
+        if timeout is None:
+            events = [pygame.event.wait()]
+        elif timeout > 0:
+            # round up, waking too early would only lead to a second wait
+            events = [pygame.event.wait(int(math.ceil(timeout * 1000)))]
+        else:
+            events = []
+        events = [event for event in events + pygame.event.get() if event.type != pygame.NOEVENT]
+        if any(event.type == FRAME_READY_EVENT for event in events):
+            _frame_ready_pending.clear()
+        return events, self._pop_due_tasks()
+
+    def _pop_due_tasks(self):
+        """
+        Returns the names of the due tasks and moves their deadlines forward by their interval,
+        deadlines which were missed completely are skipped instead of being caught up
+        """
+        current_time = time.monotonic()
+        due_tasks = []
+        for name, task in self.tasks.items():
+            deadline, interval, enabled = task
+            if not enabled or deadline > current_time:
+                continue
+            due_tasks.append(name)
+            deadline += interval
+            task[0] = deadline if deadline > current_time else current_time + interval
+        return due_tasks
@@ -68,6 +68,43 @@ def show_image(screen, image):
     pygame.display.update()
 
 
+class ImageDisplay:
+    def __init__(self, screen, image_shape):
+        """
+        Shows images of the same size centered on the screen by writing them into a persistent surface
+        Args:
+            screen(Screen): the pygame screen
+            image_shape(tuple): the shape of the shown images (width, height, 3) as used by surfarray
+        """
+        self.screen = screen
+        self.surface = pygame.Surface(image_shape[:2], depth=24)
+        width, height = screen.get_size()
+        self.x = (width - image_shape[0]) // 2
+        self.y = (height - image_shape[1]) // 2
+
+    def show(self, image, changed_region=None):
+        """
+        Shows the image on the screen, only the changed region is copied and updated on the display
+        Args:
+            image(ndarray): the image as contiguous numpy array in RGB
+            changed_region(tuple(slice, slice)|None): the region (of the array) which changed since the last shown
+            image, if None the whole image is shown
+        """
+        if changed_region is None:
+            pygame.surfarray.blit_array(self.surface, image)
+            self.screen.blit(self.surface, (self.x, self.y))
+            pygame.display.update(pygame.Rect(self.x, self.y, image.shape[0], image.shape[1]))
+            return
+        x_region, y_region = changed_region
+        pixels = pygame.surfarray.pixels3d(self.surface)
+        pixels[x_region, y_region] = image[x_region, y_region]
+        del pixels  # unlocks the surface
+        area = pygame.Rect(x_region.start, y_region.start, x_region.stop - x_region.start,
+                           y_region.stop - y_region.start)
+        self.screen.blit(self.surface, (self.x + area.x, self.y + area.y), area)
+        pygame.display.update(area.move(self.x, self.y))
+
+
 def draw_point_at_positions(screen, positions):
     """
     Draws a red dot at the positions
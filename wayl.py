@@ -1,5 +1,3 @@
-import time
-
 import cv2
 import numpy as np
 import pygame
@@ -8,11 +6,17 @@ from imutils import resize
 from config import *
 from eye_tracking.eye_tracking import start_gaze_stream_and_wait
 from eye_tracking.pupil_labs.start_pupil_capture import start_pupil_capture
-from fixation_layering.fixation_layering import filter_image_with_positions, calculate_gaussian_kernel, \
-    map_position_to_np_pixel
-from messaging.gaze_exchange import send_gaze, setup_gaze_exchange
-from view.ui_handler import initialise_screen, show_markers, show_calibration, show_image, \
-    map_position_between_screen_and_image, activate_total_fullscreen
+from fixation_layering.render_worker import RenderWorker
+from messaging.async_remote_gaze_position_stream import AsyncRemoteGazePositionStream
+from messaging import gaze_exchange
+from messaging.gaze_exchange import offer_gaze, setup_gaze_exchange, exchange_clock_sync
+from messaging.latency import latency_monitor, STAGE_DISPLAY
+from view.frame_scheduler import FrameScheduler, FRAME_READY_EVENT, notify_frame_ready
+from view.ui_handler import initialise_screen, show_markers, show_calibration, activate_total_fullscreen, \
+    ImageDisplay
+
+SEND_TASK = "send"
+CLOCK_SYNC_TASK = "clock_sync"
 
 
 def read_image():
@@ -23,63 +27,74 @@ def read_image():
     _image = cv2.imread(STIMULUS_PATH)
     _image = resize(_image, width=IMAGE_WIDTH)
     _image = cv2.cvtColor(_image, cv2.COLOR_BGR2RGB)
-    _image = np.rot90(_image)
+    _image = np.ascontiguousarray(np.rot90(_image))
     return _image
 
 
-def main_loop(_screen, _image, _gaze_stream):
-    show_image(screen, image)
-
-    filtered_image = _image.copy()
-    gaussian_kernel = calculate_gaussian_kernel(FIXATION_OVERLAY_SIGMA)
+def main_loop(_screen, _image, _gaze_stream, remote_positions_stream):
+    image_display = ImageDisplay(_screen, _image.shape)
+    image_display.show(_image)
 
-    remote_positions_stream = setup_gaze_exchange().start()
-    last_screen_update_time = 0
-    last_send_time = 0
+    render_worker = RenderWorker(_image, remote_positions_stream, _screen.get_size(), notify_frame_ready)
+    remote_positions_stream.on_gaze_received = render_worker.request_frame
+    if remote_positions_stream.stopped:  # not already started for the surface stream
+        remote_positions_stream.start()
+    render_worker.start()
+    scheduler = FrameScheduler()
+    scheduler.add_task(SEND_TASK, SEND_POLL_INTERVAL, enabled=_gaze_stream is not None)
+    # also without an eye tracker, so that observing computers answer the pings and measure their offsets
+    scheduler.add_task(CLOCK_SYNC_TASK, SEND_POLL_INTERVAL)
     while True:
-        event = pygame.event.poll()
-        if event.type == pygame.KEYUP and event.key == pygame.K_ESCAPE:
+        events, due_tasks = scheduler.wait()
+        if any(event.type == pygame.KEYUP and event.key == pygame.K_ESCAPE for event in events):
             # finish on escape clicked
+            render_worker.stop()
             remote_positions_stream.stop()
+            print("Rendered {} frames ({} late, {} dropped, {} skipped)".format(
+                render_worker.rendered_frames, render_worker.late_frames, render_worker.frame_buffer.dropped_frames,
+                render_worker.skipped_frames))
+            latency_monitor.print_report()
+            if gaze_exchange.send_policy is not None:
+                print("Sent {} gazes ({} suppressed)".format(gaze_exchange.send_policy.sent_gazes,
+                                                            gaze_exchange.send_policy.suppressed_gazes))
             if gaze_stream is not None:
                 gaze_stream.stopped = True
+            if gaze_exchange.session_recorder is not None:
+                gaze_exchange.session_recorder.close()
+                print("Recorded {} gaze events to {}".format(gaze_exchange.session_recorder.recorded_events,
+                                                             gaze_exchange.session_recorder.path))
             break
-        # only update after a given interval
-        current_time = time.time()
-        if current_time - last_screen_update_time < SCREEN_UPDATE_INTERVAL:
-            continue
-        last_screen_update_time = current_time
-        show_image(_screen, filtered_image)
-        fixations_on_screen = remote_positions_stream.read_list()
-        fixations_on_image = [
-            map_position_to_np_pixel(
-                map_position_between_screen_and_image(pos, _screen.get_size(), image.shape[:2], True),
-                image
-            ) for pos in fixations_on_screen
-        ]
-        fixations_on_image_not_none = [fix for fix in fixations_on_image if fix is not None]
-        # print("fixation", fixations_on_image)
-        filtered_image = filter_image_with_positions(image, fixations_on_image_not_none, gaussian_kernel)
+        if any(event.type == FRAME_READY_EVENT for event in events):
+            with render_worker.frame_buffer.latest() as (filtered_image, changed_region, sent_times):
+                if filtered_image is not None and changed_region is not None:
+                    image_display.show(filtered_image, changed_region)
+                    latency_monitor.record_stage(STAGE_DISPLAY, sent_times)
+        if SEND_TASK in due_tasks:
+            # read position in pygame coordinates
+            position = gaze_stream.read_position() if gaze_stream is not None else None
+            if position is not None:
+                offer_gaze(position, recorded_time=gaze_stream.surface_gaze_time)
+        if CLOCK_SYNC_TASK in due_tasks:
+            exchange_clock_sync()
 
-        if current_time - last_send_time < SEND_INTERVAL:
-            continue
-        last_send_time = current_time
-        # read position in pygame coordinates
-        position = gaze_stream.read_position() if gaze_stream is not None else None
-        print(position)
-        if position is not None:
-            send_gaze(position)
 
-
-def prepare_gaze_reading():
+def prepare_gaze_reading(remote_positions_stream):
     if TURN_OFF_EYE_TRACKING:
         return None
     show_markers(screen)
-    return start_gaze_stream_and_wait(EYE_TRACKING_IP, EYE_TRACKING_PORT, EYE_TRACKING_SURFACE_NAME)
+    runtime = None
+    if isinstance(remote_positions_stream, AsyncRemoteGazePositionStream):
+        # the surface data is received on the event loop of the gaze exchange
+        runtime = remote_positions_stream.start()
+    return start_gaze_stream_and_wait(EYE_TRACKING_IP, EYE_TRACKING_PORT, EYE_TRACKING_SURFACE_NAME, runtime,
+                                      gaze_exchange.session_recorder)
 
 
 if __name__ == '__main__':
-    if not TURN_OFF_EYE_TRACKING:
+    if not TURN_OFF_EYE_TRACKING and SIMULATE_EYE_TRACKER:
+        from eye_tracking.pupil_capture_simulator import PupilCaptureSimulator
+        PupilCaptureSimulator().start()
+    elif not TURN_OFF_EYE_TRACKING:
         start_pupil_capture()
     screen = initialise_screen()
     if not TURN_OFF_EYE_TRACKING:
@@ -88,7 +103,8 @@ if __name__ == '__main__':
         activate_total_fullscreen(screen)
         pass
     image = read_image()
-    gaze_stream = prepare_gaze_reading()
-    main_loop(screen, image, gaze_stream)
+    remote_gaze_position_stream = setup_gaze_exchange()
+    gaze_stream = prepare_gaze_reading(remote_gaze_position_stream)
+    main_loop(screen, image, gaze_stream, remote_gaze_position_stream)
     pygame.display.quit()
     pygame.quit()